@@ -0,0 +1,248 @@
+# fake_stash.py
+
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PLACEHOLDER_SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="640" height="360"><rect width="100%" height="100%"/></svg>'
+OPERATION_RE = re.compile(r'\b(findScenes|bulkSceneUpdate|sceneUpdate|fileSetFingerprints|version|configuration|__schema)\b')
+SCREENSHOT_RE = re.compile(r'^/scene/(\d+)/screenshot')
+
+
+def now():
+    return datetime.now(timezone.utc).astimezone().isoformat(timespec='seconds')
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class FakeStash:
+    """
+    In-memory stand-in for the parts of Stash's API this node uses: findScenes with
+    the filters stash_utils, lease_manager and discovery build, bulkSceneUpdate,
+    sceneUpdate, (aliased) fileSetFingerprints and screenshot downloads, plus the
+    version/configuration/introspection queries stashapi sends when it connects.
+
+    Every request is counted per operation so a benchmark can report API round trips.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.lock = threading.Lock()
+        self.scenes = {}
+        self.calls = Counter()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def load(self, media, stash_root):
+        """
+        One scene per synthetic file, at stash_root/<file name>, with no phash,
+        no tags and no cover.
+        """
+        with self.lock:
+            self.scenes = {}
+            for index, item in enumerate(media, start=1):
+                created = now()
+                self.scenes[str(index)] = {
+                    "id": str(index),
+                    "created_at": created,
+                    "updated_at": created,
+                    "tags": set(),
+                    "cover": False,
+                    "file": {
+                        "id": str(1000 + index),
+                        "path": stash_root + item["path"].replace("\\", "/").rsplit("/", 1)[-1],
+                        "size": item["size"],
+                        "duration": item["duration"],
+                        "width": item["width"],
+                        "height": item["height"],
+                        "video_codec": item["video_codec"],
+                        "audio_codec": item["audio_codec"],
+                        "frame_rate": item["frame_rate"],
+                        "fingerprints": [{"type": "oshash", "value": item["oshash"]}],
+                    },
+                }
+
+    def reset_counters(self):
+        with self.lock:
+            counts = dict(self.calls)
+            self.calls.clear()
+        return counts
+
+    def phashes(self):
+        with self.lock:
+            return {
+                scene_id: next((fp["value"] for fp in scene["file"]["fingerprints"] if fp["type"] == "phash"), None)
+                for scene_id, scene in self.scenes.items()
+            }
+
+    def scene_json(self, scene):
+        return {
+            "id": scene["id"],
+            "created_at": scene["created_at"],
+            "updated_at": scene["updated_at"],
+            "files": [dict(scene["file"], fingerprints=list(scene["file"]["fingerprints"]))],
+            "tags": [{"id": tag_id} for tag_id in sorted(scene["tags"])],
+            "paths": {"screenshot": f"http://{self.host}:{self.port}/scene/{scene['id']}/screenshot"},
+        }
+
+    def matches(self, scene, scene_filter):
+        for key, criterion in (scene_filter or {}).items():
+            if key == "AND":
+                if not self.matches(scene, criterion):
+                    return False
+            elif key == "phash":
+                has_phash = any(fp["type"] == "phash" for fp in scene["file"]["fingerprints"])
+                if has_phash == (criterion["modifier"] == "IS_NULL"):
+                    return False
+            elif key == "tags":
+                wanted = {str(tag_id) for tag_id in criterion["value"]}
+                tagged = bool(wanted & scene["tags"])
+                if tagged != (criterion["modifier"] == "INCLUDES"):
+                    return False
+            elif key == "path":
+                inside = criterion["value"] in scene["file"]["path"]
+                if inside != (criterion["modifier"] == "INCLUDES"):
+                    return False
+            elif key == "is_missing":
+                if criterion == "cover" and scene["cover"]:
+                    return False
+            elif key in ("created_at", "updated_at"):
+                value, limit = parse_time(scene[key]), parse_time(criterion["value"])
+                if criterion["modifier"] == "LESS_THAN" and not value < limit:
+                    return False
+                if criterion["modifier"] == "GREATER_THAN" and not value > limit:
+                    return False
+        return True
+
+    def find_scenes(self, variables):
+        find_filter = variables.get("filter") or {}
+        scene_ids = variables.get("scene_ids")
+        with self.lock:
+            scenes = [s for s in self.scenes.values() if self.matches(s, variables.get("scene_filter"))]
+            if scene_ids:
+                wanted = {str(scene_id) for scene_id in scene_ids}
+                scenes = [s for s in scenes if s["id"] in wanted]
+            sort = find_filter.get("sort", "id")
+            scenes.sort(key=lambda s: (s.get(sort, ""), int(s["id"])), reverse=find_filter.get("direction") == "DESC")
+            count = len(scenes)
+            per_page = find_filter.get("per_page", 25)
+            if per_page and per_page > 0:
+                start = (find_filter.get("page", 1) - 1) * per_page
+                scenes = scenes[start:start + per_page]
+            return {"count": count, "scenes": [self.scene_json(s) for s in scenes]}
+
+    def update_scenes(self, update):
+        with self.lock:
+            ids = [str(scene_id) for scene_id in update.get("ids", [update.get("id")])]
+            tag_update = update.get("tag_ids")
+            for scene_id in ids:
+                scene = self.scenes[scene_id]
+                if isinstance(tag_update, dict):
+                    tags = {str(tag_id) for tag_id in tag_update["ids"]}
+                    if tag_update["mode"] == "ADD":
+                        scene["tags"] |= tags
+                    elif tag_update["mode"] == "REMOVE":
+                        scene["tags"] -= tags
+                    else:
+                        scene["tags"] = tags
+                if update.get("cover_image"):
+                    scene["cover"] = True
+                scene["updated_at"] = now()
+            return [{"id": scene_id} for scene_id in ids]
+
+    def set_fingerprints(self, fingerprint_input):
+        with self.lock:
+            for scene in self.scenes.values():
+                if scene["file"]["id"] == str(fingerprint_input["id"]):
+                    types = {fp["type"] for fp in fingerprint_input["fingerprints"]}
+                    scene["file"]["fingerprints"] = [
+                        fp for fp in scene["file"]["fingerprints"] if fp["type"] not in types
+                    ] + fingerprint_input["fingerprints"]
+                    return True
+        return False
+
+    def graphql(self, query, variables):
+        operations = set(OPERATION_RE.findall(query))
+        with self.lock:
+            for operation in operations:
+                self.calls[operation] += 1
+            self.calls["requests"] += 1
+
+        if "__schema" in operations:
+            return {"__schema": {"types": []}}
+        if "version" in operations and "configuration" not in operations:
+            return {"version": {"version": "v0.28.0", "hash": "benchmark", "build_time": ""}}
+        if "configuration" in operations:
+            return {"configuration": {"general": {"apiKey": ""}}}
+        if "findScenes" in operations:
+            return {"findScenes": self.find_scenes(variables)}
+        if "bulkSceneUpdate" in operations:
+            return {"bulkSceneUpdate": self.update_scenes(variables["input"])}
+        if "sceneUpdate" in operations:
+            return {"sceneUpdate": self.update_scenes(variables["input"])[0]}
+        if "fileSetFingerprints" in operations:
+            # Either stashapi's single $input or stash_utils' aliased $input0..$inputN
+            aliases = re.findall(r'(\w+)\s*:\s*fileSetFingerprints\(input:\s*\$(\w+)\)', query)
+            if aliases:
+                with self.lock:
+                    self.calls["fileSetFingerprints"] += len(aliases) - 1
+                return {alias: self.set_fingerprints(variables[name]) for alias, name in aliases}
+            return {"fileSetFingerprints": self.set_fingerprints(variables["input"])}
+        raise ValueError(f"Unsupported query: {query[:200]}")
+
+    def handler_class(self):
+        stash = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                try:
+                    body = {"data": stash.graphql(request["query"], request.get("variables") or {})}
+                except Exception as e:
+                    body = {"data": None, "errors": [{"message": str(e)}]}
+                self.send(200, json.dumps(body).encode(), "application/json")
+
+            def do_GET(self):
+                match = SCREENSHOT_RE.match(self.path)
+                if not match:
+                    self.send(404, b"", "text/plain")
+                    return
+                with stash.lock:
+                    stash.calls["screenshot"] += 1
+                    scene = stash.scenes.get(match.group(1))
+                    has_cover = bool(scene and scene["cover"])
+                if has_cover:
+                    self.send(200, b"\xff\xd8\xff\xe0" + b"\0" * 4096, "image/jpeg")
+                else:
+                    self.send(200, PLACEHOLDER_SVG, "image/svg+xml")
+
+            do_HEAD = do_GET
+
+        return Handler
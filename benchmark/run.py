@@ -0,0 +1,401 @@
+# run.py
+
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no rusage, bytes read are reported as None
+    resource = None
+
+import config
+from benchmark.fake_stash import FakeStash
+from benchmark.synthetic_media import generate_media
+
+STASH_ROOT = "/benchmark/"
+
+
+class Recorder:
+    """
+    Collects what a benchmark run costs: wall time per stage (by wrapping the stage
+    functions), ffmpeg/ffprobe/videohashes launches (by counting subprocess.Popen)
+    and, from the OS, CPU time and blocks read for this process and its children.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.spawns = {}
+
+    def add_stage(self, stage, seconds):
+        with self.lock:
+            count, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds)
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+        recorder = self
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                recorder.add_stage(stage, time.perf_counter() - started)
+
+        setattr(owner, name, timed)
+
+    def count_spawns(self):
+        recorder = self
+
+        class CountingPopen(subprocess.Popen):
+            def __init__(self, args, *rest, **kwargs):
+                program = os.path.basename(str(args[0] if isinstance(args, (list, tuple)) else args).split()[0])
+                with recorder.lock:
+                    recorder.spawns[program] = recorder.spawns.get(program, 0) + 1
+                super().__init__(args, *rest, **kwargs)
+
+        # subprocess.run looks Popen up at call time, so this covers every launch
+        subprocess.Popen = CountingPopen
+
+    def snapshot(self, stash):
+        times = os.times()
+        blocks = None
+        if resource:
+            blocks = sum(resource.getrusage(who).ru_inblock for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+        with self.lock:
+            stages = dict(self.stages)
+            spawns = dict(self.spawns)
+        with stash.lock:
+            calls = dict(stash.calls)
+        return {
+            "wall": time.perf_counter(),
+            "cpu": times.user + times.system,
+            "children_cpu": times.children_user + times.children_system,
+            "blocks": blocks,
+            "stages": stages,
+            "spawns": spawns,
+            "calls": calls,
+        }
+
+    def diff(self, before, after):
+        def counter_diff(a, b):
+            return {key: b[key] - a.get(key, 0) for key in b if b[key] - a.get(key, 0)}
+
+        stages = {}
+        for stage, (count, total) in after["stages"].items():
+            old_count, old_total = before["stages"].get(stage, (0, 0.0))
+            if count > old_count:
+                stages[stage] = {"calls": count - old_count, "wall": round(total - old_total, 4)}
+        spawns = counter_diff(before["spawns"], after["spawns"])
+        calls = counter_diff(before["calls"], after["calls"])
+        return {
+            "wall": round(after["wall"] - before["wall"], 4),
+            "cpu": round(after["cpu"] - before["cpu"], 4),
+            "children_cpu": round(after["children_cpu"] - before["children_cpu"], 4),
+            # ru_inblock counts 512-byte blocks that missed the page cache
+            "bytes_read": (after["blocks"] - before["blocks"]) * 512 if resource else None,
+            "process_spawns": sum(spawns.values()),
+            "spawns_by_program": spawns,
+            "api_round_trips": calls.pop("requests", 0) + calls.get("screenshot", 0),
+            "api_calls": calls,
+            "stages": stages,
+        }
+
+
+def configure(args, workdir, media_dir, stash):
+    # Must run before any helpers module is imported: several bind config values at import
+    config.stash_scheme = "http"
+    config.stash_host = stash.host
+    config.stash_port = stash.port
+    config.stash_api_key = ""
+    config.hashing_tag, config.hashing_error_tag, config.cover_error_tag = 1, 2, 3
+    config.ffmpeg = args.ffmpeg
+    config.ffprobe = args.ffprobe
+    config.preview_encoder = args.preview_encoder
+    config.hwaccel = args.hwaccel
+    config.phash_engine = args.phash_engine
+    # Measured in the working dir so a benchmark never reuses the node's own results
+    config.encoder_calibration_path = os.path.join(workdir, "encoder_calibration.json")
+    config.sprite_path = os.path.join(workdir, "vtt")
+    config.preview_path = os.path.join(workdir, "screenshots")
+    config.translations = [{'orig': STASH_ROOT, 'local': media_dir + os.sep}]
+    config.excluded_paths = []
+    config.result_cache_path = ""
+    config.duplicate_index_path = ""
+    config.spool_path = os.path.join(workdir, "update_spool.jsonl")
+    config.spool_dead_letter_path = os.path.join(workdir, "update_spool.failed.jsonl")
+    # Rates learned in one run would reorder the next; every run starts from the defaults
+    config.cost_model_path = ""
+    config.per_page = args.batch_size
+    config.max_workers = args.max_workers
+    config.generate_sprite = True
+    config.generate_preview = True
+    config.verbose = args.verbose
+    config.dry_run = False
+    config.once = False
+    if args.auto_interval:
+        config.auto_interval = args.auto_interval
+    if os.path.exists(config.spool_path):
+        os.remove(config.spool_path)
+
+
+def reset(stash, media, workdir):
+    from helpers import media_info, stash_utils
+
+    stash.load(media, STASH_ROOT)
+    for folder in (config.sprite_path, config.preview_path):
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+    media_info._memo.clear()
+    stash_utils._scene_count.update({"value": None, "fetched": 0.0})
+    for entry in os.listdir(workdir):
+        if entry.startswith("single_pass_temp_"):
+            shutil.rmtree(os.path.join(workdir, entry), ignore_errors=True)
+
+
+def install_stage_timers(recorder):
+    import phash_videohasher_main
+    from helpers import scene_processor, stash_utils
+    from helpers.lease_manager import LeaseManager
+    from helpers.media_info import MediaInfo
+    from helpers.preview_video_generator import PreviewVideoGenerator
+    from helpers.video_sprite_generator import VideoSpriteGenerator
+
+    recorder.wrap(phash_videohasher_main, "discover_scenes", "discovery")
+    recorder.wrap(LeaseManager, "claim", "claim")
+    recorder.wrap(scene_processor, "get_media_info", "probe")
+    recorder.wrap(MediaInfo, "keyframe_times", "keyframe_scan")
+    recorder.wrap(scene_processor, "screenshot_is_placeholder", "cover_check")
+    recorder.wrap(scene_processor, "run_single_pass", "single_pass")
+    recorder.wrap(scene_processor, "compute_scene_phash", "phash")
+    recorder.wrap(scene_processor, "extract_cover", "cover")
+    recorder.wrap(VideoSpriteGenerator, "generate_sprite", "sprite")
+    recorder.wrap(VideoSpriteGenerator, "create_sprite_from_frames", "sprite")
+    recorder.wrap(PreviewVideoGenerator, "generate_preview", "preview")
+    recorder.wrap(scene_processor, "update_phash", "stash_update")
+    recorder.wrap(scene_processor, "update_cover", "stash_update")
+    if stash_utils.spool:
+        recorder.wrap(stash_utils.spool, "replay", "stash_update")
+
+
+def run_process_scene(stash, recorder):
+    """
+    process_scene on every scene in turn, as one worker would, then the Stash updates
+    it queued. Also records each scene separately.
+    """
+    from helpers.scene_discovery import mark_missing_covers
+    from helpers.scene_processor import process_scene
+    from helpers.stash_utils import flush_tag_updates
+
+    start = recorder.snapshot(stash)
+    scenes = stash.find_scenes({"filter": {"per_page": -1, "sort": "id"}})["scenes"]
+    mark_missing_covers(scenes)
+    per_scene = []
+    for index, scene in enumerate(scenes, start=1):
+        before = recorder.snapshot(stash)
+        process_scene(scene, index, len(scenes))
+        result = recorder.diff(before, recorder.snapshot(stash))
+        result["file"] = os.path.basename(scene["files"][0]["path"])
+        result["size"] = scene["files"][0]["size"]
+        result["duration"] = scene["files"][0]["duration"]
+        per_scene.append(result)
+    flush_tag_updates()
+    result = recorder.diff(start, recorder.snapshot(stash))
+    result["scenes"] = per_scene
+    return result
+
+
+def run_main_loop(stash, recorder, args):
+    """
+    The whole node: discovery, leases, the worker pool and the spool, until no
+    unhashed scene is left.
+    """
+    import phash_videohasher_main
+
+    argv = sys.argv
+    sys.argv = ["phash_videohasher_main.py", "--generate-sprite", "--generate-preview",
+                "--batch-size", str(args.batch_size), "--max-workers", str(args.max_workers)]
+    if args.verbose:
+        sys.argv.append("--verbose")
+    if args.auto_concurrency:
+        sys.argv.append("--auto-concurrency")
+    if args.scheduling:
+        sys.argv += ["--scheduling", args.scheduling]
+    if args.engine:
+        sys.argv += ["--engine", args.engine]
+    start = recorder.snapshot(stash)
+    try:
+        phash_videohasher_main.main()
+    finally:
+        sys.argv = argv
+    return recorder.diff(start, recorder.snapshot(stash))
+
+
+def ffmpeg_version(ffmpeg):
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return result.stdout.decode(errors='replace').splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def run(args):
+    workdir = os.path.abspath(args.workdir)
+    media_dir = os.path.join(workdir, "media")
+    output = os.path.abspath(args.output or os.path.join("benchmark_results", time.strftime("%Y%m%d-%H%M%S") + ".json"))
+    media = generate_media(media_dir, args.ffmpeg, quick=args.quick, profiles=args.profile)
+    if not media:
+        print("🚫 No synthetic media could be created")
+        return 1
+
+    stash = FakeStash().start()
+    configure(args, workdir, media_dir, stash)
+    recorder = Recorder()
+    recorder.count_spawns()
+    install_stage_timers(recorder)
+    from helpers.encoder_calibration import encoders
+    encoders.configure(args.ffmpeg)
+
+    results = {
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": {
+            "node": platform.node(),
+            "system": platform.platform(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "ffmpeg": ffmpeg_version(args.ffmpeg),
+        },
+        "settings": {
+            "max_workers": config.max_workers,
+            "batch_size": config.per_page,
+            "decode_slots": config.decode_slots,
+            "encoder_sessions": config.encoder_sessions,
+            "mount_read_slots": config.mount_read_slots,
+            "interleave_mounts": config.interleave_mounts,
+            "single_pass": config.single_pass,
+            "phash_engine": config.phash_engine,
+            "sprite_seek_mode": config.sprite_seek_mode,
+            "preview_encoder": config.preview_encoder,
+            "hwaccel": config.hwaccel,
+            "preview_codec_args": encoders.codec_args(),
+            "sprite_decode_args": encoders.decode_args(),
+            "auto_concurrency": args.auto_concurrency,
+            "scheduling": args.scheduling or config.scheduling_policy,
+            "engine": args.engine or config.engine,
+        },
+        "media": [{key: item[key] for key in item if key != "path"} for item in media],
+        "scenarios": {},
+    }
+
+    cwd = os.getcwd()
+    os.chdir(workdir)  # temp dirs are created in the working directory
+    try:
+        for scenario in args.scenario:
+            reset(stash, media, workdir)
+            print(f"⏱️ Running {scenario} on {len(media)} files")
+            if scenario == "process_scene":
+                result = run_process_scene(stash, recorder)
+            else:
+                result = run_main_loop(stash, recorder, args)
+            hashed = sum(1 for phash in stash.phashes().values() if phash)
+            result["scenes_hashed"] = hashed
+            result["scenes_per_hour"] = round(hashed * 3600 / result["wall"], 1) if result["wall"] else None
+            results["scenarios"][scenario] = result
+            print(f"✅ {scenario}: {result['wall']:.1f}s, {hashed}/{len(media)} hashed, "
+                  f"{result['process_spawns']} processes, {result['api_round_trips']} API round trips")
+    finally:
+        os.chdir(cwd)
+        stash.stop()
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {output}")
+    return 0
+
+
+def compare(args):
+    """
+    Prints the change per scenario and stage between two result files and returns 1
+    when anything got slower (or more expensive) than the threshold allows.
+    """
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for scenario, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(scenario)
+        if not old:
+            continue
+        print(f"📊 {scenario}")
+        metrics = [(metric, old.get(metric), new.get(metric))
+                   for metric in ("wall", "cpu", "children_cpu", "bytes_read", "process_spawns", "api_round_trips")]
+        for stage in sorted(set(old["stages"]) | set(new["stages"])):
+            metrics.append((f"stage {stage}", old["stages"].get(stage, {}).get("wall"), new["stages"].get(stage, {}).get("wall")))
+        for metric, before, after in metrics:
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+            worse = change > args.threshold and after - before > args.min_delta
+            regressions += worse
+            print(f"  {'❌' if worse else '  '} {metric:<24} {before:>12.3f} → {after:>12.3f} ({change:+.1%})")
+
+    if regressions:
+        print(f"❌ {regressions} metrics regressed by more than {args.threshold:.0%}")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the node against synthetic media and a local Stash stand-in")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="Create the test media if needed, run the scenarios and save the results")
+    bench.add_argument("--workdir", default="benchmark_work", help="Media, artifacts and temp files (default: benchmark_work)")
+    bench.add_argument("--output", help="Result file (default: benchmark_results/<timestamp>.json)")
+    bench.add_argument("--quick", action="store_true", help="Only the short test videos")
+    bench.add_argument("--profile", action="append", help="Only this media profile (repeatable)")
+    bench.add_argument("--scenario", action="append", choices=["process_scene", "main_loop"],
+                       help="Scenario to run (repeatable, default: both)")
+    bench.add_argument("--max-workers", type=int, default=config.max_workers)
+    bench.add_argument("--batch-size", type=int, default=config.per_page)
+    bench.add_argument("--ffmpeg", default=shutil.which("ffmpeg") or config.ffmpeg)
+    bench.add_argument("--ffprobe", default=shutil.which("ffprobe") or config.ffprobe)
+    bench.add_argument("--auto-concurrency", action="store_true", help="Run the main loop with the adaptive concurrency controller")
+    bench.add_argument("--auto-interval", type=int, help="Seconds between controller adjustments (default: config.auto_interval)")
+    bench.add_argument("--scheduling", choices=["fifo", "sjf", "lpt", "fair"], help="Scene order of the main loop (default: config.scheduling_policy)")
+    bench.add_argument("--engine", choices=["threads", "async"], help="Engine of the main loop (default: config.engine)")
+    bench.add_argument("--preview-encoder", default="libx264", help="Preview encoder, or auto to calibrate (default: libx264, comparable across hosts)")
+    bench.add_argument("--hwaccel", default="none", help="Sprite decoder, or auto to calibrate (default: none)")
+    bench.add_argument("--phash-engine", choices=["native", "binary"], default="native",
+                       help="Phash engine (default: native, which needs no videohashes binary)")
+    bench.add_argument("--verbose", action="store_true")
+
+    diff = commands.add_parser("compare", help="Compare two result files and flag regressions")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--threshold", type=float, default=0.10, help="Relative increase counted as a regression (default: 0.10)")
+    diff.add_argument("--min-delta", type=float, default=0.05, help="Ignore absolute changes up to this size (default: 0.05)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        args.scenario = args.scenario or ["process_scene", "main_loop"]
+        return run(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# synthetic_media.py
+
+import hashlib
+import json
+import os
+import struct
+import subprocess
+
+# name, encoder, codec name as ffprobe/Stash report it, width, height, seconds, fps, gop (frames), audio
+PROFILES = [
+    ("h264_sd_short", "libx264", "h264", 640, 360, 20, 30, 30, True),
+    ("h264_hd", "libx264", "h264", 1280, 720, 120, 30, 250, True),
+    ("hevc_fhd", "libx265", "hevc", 1920, 1080, 60, 25, 250, False),
+    ("mpeg4_sd", "mpeg4", "mpeg4", 854, 480, 90, 30, 300, True),
+    ("h264_long", "libx264", "h264", 960, 540, 600, 24, 240, False),
+]
+
+QUICK_PROFILES = ["h264_sd_short", "hevc_fhd", "mpeg4_sd"]
+
+
+def available_encoders(ffmpeg):
+    result = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    encoders = set()
+    for line in result.stdout.decode(errors='replace').splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6:
+            encoders.add(parts[1])
+    return encoders
+
+
+def oshash(path):
+    # Stash/OpenSubtitles hash: file size plus the 64-bit little-endian word sums of the first and last 64 KiB
+    size = os.path.getsize(path)
+    chunk = 64 * 1024
+    value = size
+    with open(path, 'rb') as f:
+        head = f.read(chunk)
+        f.seek(max(0, size - chunk))
+        tail = f.read(chunk)
+    for block in (head, tail):
+        block = block[:len(block) - len(block) % 8]
+        value += sum(struct.unpack(f'<{len(block) // 8}Q', block))
+    return format(value & 0xFFFFFFFFFFFFFFFF, '016x')
+
+
+def build_command(ffmpeg, path, encoder, width, height, seconds, fps, gop, audio):
+    # testsrc2 and sine are deterministic, and bitexact keeps encoder banners out of the file
+    command = [
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={seconds}',
+    ]
+    if audio:
+        command += ['-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={seconds}']
+    command += ['-map', '0:v', '-c:v', encoder, '-g', str(gop), '-pix_fmt', 'yuv420p']
+    if encoder in ('libx264', 'libx265'):
+        command += ['-preset', 'veryfast', '-threads', '1']
+    if encoder == 'libx265':
+        command += ['-x265-params', 'log-level=error:pools=1']
+    if encoder == 'mpeg4':
+        command += ['-q:v', '5']
+    if audio:
+        command += ['-map', '1:a', '-c:a', 'aac', '-b:a', '96k']
+    command += ['-fflags', '+bitexact', '-flags:v', '+bitexact', '-map_metadata', '-1', path]
+    return command
+
+
+def generate_media(media_dir, ffmpeg='ffmpeg', quick=False, profiles=None):
+    """
+    Creates the synthetic test videos (reusing ones already there) and returns one
+    dict per file with the fields Stash would report for it. Profiles whose encoder
+    this ffmpeg lacks are skipped.
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    encoders = available_encoders(ffmpeg)
+    wanted = profiles or (QUICK_PROFILES if quick else [p[0] for p in PROFILES])
+
+    media = []
+    for name, encoder, codec, width, height, seconds, fps, gop, audio in PROFILES:
+        if name not in wanted:
+            continue
+        if encoder not in encoders:
+            print(f"⏭️ Skipping {name}, ffmpeg has no {encoder} encoder")
+            continue
+
+        command = build_command(ffmpeg, '{path}', encoder, width, height, seconds, fps, gop, audio)
+        # The parameters are part of the name, so changing a profile never reuses a stale file
+        digest = hashlib.sha1(json.dumps(command[1:]).encode()).hexdigest()[:8]
+        path = os.path.join(media_dir, f"{name}_{digest}.mp4")
+        if not os.path.exists(path):
+            print(f"🎬 Creating {os.path.basename(path)} ({encoder}, {width}x{height}, {seconds}s)")
+            temp_path = path + '.part.mp4'
+            subprocess.run(build_command(ffmpeg, temp_path, encoder, width, height, seconds, fps, gop, audio), check=True)
+            os.replace(temp_path, path)
+
+        media.append({
+            "name": name,
+            "path": path,
+            "size": os.path.getsize(path),
+            "oshash": oshash(path),
+            "duration": float(seconds),
+            "width": width,
+            "height": height,
+            "video_codec": codec,
+            "audio_codec": "aac" if audio else "",
+            "frame_rate": float(fps),
+        })
+    return media
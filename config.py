@@ -11,6 +11,9 @@ stash_api_key = ""  # Set your Stash API key here (Settings → Security → API
 
 windows = platform.system() == "Windows"
 
+# #️⃣ Perceptual hash engine
+phash_engine = "binary"  # --phash-engine: "binary" (videohashes) or "native" (in-process NumPy, no extra decode; checked against videohashes by tests/test_phash.py)
+
 # 📁 External tool paths
 binary_windows = r".\bin\videohashes-windows.exe"
 binary_linux = r"./videohashes-linux-amd64"
@@ -29,12 +32,98 @@ cover_error_tag = 0    # Stash tag ID for "Cover Error"
 
 # 🔢 Batch size for scene processing
 per_page = 25  # --batch-size: Number of scenes to process per run (default: 25)
+scene_count_ttl = 300  # Seconds to reuse the remaining-scene count before asking Stash again
+tag_flush_interval = 2  # Seconds to collect tag changes before sending them as one bulk update
+
+# 🔒 Work leases: claimed scenes are renewed every lease_ttl/3 seconds while processing.
+# Scenes tagged "In Process" without a renewal for lease_ttl seconds are returned to the pool.
+# Stash sets updated_at with its own clock, so keep the TTL well above any clock skew between nodes.
+lease_ttl = 900  # --lease-ttl: Seconds a claim stays valid without a heartbeat
+lease_sweep_interval = 300  # Seconds between sweeps for expired leases
+
+# 💾 Local result cache (phash, duration, artifacts written) so re-queued scenes aren't decoded again
+result_cache_path = "result_cache.sqlite3"  # Set to "" to disable; inspect with: python -m helpers.result_cache stats
+result_cache_max_entries = 100000
+result_cache_max_age_days = 90
+
+# 👯 Duplicate index: oshash → phash and artifacts of every file this node hashed, with a phash near-duplicate lookup.
+# Copies of a known file reuse its phash (their oshash-named artifacts are shared already); near-duplicates (re-encodes, re-muxes) are reported.
+duplicate_index_path = "duplicate_index.sqlite3"  # Set to "" to disable; query with: python -m helpers.duplicate_index stats|show|near|scan
+duplicate_distance = 4  # --duplicate-distance: Largest phash Hamming distance reported as a near-duplicate (-1 = don't report)
+duplicate_report_path = "duplicates.jsonl"  # Near-duplicates found, one JSON line each ("" = console only)
+
+# 📮 Write-behind spool: results are journaled locally and sent to Stash in the background,
+# so hashing continues while Stash is slow or restarting. Unsent updates are replayed on the next start.
+spool_path = "update_spool.jsonl"  # Set to "" to send every update synchronously
+spool_max_backoff = 60  # Longest wait in seconds between retries while Stash is unreachable
+spool_dead_letter_path = "update_spool.failed.jsonl"  # Updates Stash rejected with a GraphQL error, one JSON line each with the error
+
+# 📈 Telemetry: per-stage timings, API latency, queue depth and active ffmpeg runs
+metrics_port = 0  # --metrics-port: Serve Prometheus metrics at http://<node>:PORT/metrics (0 = off)
+metrics_log_path = ""  # --metrics-log: Append one JSON line per timed stage and API call to this file ("" = off)
+
+# 🗂️ Scheduling: order claimed scenes by estimated cost (duration x resolution, or file size),
+# using processing rates this node learned from earlier scenes
+scheduling_policy = "fair"  # --scheduling: "fifo", "sjf" (shortest first), "lpt" (longest first) or "fair" (shortest first with aging)
+fair_aging = 1.0  # Seconds of estimated cost forgiven per second a scene waits (fair policy)
+cost_model_path = "cost_model.json"  # Learned rates; set to "" to keep them in memory only
 
 # ⚙️ Parallelism settings
 max_workers = 4  # --max-workers: Number of threads for parallel processing
 
+# 🎛️ Adaptive concurrency: tune max_workers and decode_slots from CPU, iowait, queueing and throughput
+auto_concurrency = False  # --auto-concurrency: Start from the values above and adjust within these bounds
+auto_interval = 30  # Seconds between adjustments
+auto_workers_min = 1
+auto_workers_max = 16
+auto_decode_slots_min = 1
+auto_decode_slots_max = os.cpu_count() or 4
+auto_cpu_high = 0.90  # CPU busy fraction treated as saturated
+auto_cpu_low = 0.70  # Below this there is CPU to spare
+auto_iowait_high = 0.25  # iowait fraction treated as storage-bound
+auto_tolerance = 0.20  # A change that drops throughput, or a step up that slows scenes, by more than this is undone
+
+# ⚡ Engine: "threads" runs each in-flight scene on its own thread; "async" runs scenes as asyncio
+# tasks with ffmpeg as asyncio subprocesses, so hundreds can wait on slots and I/O with a few threads
+engine = "threads"  # --engine: "threads" or "async"
+async_max_scenes = 64  # --async-max-scenes: Scenes in flight with the async engine (ffmpeg stays bounded by the budgets below)
+async_threads = 4  # Threads the async engine keeps for file checks, probes, frame assembly and phash math, on top of one per decode slot and mount read slot for blocking ffmpeg runs and staging copies
+async_http_connections = 16  # Keep-alive connections of the async engine's Stash client (needs aiohttp; only used with the spool disabled)
+
+# 🚦 Node-wide resource budgets, shared by all workers (ffmpeg multithreads on its own, so fewer decoders than cores)
+decode_slots = max(1, (os.cpu_count() or 4) // 2)  # --decode-slots: ffmpeg/videohashes decodes running at once
+encoder_sessions = 2  # --encoder-sessions: Preview encodes running at once (consumer NVIDIA cards limit NVENC sessions)
+mount_read_slots = 2  # --mount-read-slots: Processes reading from the same storage mount at once
+mount_read_limits = {  # Per-volume overrides of mount_read_slots, keyed like the translations' local paths
+    # 'R:/': 1,  # e.g. a single spinning disk
+}
+interleave_mounts = True  # --no-interleave-mounts: Start scenes on the least busy volume instead of in queue order
+
+# 🚚 Local staging: copy each source file once, sequentially, to a local scratch directory (ideally an SSD)
+# ahead of processing, so the stages' seeks hit the local copy instead of the NFS/SMB share
+staging_path = ""  # --staging-path: Scratch directory; copies go to its stash_staging folder, emptied at start and exit ("" = read sources in place)
+staging_max_gb = 50  # --staging-max-gb: Size cap of the staged copies; least recently used ones not in use are evicted
+staging_min_free_gb = 10  # Free space always left on the staging disk
+staging_ahead = 4  # Queued scenes copied ahead of the workers
+staging_buffer_mb = 16  # Read size of the sequential copy
+staging_read_slots = 8  # Processes reading staged copies at once (instead of mount_read_slots)
+
+# 🎬 Single-pass extraction: when a sprite or preview is missing, decode each file once for them and the cover and phash
+single_pass = True  # --no-single-pass: Fall back to separate ffmpeg runs per artifact
+
+# 🖼️ Cover settings
+cover_candidates = 1  # --cover-candidates: Frames to compare when picking a cover; above 1 skips black and blurry frames
+
 # 🖼️ Sprite generation settings
 generate_sprite = True  # --generate-sprite: Enable sprite image generation
+sprite_seek_mode = "exact"  # --sprite-seek-mode: "exact" (exact timestamps, full decode) or "keyframe" (nearest keyframe, fast, but tiles can be off from their VTT times by up to a GOP)
+
+# 🏎️ Encoder selection, measured once per host with a short synthetic encode and cached
+preview_encoder = "auto"  # --preview-encoder: "auto" (fastest working encoder above the quality floor) or an ffmpeg encoder, e.g. libx264, h264_nvenc, h264_qsv
+hwaccel = "auto"  # --hwaccel: Decoder for sprite screenshots: "auto" (fastest that works), "none" or an ffmpeg -hwaccel method
+encoder_quality_floor = 40.0  # Minimum PSNR in dB against the source for an encoder/preset to be picked
+encoder_calibration_path = "encoder_calibration.json"  # Results per host; --recalibrate measures again
+encoder_calibration_seconds = 4  # Length of the synthetic calibration clips
 
 # 🎞️ Preview video settings
 generate_preview = True  # --generate-preview: Enable preview video generation
@@ -47,7 +136,12 @@ preview_skip_seconds = 15
 dry_run = False  # --dry-run: Simulate processing without writing changes
 once = False     # --once: Run one batch then exit
 verbose = False  # --verbose: Display additional information including progress bars for generation tasks
-nvenc = True     # Use NVIDIA NVENC hardware encoder for preview video generation
+
+# 👀 Watch mode: keep running once the backlog is empty and pick up scenes as Stash adds or re-queues them
+watch = False  # --watch: Run as a daemon, polling for scenes changed since the last one seen
+watch_min_interval = 2  # Seconds between polls while new scenes keep coming
+watch_max_interval = 30  # Longest wait between polls when idle (the wait doubles from watch_min_interval)
+watch_reconcile_interval = 3600  # Seconds between full backlog passes that catch scenes the cursor missed
 
 # 🚫 Stash paths to exclude from processing (matched with EXCLUDES filter)
 excluded_paths = [
@@ -0,0 +1,100 @@
+# async_engine.py
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from helpers.async_stash import AsyncStashClient
+from helpers.scene_processor import process_scene_async
+from helpers.stash_utils import release_scene, spool
+from helpers.storage_locality import locality
+from helpers.telemetry import metrics
+
+
+class AsyncEngine:
+    """
+    Runs claimed scenes as asyncio tasks instead of one thread each.
+
+    Up to async_max_scenes scenes are in flight. ffmpeg and videohashes run as
+    asyncio subprocesses under the same decode/encode/read budgets as the thread
+    engine, so most tasks are just waiting on a process or a slot and cost no
+    thread. The blocking parts of a scene run on a thread pool: async_threads
+    threads for the short steps, plus one per decode slot and mount read slot for
+    the ffmpeg runs that still block (stages the single pass doesn't cover, stream
+    copies) and on-demand staging copies, which hold such a slot while they run.
+    Without the write-behind spool, Stash writes go out over one pooled aiohttp
+    session.
+
+    Limits: the spool is on by default, and then every write goes through the
+    spool flusher's blocking stashapi calls on its own thread, so the aiohttp
+    client only serves nodes running with spool_path = "". Discovery, leases and
+    the heartbeat also stay on stashapi in their own threads. ffmpeg stages the
+    single pass doesn't cover, and stream copies, still block a pool thread each.
+    """
+
+    def __init__(self, feed, leases, cost_model):
+        self.feed = feed
+        self.leases = leases
+        self.cost_model = cost_model
+        self.tasks = set()
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.pool_size(), thread_name_prefix="scene"))
+        metrics.gauge_callback("scenes_in_flight", lambda: len(self.tasks))
+
+        # The spool already batches writes on its own thread
+        if spool or config.dry_run:
+            await self.schedule(None)
+        elif not AsyncStashClient.available():
+            print("⚠️ aiohttp is not installed, Stash writes of the async engine go through the thread pool")
+            await self.schedule(None)
+        else:
+            async with AsyncStashClient() as client:
+                await self.schedule(client)
+
+    def pool_size(self):
+        # Every blocking ffmpeg run holds a decode slot, or a read slot when it only copies
+        return config.async_threads + config.decode_slots + config.mount_read_slots
+
+    async def schedule(self, client):
+        while True:
+            while len(self.tasks) < config.async_max_scenes:
+                item = self.feed.get(block=False)
+                if item is None:
+                    break
+                self.tasks.add(asyncio.create_task(self.process_leased_scene(client, *item)))
+
+            if not self.tasks:
+                if self.feed.done:
+                    return
+                # Nothing running: poll the feed rather than park a pool thread in get()
+                await asyncio.sleep(0.2)
+                continue
+
+            # Wake up periodically so newly prefetched scenes fill free slots
+            done, self.tasks = await asyncio.wait(self.tasks, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    task.result()
+                except Exception as e:
+                    print(f"❌ Unexpected error while processing a scene: {e}")
+
+    async def process_leased_scene(self, client, scene, index, total_batch):
+        # Same bookkeeping as the thread engine's process_leased_scene
+        try:
+            if self.leases.is_lost(scene['id']):
+                print(f"⏭️ Skipping scene {scene['id']}, another node already hashed it")
+                release_scene(scene['id'])
+                return
+            started = time.monotonic()
+            with locality.track(scene):
+                result = await process_scene_async(scene, index, total_batch, client)
+            if result == "done":
+                self.cost_model.observe(scene, time.monotonic() - started)
+        finally:
+            self.leases.drop(scene['id'])
@@ -0,0 +1,76 @@
+# async_stash.py
+
+import config
+from helpers.telemetry import metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+SET_PHASH_MUTATION = """
+mutation SetPhash($input: FileSetFingerprintsInput!) {
+    fileSetFingerprints(input: $input)
+}
+"""
+
+UPDATE_COVER_MUTATION = """
+mutation SceneUpdate($input: SceneUpdateInput!) {
+    sceneUpdate(input: $input) { id }
+}
+"""
+
+
+class AsyncStashClient:
+    """
+    The Stash requests the async engine makes per scene, over one pooled aiohttp
+    session: keep-alive connections are capped at async_http_connections however
+    many scenes are in flight. Requests are timed like the stashapi client's.
+
+    Needs aiohttp; available() says whether it is installed.
+    """
+
+    def __init__(self, connections=None):
+        self.url = f"{config.stash_scheme}://{config.stash_host}:{config.stash_port}/graphql"
+        self.connections = connections or config.async_http_connections
+        self.session = None
+
+    @staticmethod
+    def available():
+        return aiohttp is not None
+
+    async def __aenter__(self):
+        headers = {"ApiKey": config.stash_api_key} if config.stash_api_key else {}
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60),
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=120),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def call(self, query, variables=None):
+        with metrics.api_call(query):
+            async with self.session.post(self.url, json={"query": query, "variables": variables or {}}) as response:
+                response.raise_for_status()
+                body = await response.json()
+        if body.get("errors"):
+            raise RuntimeError(f"GraphQL error: {body['errors'][0].get('message')}")
+        return body["data"]
+
+    async def set_phash(self, file_id, phash):
+        await self.call(SET_PHASH_MUTATION, {"input": {"id": file_id, "fingerprints": [{"type": "phash", "value": phash}]}})
+
+    async def update_cover(self, scene_id, cover_data):
+        await self.call(UPDATE_COVER_MUTATION, {"input": {"id": scene_id, "cover_image": cover_data}})
+
+    async def screenshot_is_placeholder(self, url):
+        # Same check as stash_utils.screenshot_is_placeholder, on the first kilobyte only
+        async with self.session.get(url, headers={"Range": "bytes=0-1023"}) as response:
+            response.raise_for_status()
+            if "svg" in response.headers.get("Content-Type", "").lower():
+                return True
+            head = await response.content.read(1024)
+        return b"<svg" in head.lower()
@@ -0,0 +1,28 @@
+# async_subprocess.py
+
+import asyncio
+import subprocess
+
+
+async def run_command(args, capture=False):
+    """
+    subprocess.run(args, check=True) for the asyncio engine: waiting for the
+    process costs no thread. Returns stdout when capture is set (stderr is merged
+    into it, like the videohashes call), otherwise None.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE if capture else None,
+        stderr=subprocess.STDOUT if capture else None,
+    )
+    try:
+        stdout, _ = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, output=stdout)
+    return stdout
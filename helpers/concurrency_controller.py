@@ -0,0 +1,188 @@
+# concurrency_controller.py
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import config
+from helpers.resource_scheduler import scheduler
+from helpers.telemetry import metrics
+
+
+def read_cpu_times():
+    """
+    (busy, iowait, total) jiffies from /proc/stat, or None where it doesn't exist.
+    """
+    try:
+        with open("/proc/stat", encoding="ascii") as stat:
+            values = [int(v) for v in stat.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle, iowait = values[3], values[4] if len(values) > 4 else 0
+    total = sum(values[:8])
+    return total - idle - iowait, iowait, total
+
+
+class LoadSample:
+    """
+    One interval of node load: CPU busy and iowait fractions, average wait per
+    decode/encode reservation, finished scenes and their average duration.
+    """
+
+    def __init__(self, cpu, iowait, decode_wait, encode_wait, scenes, scene_seconds, seconds):
+        self.cpu = cpu
+        self.iowait = iowait
+        self.decode_wait = decode_wait
+        self.encode_wait = encode_wait
+        self.scenes = scenes
+        self.scene_seconds = scene_seconds
+        self.seconds = seconds
+
+    @property
+    def throughput(self):
+        # Scenes per hour
+        return self.scenes * 3600 / self.seconds if self.seconds else 0.0
+
+    def describe(self):
+        iowait = f"{self.iowait:.0%}" if self.iowait is not None else "n/a"
+        return (f"cpu {self.cpu:.0%}, iowait {iowait}, decode wait {self.decode_wait:.1f}s, "
+                f"encode wait {self.encode_wait:.1f}s, {self.throughput:.0f} scenes/h")
+
+
+class ConcurrencyController:
+    """
+    Tunes the number of in-flight scenes (config.max_workers) and the decode budget
+    (config.decode_slots) from live load, between the configured bounds.
+
+    Every interval it samples the node and makes at most one change:
+    - iowait high: the disks are the limit, so run fewer scenes at once
+    - CPU saturated: more decoders only contend, so lower the decode budget, or run
+      fewer scenes once the budget is at its floor
+    - CPU to spare and decodes queueing: raise the decode budget
+    - CPU to spare, no queueing and the encoder not the bottleneck: run one more scene
+    A change that lowered throughput by more than the tolerance is undone, as is a step
+    up after which scenes take longer than the extra concurrency explains (more scenes
+    in flight stretch each one, more decoders shouldn't). The controller then holds
+    still for a few intervals before probing again.
+    """
+
+    def __init__(self, feed=None, interval=None):
+        self.feed = feed
+        self.interval = interval or config.auto_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.previous = None
+        self.last_change = None  # (knob, old value, throughput before, scene seconds before)
+        self.hold = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def snapshot(self):
+        count, total = metrics.histogram_total("stage_seconds", stage="scene")
+        return {
+            "time": time.monotonic(),
+            "cpu": read_cpu_times(),
+            "load": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+            "decode": (scheduler.decode.acquires, scheduler.decode.waited),
+            "encode": (scheduler.encode.acquires, scheduler.encode.waited),
+            "scenes": (count, total),
+        }
+
+    def sample(self, before, after):
+        seconds = after["time"] - before["time"]
+        if before["cpu"] and after["cpu"] and after["cpu"][2] > before["cpu"][2]:
+            total = after["cpu"][2] - before["cpu"][2]
+            cpu = (after["cpu"][0] - before["cpu"][0]) / total
+            iowait = (after["cpu"][1] - before["cpu"][1]) / total
+        else:
+            # No /proc/stat: the load average per core stands in for CPU use
+            cpu = min(1.0, (after["load"] or 0) / (os.cpu_count() or 1))
+            iowait = None
+
+        def average_wait(key):
+            acquires = after[key][0] - before[key][0]
+            return (after[key][1] - before[key][1]) / acquires if acquires else 0.0
+
+        scenes = after["scenes"][0] - before["scenes"][0]
+        scene_seconds = (after["scenes"][1] - before["scenes"][1]) / scenes if scenes else None
+        return LoadSample(cpu, iowait, average_wait("decode"), average_wait("encode"), scenes, scene_seconds, seconds)
+
+    def set_knob(self, knob, value, reason, sample):
+        old = getattr(config, knob)
+        if value == old:
+            return False
+        setattr(config, knob, value)
+        if knob == "decode_slots":
+            scheduler.configure(config.decode_slots, config.encoder_sessions, config.mount_read_slots)
+        elif self.feed:
+            self.feed.low_water = value
+        self.last_change = (knob, old, sample.throughput, sample.scene_seconds)
+        metrics.gauge(f"auto_{knob}", value)
+        metrics.event("concurrency", knob=knob, old=old, new=value, reason=reason,
+                      cpu=round(sample.cpu, 3), iowait=sample.iowait, throughput=round(sample.throughput, 1))
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[{timestamp}] 🎛️ {knob} {old} → {value}: {reason} ({sample.describe()})")
+        return True
+
+    @staticmethod
+    def slowed_down(knob, old, latency_before, sample):
+        """
+        Whether a step up of knob from old left scenes slower than it can explain. With
+        throughput unchanged, n+1 scenes in flight take (n+1)/n as long each; a larger
+        decode budget shouldn't slow a scene at all. Past that by the tolerance, the
+        step only added contention.
+        """
+        new = getattr(config, knob)
+        if new <= old or not latency_before or sample.scene_seconds is None:
+            return False
+        expected = latency_before * new / old if knob == "max_workers" else latency_before
+        return sample.scene_seconds > expected * (1 + config.auto_tolerance)
+
+    def decide(self, sample):
+        workers, decoders = config.max_workers, config.decode_slots
+
+        # Undo the last change if it made things worse; only judged once scenes finished
+        if self.last_change and sample.scenes:
+            knob, old, throughput_before, latency_before = self.last_change
+            self.last_change = None
+            reason = None
+            if throughput_before and sample.throughput < throughput_before * (1 - config.auto_tolerance):
+                reason = "throughput dropped after the last change"
+            elif self.slowed_down(knob, old, latency_before, sample):
+                reason = "scenes slowed down after the last change"
+            if reason:
+                self.set_knob(knob, old, reason, sample)
+                self.last_change = None
+                self.hold = 3
+                return
+
+        if self.hold:
+            self.hold -= 1
+            return
+
+        if sample.iowait is not None and sample.iowait > config.auto_iowait_high and workers > config.auto_workers_min:
+            self.set_knob("max_workers", workers - 1, "storage is saturated", sample)
+        elif sample.cpu > config.auto_cpu_high and decoders > config.auto_decode_slots_min:
+            self.set_knob("decode_slots", decoders - 1, "CPU is saturated", sample)
+        elif sample.cpu > config.auto_cpu_high and workers > config.auto_workers_min:
+            self.set_knob("max_workers", workers - 1, "CPU is saturated with the decode budget at its floor", sample)
+        elif sample.cpu < config.auto_cpu_low:
+            if sample.decode_wait > 1 and decoders < config.auto_decode_slots_max:
+                self.set_knob("decode_slots", decoders + 1, "decodes are queueing with CPU to spare", sample)
+            elif sample.decode_wait <= 1 and sample.encode_wait <= 1 and workers < config.auto_workers_max:
+                self.set_knob("max_workers", workers + 1, "CPU to spare and nothing queueing", sample)
+
+    def run(self):
+        self.previous = self.snapshot()
+        while not self.stop_event.wait(self.interval):
+            current = self.snapshot()
+            try:
+                self.decide(self.sample(self.previous, current))
+            except Exception as e:
+                print(f"⚠️ Concurrency controller failed: {e}")
+            self.previous = current
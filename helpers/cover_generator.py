@@ -0,0 +1,116 @@
+# cover_generator.py
+
+import io
+import subprocess
+import numpy as np
+from PIL import Image
+
+from helpers.resource_scheduler import scheduler
+from helpers.media_info import get_media_info
+
+# Candidates are scored on a small grayscale copy; the chosen JPEG is returned untouched
+SCORE_SIZE = (160, 90)
+
+
+def cover_time(duration):
+    # 30 seconds in, or 5 seconds for short videos
+    if duration > 30:
+        return 30
+    if duration > 5:
+        return 5
+    return 0
+
+
+def candidate_times(duration, count):
+    # The usual cover time first, then evenly spread over 10%-60% of the video
+    times = [cover_time(duration)]
+    if count > 1:
+        step = 0.5 * duration / (count - 1)
+        times += [0.1 * duration + i * step for i in range(count - 1)]
+    return times
+
+
+def score_frames(frames):
+    """
+    Scores a stack of grayscale frames (N x H x W): the variance of the Laplacian,
+    so sharper frames score higher, and 0 for frames that are nearly black, nearly
+    white or flat (fades, title cards).
+    """
+    pixels = frames.astype(np.float32)
+    laplacian = (
+        4 * pixels[:, 1:-1, 1:-1]
+        - pixels[:, :-2, 1:-1] - pixels[:, 2:, 1:-1]
+        - pixels[:, 1:-1, :-2] - pixels[:, 1:-1, 2:]
+    )
+    sharpness = laplacian.reshape(len(frames), -1).var(axis=1)
+    brightness = pixels.reshape(len(frames), -1).mean(axis=1)
+    contrast = pixels.reshape(len(frames), -1).std(axis=1)
+    usable = (brightness > 16) & (brightness < 240) & (contrast > 8)
+    return np.where(usable, sharpness, 0.0)
+
+
+class CoverGenerator:
+    """
+    Grabs the cover as a single JPEG over a pipe: input seek, so only the frames
+    from the nearest keyframe on are decoded, and nothing is written to disk.
+
+    With candidates > 1, that many frames are grabbed and the sharpest one that
+    isn't black, white or flat is picked. If none is usable, the frame at the
+    usual cover time is kept.
+    """
+
+    def __init__(self, filename, ffmpeg='ffmpeg', ffprobe='ffprobe', candidates=1, media_info=None):
+        self.filename = filename
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.candidates = max(1, candidates)
+        self.media_info = media_info
+
+    def get_video_duration(self):
+        if self.media_info is None:
+            self.media_info = get_media_info(self.filename, self.ffprobe)
+        return self.media_info.duration
+
+    def build_command(self, time):
+        return [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-ss', str(time),
+            '-i', self.filename,
+            '-frames:v', '1', '-q:v', '2',
+            '-c:v', 'mjpeg', '-f', 'image2pipe', 'pipe:1'
+        ]
+
+    def extract_frame(self, time):
+        result = subprocess.run(self.build_command(time), stdout=subprocess.PIPE, check=True)
+        return result.stdout
+
+    def pick_best(self, images):
+        thumbnails = []
+        for image in images:
+            with Image.open(io.BytesIO(image)) as img:
+                img.draft('L', SCORE_SIZE)  # let the JPEG decoder downscale
+                thumbnails.append(np.asarray(img.convert('L').resize(SCORE_SIZE)))
+        scores = score_frames(np.stack(thumbnails))
+        return images[int(np.argmax(scores))]
+
+    def generate(self):
+        """
+        Returns the cover as JPEG bytes. Raises when no frame could be extracted.
+        """
+        times = candidate_times(self.get_video_duration(), self.candidates)
+        images = []
+        with scheduler.reserve(self.filename):
+            for time in times:
+                try:
+                    image = self.extract_frame(time)
+                except subprocess.CalledProcessError:
+                    if len(times) == 1:
+                        raise
+                    continue
+                if image:
+                    images.append(image)
+        if not images:
+            raise RuntimeError(f"ffmpeg returned no cover frame for {self.filename}")
+        if len(images) == 1:
+            return images[0]
+        return self.pick_best(images)
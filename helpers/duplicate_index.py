@@ -0,0 +1,381 @@
+# duplicate_index.py
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import config
+from helpers.telemetry import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    oshash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    phash TEXT NOT NULL,
+    duration REAL,
+    scene_id TEXT,
+    path TEXT,
+    sprite TEXT,
+    vtt TEXT,
+    preview TEXT,
+    created_at REAL NOT NULL,
+    reused INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MERGE_PENDING = 1024  # New hashes kept unsorted before the tables are rebuilt
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(values)
+    return POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def phash_value(phash):
+    return int(phash, 16) & 0xFFFFFFFFFFFFFFFF
+
+
+def chunk_masks(radius):
+    # Every CHUNK_BITS-bit mask with at most radius bits set
+    masks = np.arange(1 << CHUNK_BITS, dtype=np.uint32)
+    return masks[popcount(masks.astype(np.uint64)) <= radius]
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit phashes: each hash is split into four 16-bit
+    chunks and every chunk has a sorted table. Two hashes within distance d agree
+    to within d // 4 bits on at least one chunk, so a search only looks at the
+    table rows near the query's chunks and checks those candidates' full
+    distance. With millions of hashes that is a few hundred candidates per
+    search instead of a scan.
+
+    Hashes added after a build wait in a small unsorted list until MERGE_PENDING
+    of them have gathered.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.tables = []   # per chunk: (sorted chunk values, ids and hashes in that order)
+        self.pending = []  # (id, hash) not in the tables yet
+        self.masks = {}
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def build(self, ids, hashes):
+        with self.lock:
+            self.ids = np.asarray(ids, dtype=np.int64)
+            self.hashes = np.asarray(hashes, dtype=np.uint64)
+            self.pending = []
+            self.index_tables()
+
+    def index_tables(self):
+        self.tables = []
+        for chunk in range(CHUNKS):
+            values = ((self.hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(CHUNK_MASK)).astype(np.uint16)
+            order = np.argsort(values, kind="stable")
+            self.tables.append((values[order], self.ids[order], self.hashes[order]))
+
+    def add(self, id, value):
+        with self.lock:
+            self.pending.append((id, value))
+            if len(self.pending) >= MERGE_PENDING:
+                ids, hashes = zip(*self.pending)
+                self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+                self.hashes = np.concatenate([self.hashes, np.array(hashes, dtype=np.uint64)])
+                self.pending = []
+                self.index_tables()
+
+    def search(self, value, max_distance):
+        """
+        (id, distance) of every indexed hash within max_distance bits of value,
+        closest first.
+        """
+        radius = max_distance // CHUNKS
+        if radius not in self.masks:
+            self.masks[radius] = chunk_masks(radius)
+        masks = self.masks[radius]
+        query = np.uint64(value)
+
+        with self.lock:
+            tables, pending = self.tables, list(self.pending)
+
+        found = {}
+        if tables and len(tables[0][0]):
+            candidate_ids, candidate_hashes = [], []
+            for chunk, (values, ids, hashes) in enumerate(tables):
+                near = (masks ^ ((value >> (chunk * CHUNK_BITS)) & CHUNK_MASK)).astype(np.uint16)
+                low = np.searchsorted(values, near, side="left")
+                high = np.searchsorted(values, near, side="right")
+                lengths = high - low
+                total = int(lengths.sum())
+                if total:
+                    # Every row of every matching run, without a Python loop over the runs
+                    rows = np.repeat(low - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+                    candidate_ids.append(ids[rows])
+                    candidate_hashes.append(hashes[rows])
+            if candidate_ids:
+                # A hash close on several chunks shows up once per chunk; the dict keeps one
+                distances = popcount(np.concatenate(candidate_hashes) ^ query)
+                close = distances <= max_distance
+                found = dict(zip(np.concatenate(candidate_ids)[close].tolist(), distances[close].tolist()))
+
+        if pending:
+            pending_ids, pending_hashes = zip(*pending)
+            distances = popcount(np.array(pending_hashes, dtype=np.uint64) ^ query)
+            for position in np.flatnonzero(distances <= max_distance).tolist():
+                found[pending_ids[position]] = int(distances[position])
+        return sorted(found.items(), key=lambda item: item[1])
+
+
+class DuplicateIndex:
+    """
+    Every file this node hashed, by oshash: its phash, duration and where its
+    sprite, VTT and preview were written, plus a HammingIndex of the phashes.
+
+    A scene whose file (same oshash and size) is already known takes its phash
+    from here instead of being decoded again; its artifacts are named after the
+    oshash, so they already exist. A newly hashed file whose phash is within duplicate_distance
+    of another one (a re-encode or re-mux of the same video) is reported on the
+    console and in duplicate_report_path; nothing is reused for those, since
+    sprite timings and previews depend on the exact file.
+
+    Unlike the result cache, entries are never evicted: an oshash names the
+    file's content, so the record stays true wherever the file moves.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        self.hamming = HammingIndex()
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        self.counts = {"exact": 0, "near": 0}
+
+    def load(self):
+        # The phashes are read once per run; lookups by oshash go to SQLite's primary key
+        with self.load_lock:
+            if self.loaded:
+                return
+            started = time.perf_counter()
+            with self.lock:
+                rows = self.db.execute("SELECT rowid, phash FROM files").fetchall()
+            self.hamming.build([row[0] for row in rows], [phash_value(row[1]) for row in rows])
+            self.loaded = True
+        if config.verbose:
+            print(f"👯 Loaded {len(rows)} phashes into the duplicate index in {time.perf_counter() - started:.1f}s")
+
+    def lookup(self, oshash, size):
+        """
+        The record of a file with this oshash and size as a dict, or None.
+        """
+        with self.lock:
+            self.db.row_factory = sqlite3.Row
+            try:
+                row = self.db.execute("SELECT * FROM files WHERE oshash = ? AND size = ?", (oshash, size)).fetchone()
+            finally:
+                self.db.row_factory = None
+        return dict(row) if row else None
+
+    def reuse(self, record, scene_id, filename_pretty):
+        """
+        Counts a scene that takes a known file's phash. Its sprite, VTT and preview
+        need nothing: they are named after the oshash, which the copy shares, so
+        they are already in place wherever the original's were written.
+        """
+        with self.lock:
+            if not config.dry_run:
+                self.db.execute("UPDATE files SET reused = reused + 1 WHERE oshash = ?", (record["oshash"],))
+                self.db.commit()
+            self.counts["exact"] += 1
+        metrics.inc("duplicates_total", kind="exact")
+        print(f"👯 Scene {scene_id} — {filename_pretty} is the same file as scene {record['scene_id']}, reusing its phash")
+
+    def record(self, oshash, size, phash, duration, scene_id, path, sprite=None, vtt=None, preview=None):
+        """
+        Adds a newly hashed file, or fills in artifacts for a known one. New files
+        are checked for near-duplicates, which are reported.
+        """
+        if config.dry_run:
+            return
+        self.load()  # before the insert, so the new file isn't loaded and added twice
+        now = time.time()
+        with self.lock:
+            existing = self.db.execute("SELECT rowid FROM files WHERE oshash = ?", (oshash,)).fetchone()
+            if existing:
+                self.db.execute(
+                    "UPDATE files SET sprite = COALESCE(?, sprite), vtt = COALESCE(?, vtt), preview = COALESCE(?, preview) "
+                    "WHERE oshash = ?", (sprite, vtt, preview, oshash)
+                )
+            else:
+                rowid = self.db.execute(
+                    "INSERT INTO files (oshash, size, phash, duration, scene_id, path, sprite, vtt, preview, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (oshash, size, phash, duration, str(scene_id), path, sprite, vtt, preview, now)
+                ).lastrowid
+            self.db.commit()
+        if existing:
+            return
+
+        value = phash_value(phash)
+        if config.duplicate_distance >= 0:
+            matches = self.near(value, config.duplicate_distance, exclude=rowid)
+            if matches:
+                self.report(oshash, phash, scene_id, path, matches)
+        self.hamming.add(rowid, value)
+
+    def near(self, value, max_distance, exclude=None):
+        """
+        Records of files whose phash is within max_distance of value, closest
+        first, each with its "distance".
+        """
+        self.load()
+        found = [(rowid, distance) for rowid, distance in self.hamming.search(value, max_distance) if rowid != exclude]
+        if not found:
+            return []
+        distances = dict(found)
+        with self.lock:
+            self.db.row_factory = sqlite3.Row
+            try:
+                rows = self.db.execute(
+                    f"SELECT rowid, * FROM files WHERE rowid IN ({','.join('?' * len(distances))})", list(distances)
+                ).fetchall()
+            finally:
+                self.db.row_factory = None
+        matches = [dict(row, distance=distances[row["rowid"]]) for row in rows]
+        return sorted(matches, key=lambda match: match["distance"])
+
+    def report(self, oshash, phash, scene_id, path, matches):
+        with self.lock:
+            self.counts["near"] += 1
+        metrics.inc("duplicates_total", kind="near")
+        closest = matches[0]
+        more = f" and {len(matches) - 1} more" if len(matches) > 1 else ""
+        print(f"👯 Scene {scene_id} looks like scene {closest['scene_id']} (phash distance {closest['distance']}){more}: "
+              f"{path} ↔ {closest['path']}")
+        if not config.duplicate_report_path:
+            return
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "scene_id": str(scene_id),
+            "oshash": oshash,
+            "phash": phash,
+            "path": path,
+            "matches": [{k: match[k] for k in ("scene_id", "oshash", "phash", "path", "distance")} for match in matches],
+        }
+        with self.lock:
+            with open(config.duplicate_report_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def summary(self):
+        with self.lock:
+            exact, near = self.counts["exact"], self.counts["near"]
+        if exact or near:
+            where = f", listed in {config.duplicate_report_path}" if near and config.duplicate_report_path else ""
+            print(f"👯 {exact} copies of known files reused, {near} near-duplicates found{where}")
+
+    def show(self, oshash):
+        with self.lock:
+            self.db.row_factory = sqlite3.Row
+            try:
+                row = self.db.execute("SELECT * FROM files WHERE oshash = ?", (oshash,)).fetchone()
+            finally:
+                self.db.row_factory = None
+        return dict(row) if row else None
+
+    def stats(self):
+        with self.lock:
+            entries, reused = self.db.execute("SELECT COUNT(*), COALESCE(SUM(reused), 0) FROM files").fetchone()
+        return {
+            "entries": entries,
+            "reused": reused,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_duplicate_index():
+    """
+    The node's shared index, opened on first use. None when duplicate_index_path
+    is empty.
+    """
+    global _index
+    if not config.duplicate_index_path:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = DuplicateIndex(config.duplicate_index_path)
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the local duplicate index")
+    parser.add_argument("--path", default=config.duplicate_index_path, help=f"Index database (default: {config.duplicate_index_path})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show entry counts and database size")
+    show = commands.add_parser("show", help="Show the record for an oshash")
+    show.add_argument("oshash")
+    near = commands.add_parser("near", help="List files whose phash is close to a phash")
+    near.add_argument("phash")
+    near.add_argument("--distance", type=int, default=config.duplicate_distance)
+    scan = commands.add_parser("scan", help="List every group of near-duplicate files in the index")
+    scan.add_argument("--distance", type=int, default=config.duplicate_distance)
+    args = parser.parse_args()
+
+    index = DuplicateIndex(args.path)
+    if args.command == "stats":
+        stats = index.stats()
+        print(f"👯 {stats['entries']} files, reused {stats['reused']} times, {stats['size_bytes'] / 1024:.0f} KiB")
+    elif args.command == "show":
+        entry = index.show(args.oshash)
+        print(json.dumps(entry, indent=2) if entry else f"🚫 No entry for {args.oshash}")
+    elif args.command == "near":
+        index.load()
+        started = time.perf_counter()
+        matches = index.near(phash_value(args.phash), args.distance)
+        elapsed = (time.perf_counter() - started) * 1000
+        for match in matches:
+            print(f"{match['distance']:>3}  scene {match['scene_id']}  {match['oshash']}  {match['path']}")
+        print(f"🔎 {len(matches)} within distance {args.distance} ({elapsed:.2f} ms)")
+    elif args.command == "scan":
+        index.load()
+        seen = set()
+        groups = 0
+        for rowid, oshash, phash, scene_id, path in index.db.execute("SELECT rowid, oshash, phash, scene_id, path FROM files").fetchall():
+            if rowid in seen:
+                continue
+            matches = [m for m in index.near(phash_value(phash), args.distance, exclude=rowid) if m["rowid"] not in seen]
+            if not matches:
+                continue
+            groups += 1
+            seen.add(rowid)
+            print(f"scene {scene_id}  {oshash}  {path}")
+            for match in matches:
+                seen.add(match["rowid"])
+                print(f"  {match['distance']:>3}  scene {match['scene_id']}  {match['oshash']}  {match['path']}")
+        print(f"👯 {groups} groups of near-duplicates within distance {args.distance}")
+
+
+if __name__ == '__main__':
+    main()
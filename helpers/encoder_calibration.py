@@ -0,0 +1,290 @@
+# encoder_calibration.py
+
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import config
+from helpers.frame_extractor import FrameExtractor
+
+# Preview encoder candidates, fastest presets first: (encoder, quality/preset args)
+ENCODER_CANDIDATES = [
+    ("h264_nvenc", ['-preset', 'p1', '-cq:v', '18']),
+    ("h264_nvenc", ['-preset', 'p4', '-cq:v', '18']),
+    ("h264_qsv", ['-preset', 'veryfast', '-global_quality', '20']),
+    ("h264_videotoolbox", ['-q:v', '65']),
+    ("h264_amf", ['-quality', 'speed', '-rc', 'cqp', '-qp_i', '18', '-qp_p', '18']),
+    ("libx264", ['-preset', 'ultrafast', '-crf', '18']),
+    ("libx264", ['-preset', 'superfast', '-crf', '18']),
+    ("libx264", ['-preset', 'veryfast', '-crf', '18']),
+    ("libx264", ['-preset', 'fast', '-crf', '18']),
+]
+
+# What every node can run when nothing was measured
+FALLBACK_ENCODER = {"encoder": "libx264", "args": ['-preset', 'fast', '-crf', '18'], "threads": 0}
+
+PSNR_RE = re.compile(r'PSNR .*average:(\S+)')
+
+
+def ffmpeg_list(ffmpeg, option):
+    result = subprocess.run([ffmpeg, '-hide_banner', option], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return result.stdout.decode(errors='replace').splitlines()
+
+
+def available_encoders(ffmpeg):
+    encoders = set()
+    for line in ffmpeg_list(ffmpeg, '-encoders'):
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6:
+            encoders.add(parts[1])
+    return encoders
+
+
+def available_hwaccels(ffmpeg):
+    lines = ffmpeg_list(ffmpeg, '-hwaccels')
+    return [line.strip() for line in lines[1:] if line.strip()]
+
+
+def ffmpeg_version(ffmpeg):
+    return ffmpeg_list(ffmpeg, '-version')[0]
+
+
+class EncoderCalibration:
+    """
+    Picks the preview encoder and the sprite decoder for this host by measuring them.
+
+    At startup, every preview encoder this ffmpeg has is run on a short synthetic
+    clip at the preview size, encoder_sessions copies at once (as the node will run
+    them), at each candidate preset and, for libx264, thread count. Candidates that
+    fail or fall below encoder_quality_floor (PSNR against the source) are skipped;
+    the fastest of the rest encodes every preview. Each -hwaccel method is tried on
+    the sprite's screenshot extraction of a 1080p clip the same way.
+
+    Results are cached per host in encoder_calibration_path and measured again when
+    ffmpeg, the session count or the CPU count change, or with --recalibrate.
+    preview_encoder / hwaccel in config.py override the choice.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.encoder = None  # {"encoder", "args", "threads"}
+        self.hwaccel = None  # -hwaccel method, or None for software decoding
+        self.record = None
+
+    def configure(self, ffmpeg=None, recalibrate=False):
+        ffmpeg = ffmpeg or config.ffmpeg
+        wants_encoder = config.preview_encoder == "auto"
+        wants_hwaccel = config.hwaccel == "auto"
+        if wants_encoder or wants_hwaccel:
+            try:
+                record = None if recalibrate else self.load(ffmpeg)
+                if record is None:
+                    record = self.calibrate(ffmpeg)
+                    self.save(record)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"⚠️ Encoder calibration failed, using the defaults: {e}")
+                record = {}
+            self.record = record
+
+        with self.lock:
+            if wants_encoder:
+                self.encoder = self.record.get("encoder") or FALLBACK_ENCODER
+            else:
+                self.encoder = self.named_encoder(config.preview_encoder)
+            if wants_hwaccel:
+                self.hwaccel = self.record.get("hwaccel")
+            else:
+                self.hwaccel = None if config.hwaccel == "none" else config.hwaccel
+
+        print(f"🏎️ Preview encoder: {self.describe(self.encoder)}; sprite decoding: {self.hwaccel or 'software'}")
+
+    def named_encoder(self, name):
+        # An encoder set by hand gets the first candidate's settings for it
+        for encoder, args in ENCODER_CANDIDATES:
+            if encoder == name:
+                return {"encoder": encoder, "args": args, "threads": 0}
+        return {"encoder": name, "args": [], "threads": 0}
+
+    def describe(self, choice):
+        text = " ".join([choice["encoder"], *choice["args"]])
+        return text + (f" -threads {choice['threads']}" if choice.get("threads") else "")
+
+    def codec_args(self):
+        """
+        Video codec arguments for a preview encode.
+        """
+        with self.lock:
+            choice = self.encoder
+        if choice is None:
+            # Not configured (e.g. process_scene used as a library): the setting, or what every node can run
+            choice = FALLBACK_ENCODER if config.preview_encoder == "auto" else self.named_encoder(config.preview_encoder)
+        args = ['-c:v', choice["encoder"], *choice["args"]]
+        if choice.get("threads"):
+            args += ['-threads', str(choice["threads"])]
+        return args
+
+    def decode_args(self):
+        """
+        Input arguments for the sprite's screenshot extraction.
+        """
+        with self.lock:
+            return ['-hwaccel', self.hwaccel] if self.hwaccel else []
+
+    def host_key(self):
+        return platform.node() or "localhost"
+
+    def load(self, ffmpeg):
+        path = config.encoder_calibration_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f).get(self.host_key())
+        except (OSError, ValueError):
+            return None
+        if not record:
+            return None
+        if (record.get("ffmpeg"), record.get("encoder_sessions"), record.get("cpu_count")) != (
+                ffmpeg_version(ffmpeg), config.encoder_sessions, os.cpu_count()):
+            return None
+        return record
+
+    def save(self, record):
+        path = config.encoder_calibration_path
+        if not path:
+            return
+        hosts = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    hosts = json.load(f)
+            except (OSError, ValueError):
+                hosts = {}
+        hosts[self.host_key()] = record
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(hosts, f, indent=2)
+        os.replace(temp_path, path)
+
+    def calibrate(self, ffmpeg):
+        print("🏎️ Calibrating encoders and decoders for this host...")
+        temp_dir = tempfile.mkdtemp(prefix="encoder_calibration_")
+        try:
+            encoders = self.measure_encoders(ffmpeg, temp_dir)
+            decoders = self.measure_decoders(ffmpeg, temp_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        for result in encoders + decoders:
+            if result.get("fps"):
+                quality = f", PSNR {result['psnr']:.1f} dB" if result.get("psnr") else ""
+                print(f"   {result['name']}: {result['fps']:.0f} fps{quality}")
+            elif config.verbose:
+                print(f"   {result['name']}: unavailable ({result.get('error')})")
+
+        eligible = [r for r in encoders if r.get("fps") and (r.get("psnr") or 0) >= config.encoder_quality_floor]
+        best_encoder = max(eligible, key=lambda r: r["fps"], default=None)
+        working_decoders = [r for r in decoders if r.get("fps")]
+        best_decoder = max(working_decoders, key=lambda r: r["fps"], default=None)
+
+        return {
+            "measured_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "ffmpeg": ffmpeg_version(ffmpeg),
+            "encoder_sessions": config.encoder_sessions,
+            "cpu_count": os.cpu_count(),
+            "encoder": {k: best_encoder[k] for k in ("encoder", "args", "threads")} if best_encoder else None,
+            "hwaccel": best_decoder["hwaccel"] if best_decoder else None,
+            "encoders": encoders,
+            "decoders": decoders,
+        }
+
+    def source_filter(self, width, height):
+        return f"testsrc2=size={width}x{height}:rate=30:duration={config.encoder_calibration_seconds}"
+
+    def measure_encoders(self, ffmpeg, temp_dir):
+        # Rendered once as raw video so the measurement is the encoder, not the test source
+        reference = os.path.join(temp_dir, "reference.nut")
+        subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+                        '-f', 'lavfi', '-i', self.source_filter(640, 360),
+                        '-pix_fmt', 'yuv420p', '-c:v', 'rawvideo', reference], check=True)
+        frames = 30 * config.encoder_calibration_seconds
+        sessions = max(1, config.encoder_sessions)
+        have = available_encoders(ffmpeg)
+
+        thread_counts = sorted({0, max(1, (os.cpu_count() or 1) // sessions)})
+        candidates = []
+        for encoder, args in ENCODER_CANDIDATES:
+            if encoder not in have:
+                continue
+            for threads in (thread_counts if encoder.startswith("lib") else [0]):
+                candidates.append({"encoder": encoder, "args": args, "threads": threads})
+
+        results = []
+        for candidate in candidates:
+            result = dict(candidate, name=self.describe(candidate))
+            outputs = [os.path.join(temp_dir, f"encode_{i}.mp4") for i in range(sessions)]
+            command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', reference,
+                       '-c:v', candidate["encoder"], *candidate["args"]]
+            if candidate["threads"]:
+                command += ['-threads', str(candidate["threads"])]
+            started = time.perf_counter()
+            processes = [subprocess.Popen(command + ['-an', output], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                         for output in outputs]
+            errors = [p.communicate()[1] for p in processes]
+            seconds = time.perf_counter() - started
+            failed = next((e for p, e in zip(processes, errors) if p.returncode), None)
+            if failed is not None:
+                lines = failed.decode(errors='replace').strip().splitlines()
+                result["error"] = lines[-1] if lines else "failed"
+            else:
+                result["fps"] = round(frames * sessions / seconds, 1)
+                result["psnr"] = self.psnr(ffmpeg, outputs[0], reference)
+            results.append(result)
+        return results
+
+    def psnr(self, ffmpeg, encoded, reference):
+        result = subprocess.run([
+            ffmpeg, '-hide_banner', '-nostdin', '-i', encoded, '-i', reference,
+            '-lavfi', '[0:v]settb=AVTB,setpts=PTS-STARTPTS[a];[1:v]settb=AVTB,setpts=PTS-STARTPTS[b];[a][b]psnr',
+            '-f', 'null', '-'
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        match = PSNR_RE.search(result.stderr.decode(errors='replace'))
+        if not match:
+            return None
+        value = match.group(1)
+        return 100.0 if value == "inf" else round(float(value), 2)
+
+    def measure_decoders(self, ffmpeg, temp_dir):
+        if "libx264" not in available_encoders(ffmpeg):
+            return []
+        clip = os.path.join(temp_dir, "decode.mp4")
+        subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+                        '-f', 'lavfi', '-i', self.source_filter(1920, 1080),
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '30', '-pix_fmt', 'yuv420p', clip], check=True)
+        timestamps = [i * config.encoder_calibration_seconds / 81 for i in range(81)]
+
+        results = []
+        for hwaccel in [None] + available_hwaccels(ffmpeg):
+            result = {"name": f"sprite decode ({hwaccel or 'software'})", "hwaccel": hwaccel}
+            extractor = FrameExtractor(clip, ffmpeg, 160, 90, mode=config.sprite_seek_mode,
+                                       input_args=['-hwaccel', hwaccel] if hwaccel else [])
+            started = time.perf_counter()
+            try:
+                frames = extractor.extract(timestamps)
+                if len(frames) != len(timestamps) or any(frame is None for frame in frames):
+                    raise RuntimeError("missing frames")
+                result["fps"] = round(len(frames) / (time.perf_counter() - started), 1)
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+        return results
+
+
+encoders = EncoderCalibration()
@@ -0,0 +1,177 @@
+# lease_manager.py
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config
+from helpers.stash_utils import stash, build_scene_filter, claim_scenes, forget_release, reclaim_scenes, renew_leases
+
+FIND_SCENE_IDS_QUERY = """
+query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType, $scene_ids: [Int!]) {
+    findScenes(filter: $filter, scene_filter: $scene_filter, scene_ids: $scene_ids) {
+        scenes {
+            id
+            files { fingerprints { type value } }
+        }
+    }
+}
+"""
+
+
+class LeaseManager:
+    """
+    Time-limited work leases on top of hashing_tag.
+
+    Stash bumps a scene's updated_at on every update, so updated_at doubles as the
+    lease heartbeat: claiming adds hashing_tag, renewing re-adds it to every held
+    scene whose release isn't queued yet, and any scene still tagged hashing_tag whose
+    updated_at is older than the TTL belonged to a node that died and is swept
+    back into the pool.
+
+    Stash has no compare-and-set, so a claim re-checks the candidates right before
+    tagging them. Scenes another node took in the meantime count as collisions.
+    Held scenes that gain a phash from someone else count as duplicates and are
+    skipped if their work hasn't started.
+
+    Every tag change goes through the same ordered path as releases (the spool or
+    the tag batcher), so a heartbeat never lands after a release and re-tags a
+    finished scene.
+    """
+
+    def __init__(self, ttl=None, sweep_interval=None):
+        self.ttl = ttl or config.lease_ttl
+        self.sweep_interval = sweep_interval or config.lease_sweep_interval
+        self.lock = threading.Lock()
+        self.held = {}          # scene_id -> time claimed
+        self.lost = set()       # held scenes someone else already hashed
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+        self.last_sweep = 0.0
+        self.stats = {"candidates": 0, "claimed": 0, "collisions": 0, "duplicates": 0, "swept": 0}
+
+    def find_scenes_by_id(self, scene_ids, scene_filter=None):
+        result = stash.call_GQL(FIND_SCENE_IDS_QUERY, {
+            "filter": {"per_page": -1},
+            "scene_filter": scene_filter or {},
+            "scene_ids": [int(scene_id) for scene_id in scene_ids],
+        })
+        return result['findScenes']['scenes']
+
+    def claim(self, scenes):
+        """
+        Leases as many of `scenes` as are still free and returns those.
+        """
+        if not scenes:
+            return []
+        if config.dry_run:
+            print(f"[DRY RUN] Would lease {len(scenes)} scenes")
+            return scenes
+
+        available = {s['id'] for s in self.find_scenes_by_id([s['id'] for s in scenes], build_scene_filter())}
+        claimed = [s for s in scenes if s['id'] in available]
+        if claimed:
+            claim_scenes([s['id'] for s in claimed])
+
+        now = time.monotonic()
+        with self.lock:
+            for scene in claimed:
+                self.held[scene['id']] = now
+            self.stats["candidates"] += len(scenes)
+            self.stats["claimed"] += len(claimed)
+            self.stats["collisions"] += len(scenes) - len(claimed)
+
+        collisions = len(scenes) - len(claimed)
+        print(f"🔒 Leased {len(claimed)} of {len(scenes)} scenes ({collisions} already taken by other nodes)")
+        self.start_heartbeat()
+        return claimed
+
+    def renew(self):
+        # Under the lock, so a scene dropped meanwhile (and its release) can't be renewed after the fact
+        with self.lock:
+            held = list(self.held)
+            if not held:
+                return
+            held = renew_leases(held)
+        if not held:
+            return
+
+        # The same round trip tells us whether another node already hashed any of ours
+        hashed = {
+            s['id'] for s in self.find_scenes_by_id(held)
+            if any(fp['type'].lower() == 'phash' for f in s.get('files', []) for fp in f.get('fingerprints', []))
+        }
+        with self.lock:
+            for scene_id in hashed & set(self.held) - self.lost:
+                self.lost.add(scene_id)
+                self.stats["duplicates"] += 1
+        if config.verbose:
+            print(f"💓 Renewed {len(held)} leases")
+
+    def is_lost(self, scene_id):
+        with self.lock:
+            return scene_id in self.lost
+
+    def drop(self, scene_id):
+        # Called once a scene is finished; the tag itself is removed by release_scene/tag_scene_error
+        with self.lock:
+            self.held.pop(scene_id, None)
+            self.lost.discard(scene_id)
+            forget_release(scene_id)
+
+    def sweep_expired(self, force=False):
+        """
+        Returns scenes whose lease holder stopped renewing back to the pool.
+        Runs at most every sweep_interval seconds unless forced.
+        """
+        if config.dry_run:
+            return 0
+        if not force and time.monotonic() - self.last_sweep < self.sweep_interval:
+            return 0
+        self.last_sweep = time.monotonic()
+
+        cutoff = (datetime.now() - timedelta(seconds=self.ttl)).astimezone().isoformat(timespec='seconds')
+        expired = stash.find_scenes(
+            f={
+                "tags": {"value": [config.hashing_tag], "modifier": "INCLUDES"},
+                "updated_at": {"value": cutoff, "modifier": "LESS_THAN"},
+            },
+            filter={"per_page": -1},
+            fragment="id"
+        )
+        with self.lock:
+            expired_ids = [s['id'] for s in expired if s['id'] not in self.held]
+            self.stats["swept"] += len(expired_ids)
+        if expired_ids:
+            reclaim_scenes(expired_ids)
+            print(f"🧹 Reclaimed {len(expired_ids)} scenes with expired leases (older than {self.ttl}s)")
+        return len(expired_ids)
+
+    def heartbeat_loop(self):
+        interval = max(1, self.ttl / 3)
+        while not self.stop_event.wait(interval):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"⚠️ Lease renewal failed: {e}")
+
+    def start_heartbeat(self):
+        if self.heartbeat is None or not self.heartbeat.is_alive():
+            self.stop_event.clear()
+            self.heartbeat = threading.Thread(target=self.heartbeat_loop, daemon=True)
+            self.heartbeat.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        candidates = stats["candidates"] or 1
+        claimed = stats["claimed"] or 1
+        print(
+            f"📊 Leases: {stats['claimed']} claimed, "
+            f"collision rate {stats['collisions'] / candidates:.1%} ({stats['collisions']}), "
+            f"duplicate rate {stats['duplicates'] / claimed:.1%} ({stats['duplicates']}), "
+            f"{stats['swept']} stale leases reclaimed"
+        )
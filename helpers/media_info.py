@@ -0,0 +1,172 @@
+# media_info.py
+
+import copy
+import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+# Video file fields Stash already returns with each scene (see scene_discovery)
+STASH_FILE_FRAGMENT = "id path size duration width height video_codec audio_codec frame_rate fingerprints{value type}"
+
+
+class MediaInfo:
+    """
+    What the stages need to know about one file: duration, display size, codecs
+    and frame rate, plus keyframe positions on demand.
+
+    Built from the file fields Stash returns with the scene when they are
+    complete, otherwise from one ffprobe JSON call. Keyframe times need a
+    packet scan, so they are only read the first time a stage asks and then
+    kept on the object.
+    """
+
+    def __init__(self, filename, duration, width, height, video_codec=None, audio_codec=None,
+                 frame_rate=None, source='ffprobe', ffprobe='ffprobe'):
+        self.filename = filename
+        self.duration = float(duration)
+        self.width = int(width)
+        self.height = int(height)
+        self.video_codec = video_codec or None
+        self.audio_codec = audio_codec or None
+        self.frame_rate = float(frame_rate) if frame_rate else None
+        self.source = source
+        self.ffprobe = ffprobe
+        self.lock = threading.Lock()
+        self.keyframes = None
+
+    def for_path(self, filename):
+        """
+        The same info for a copy of the file at another path (a staged copy),
+        so the keyframe scan reads the copy.
+        """
+        if filename == self.filename:
+            return self
+        other = copy.copy(self)
+        other.filename = filename
+        other.lock = threading.Lock()
+        return other
+
+    def keyframe_times(self):
+        # Packet flags only, nothing is decoded
+        with self.lock:
+            if self.keyframes is None:
+                result = subprocess.run(
+                    [self.ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                     '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', self.filename],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=True
+                )
+                keyframes = []
+                for line in result.stdout.decode().splitlines():
+                    pts_time, _, flags = line.partition(',')
+                    if 'K' in flags and pts_time not in ('', 'N/A'):
+                        keyframes.append(float(pts_time))
+                self.keyframes = sorted(keyframes)
+            return self.keyframes
+
+    def keyframe_interval(self):
+        """
+        Median seconds between keyframes, or None for files with fewer than two.
+        Triggers the keyframe scan if it hasn't run yet.
+        """
+        keyframes = self.keyframe_times()
+        if len(keyframes) < 2:
+            return None
+        gaps = sorted(b - a for a, b in zip(keyframes, keyframes[1:]))
+        return gaps[len(gaps) // 2]
+
+    def as_dict(self):
+        return {
+            "duration": self.duration,
+            "width": self.width,
+            "height": self.height,
+            "video_codec": self.video_codec,
+            "audio_codec": self.audio_codec,
+            "frame_rate": self.frame_rate,
+        }
+
+    @classmethod
+    def from_dict(cls, filename, values, source='cache', ffprobe='ffprobe'):
+        """
+        MediaInfo from stored or Stash-reported values, or None when duration or
+        dimensions are missing (Stash reports 0 for files it couldn't probe).
+        """
+        values = values or {}
+        if not all(values.get(key) for key in ("duration", "width", "height")):
+            return None
+        return cls(
+            filename, values["duration"], values["width"], values["height"],
+            values.get("video_codec"), values.get("audio_codec"), values.get("frame_rate"),
+            source=source, ffprobe=ffprobe
+        )
+
+
+def probe_media(filename, ffprobe='ffprobe'):
+    """
+    One ffprobe call for everything in MediaInfo. Raises when the file can't be
+    probed or has no video stream.
+    """
+    result = subprocess.run(
+        [ffprobe, '-v', 'error',
+         '-show_entries', 'format=duration:stream=codec_type,codec_name,width,height,avg_frame_rate'
+                          ':stream_tags=rotate:stream_side_data=rotation',
+         '-of', 'json', filename],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True
+    )
+    info = json.loads(result.stdout)
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        raise ValueError(f"No video stream in {filename}")
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    width, height = int(video['width']), int(video['height'])
+    rotation = video.get('tags', {}).get('rotate', 0)
+    for side_data in video.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    # ffmpeg autorotates, so portrait phone footage decodes with the dimensions swapped
+    if abs(int(rotation)) % 180 == 90:
+        width, height = height, width
+
+    try:
+        frame_rate = float(Fraction(video.get('avg_frame_rate', '0/1')))
+    except (ValueError, ZeroDivisionError):
+        frame_rate = None
+
+    return MediaInfo(
+        filename, float(info['format']['duration']), width, height,
+        video.get('codec_name'), audio.get('codec_name') if audio else None, frame_rate,
+        source='ffprobe', ffprobe=ffprobe
+    )
+
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+_memo_size = 256
+
+def get_media_info(filename, ffprobe='ffprobe', stash_file=None):
+    """
+    MediaInfo for a file, memoized per path. Uses the Stash file fields when
+    they are complete and falls back to a single ffprobe call otherwise.
+    """
+    filename = os.path.abspath(filename)
+    with _memo_lock:
+        if filename in _memo:
+            _memo.move_to_end(filename)
+            return _memo[filename]
+
+    media = MediaInfo.from_dict(filename, stash_file, source='stash', ffprobe=ffprobe) if stash_file else None
+    if media is None:
+        media = probe_media(filename, ffprobe)
+
+    with _memo_lock:
+        _memo[filename] = media
+        while len(_memo) > _memo_size:
+            _memo.popitem(last=False)
+    return media
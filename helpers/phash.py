@@ -0,0 +1,162 @@
+# phash.py
+
+import io
+import math
+import subprocess
+import numpy as np
+from PIL import Image
+
+from helpers.resource_scheduler import scheduler
+from helpers.media_info import get_media_info
+
+# Montage layout and frame width used by Stash/videohashes
+COLUMNS = 5
+ROWS = 5
+FRAME_WIDTH = 160
+
+
+def phash_timestamps(duration, frame_count=COLUMNS * ROWS):
+    # Skip 5% at each end to avoid intros/outros, then sample evenly
+    offset = 0.05 * duration
+    step = (0.9 * duration) / frame_count
+    return [offset + i * step for i in range(frame_count)]
+
+
+def _resize_weights(in_size, out_size):
+    """
+    Integer bilinear weights exactly as nfnt/resize builds them (createWeights8),
+    folded into a dense (out_size, in_size) matrix. Taps that fall outside the
+    image are clamped to the edge pixel, so duplicates simply add up.
+    """
+    scale = in_size / out_size
+    filter_length = 2 * max(math.ceil(scale), 1)
+    filter_factor = min(1.0 / scale, 1.0)
+    max_x = in_size - 1
+
+    weights = np.zeros((out_size, in_size), dtype=np.int64)
+    for y in range(out_size):
+        interp = scale * (y + 0.5) - 0.5
+        start = math.trunc(interp) - filter_length // 2 + 1
+        interp -= start
+        for i in range(filter_length):
+            distance = abs((interp - i) * filter_factor)
+            coeff = math.trunc((1 - distance) * 256) if distance <= 1 else 0
+            if coeff:
+                xi = start + i
+                weights[y, min(max(xi, 0), max_x)] += coeff
+    return weights
+
+
+def _resize(image, width, height):
+    # Separable 8-bit resize: horizontal pass first, truncated to uint8, then vertical
+    wx = _resize_weights(image.shape[1], width)
+    wy = _resize_weights(image.shape[0], height)
+    pixels = image.astype(np.int64)
+    temp = np.einsum('ox,yxc->yoc', wx, pixels) // wx.sum(axis=1)[None, :, None]
+    temp = np.clip(temp, 0, 255)
+    result = np.einsum('oy,yxc->oxc', wy, temp) // wy.sum(axis=1)[:, None, None]
+    return np.clip(result, 0, 255)
+
+
+def _dct(values):
+    """
+    Unnormalised DCT-II along the last axis using Lee's recursive algorithm,
+    the same operation order goimagehash uses, so rounding matches as well.
+    """
+    n = values.shape[-1]
+    if n == 1:
+        return values.copy()
+    half = n // 2
+    head = values[..., :half]
+    tail = values[..., ::-1][..., :half]
+    factors = np.cos((np.arange(half) + 0.5) * math.pi / n) * 2
+    low = _dct(head + tail)
+    high = _dct((head - tail) / factors)
+
+    result = np.empty_like(values)
+    result[..., 0:n - 2:2] = low[..., :half - 1]
+    result[..., 1:n - 2:2] = high[..., :half - 1] + high[..., 1:half]
+    result[..., n - 2] = low[..., half - 1]
+    result[..., n - 1] = high[..., half - 1]
+    return result
+
+
+def build_montage(frames):
+    # Pastes the sampled frames (HxWx3 uint8 arrays) into the 5x5 grid Stash hashes
+    height, width = frames[0].shape[:2]
+    montage = np.zeros((height * ROWS, width * COLUMNS, 3), dtype=np.uint8)
+    for index, frame in enumerate(frames):
+        x = width * (index % COLUMNS)
+        y = height * (index // COLUMNS)
+        montage[y:y + height, x:x + width] = frame[:, :, :3]
+    return montage
+
+
+def to_array(frame, size=None):
+    if isinstance(frame, np.ndarray):
+        return frame
+    width, height = size
+    return np.frombuffer(frame, dtype=np.uint8).reshape(height, width, 3)
+
+
+def compute_phash(frames, size=None):
+    """
+    Computes the Stash/videohashes perceptual hash from the 25 sampled frames.
+    Accepts HxWx3 uint8 arrays, or raw RGB24 bytes together with their (width, height),
+    so frames already decoded for sprites or by the single pass can be reused.
+    Returns the hash as a hex string, the format update_phash expects.
+    """
+    if len(frames) != COLUMNS * ROWS:
+        raise ValueError(f"Expected {COLUMNS * ROWS} frames for phash, got {len(frames)}")
+
+    montage = build_montage([to_array(frame, size) for frame in frames])
+    resized = _resize(montage, 64, 64).astype(np.float64)
+    gray = 0.299 * resized[:, :, 0] + 0.587 * resized[:, :, 1] + 0.114 * resized[:, :, 2]
+
+    # Rows first, then only the 8 lowest-frequency columns are needed
+    coefficients = _dct(_dct(gray).T[:8]).T[:8]
+    flattened = coefficients.reshape(64)
+    median = np.sort(flattened)[32]
+
+    value = 0
+    for index, bit in enumerate(flattened > median):
+        if bit:
+            value |= 1 << (63 - index)
+    return format(value, 'x')
+
+
+class PhashGenerator:
+    """
+    Standalone phash path for when no single-pass frames are available.
+    Grabs each sample frame the way Stash does (input seek, scale=160:-2, BMP over a pipe).
+    """
+
+    def __init__(self, filename, ffmpeg='ffmpeg', ffprobe='ffprobe', media_info=None):
+        self.filename = filename
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.media_info = media_info
+
+    def get_video_duration(self):
+        if self.media_info is None:
+            self.media_info = get_media_info(self.filename, self.ffprobe)
+        return self.media_info.duration
+
+    def extract_frame(self, time):
+        command = [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-ss', str(time),
+            '-i', self.filename,
+            '-frames:v', '1',
+            '-vf', f'scale={FRAME_WIDTH}:-2',
+            '-c:v', 'bmp', '-f', 'image2pipe', 'pipe:1'
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        with Image.open(io.BytesIO(result.stdout)) as img:
+            return np.asarray(img.convert('RGB'))
+
+    def generate(self):
+        duration = self.get_video_duration()
+        with scheduler.reserve(self.filename):
+            frames = [self.extract_frame(t) for t in phash_timestamps(duration)]
+        return compute_phash(frames)
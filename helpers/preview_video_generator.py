@@ -3,14 +3,15 @@
 import subprocess
 import os
 import shutil
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
-from config import verbose, nvenc
+from config import verbose
+from helpers.resource_scheduler import scheduler
+from helpers.media_info import get_media_info
+from helpers.encoder_calibration import encoders
 
 class PreviewVideoGenerator:
     def __init__(self, filename, output_path, filehash, ffmpeg='ffmpeg', ffprobe='ffprobe',
                  num_clips=15, clip_length=1, skip_seconds=0, include_audio=True,
-                 scene_id=None, scene_name=None):
+                 scene_id=None, scene_name=None, width=640, height=360, media_info=None):
         self.filename = os.path.abspath(filename.strip('"').strip("'"))
         self.output_path = os.path.abspath(output_path)
         self.temp_dir = os.path.abspath(os.path.join(".", f"preview_temp_{filehash}"))
@@ -22,107 +23,135 @@ class PreviewVideoGenerator:
         self.ffprobe = ffprobe
         self.scene_id = scene_id
         self.scene_name = scene_name
+        self.width = width
+        self.height = height
+        self.media_info = media_info
+
+    def get_media_info(self):
+        if self.media_info is None:
+            self.media_info = get_media_info(self.filename, self.ffprobe)
+        return self.media_info
+
+    @property
+    def with_audio(self):
+        # Audio is only mapped when the source has an audio stream to map
+        return self.include_audio and bool(self.get_media_info().audio_codec)
 
     def get_video_duration(self):
-        result = subprocess.run(
-            [self.ffprobe, '-v', 'error', '-show_entries', 'format=duration',
-             '-of', 'default=noprint_wrappers=1:nokey=1', self.filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        return float(result.stdout)
+        return self.get_media_info().duration
+
+    def get_video_codec_args(self):
+        # The encoder, preset and threads calibrated for this host
+        return encoders.codec_args()
 
     def clean_previous_clips(self):
+        # Leftovers from the old per-clip encoder
         if os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
 
-    def generate_clips(self):
-        os.makedirs(self.temp_dir, exist_ok=True)
-        video_duration = self.get_video_duration()
-        start_times = self.get_start_times(video_duration)
-
-        def extract_clip(i, start_time):
-            clip_file = os.path.join(self.temp_dir, f"clip_{i:03d}.mp4")
-            command = [
-                self.ffmpeg,
-                '-ss', str(start_time),
-                '-i', self.filename,
-                '-t', str(self.clip_length),
-                '-s', '640x360',
-                '-c:v', 'h264_nvenc' if nvenc else 'libx264',
-                '-cq:v' if nvenc else '-crf', '18',
-                '-preset', 'p4' if nvenc else 'fast',
-                '-loglevel', 'quiet'
-            ]
-            if self.include_audio:
-                command.extend(['-c:a', 'aac', '-b:a', '192k', '-strict', 'experimental'])
-            else:
-                command.append('-an')
-            command.append(clip_file)
-            try:
-                subprocess.run(command, check=True)
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to generate clip {i} for scene {self.scene_id} — {self.scene_name}: {e}")
-                return None
-            return clip_file
-
-        clips = []
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(extract_clip, i, start_time) for i, start_time in enumerate(start_times)]
-            iterator = tqdm(futures, desc="🎞️ Generating Preview Clips", unit="clip") if verbose else futures
-            for future in iterator:
-                clip = future.result()
-                if clip:
-                    clips.append(clip)
-
-        return clips
-
     def get_start_times(self, video_duration):
         interval = (video_duration - self.skip_seconds - self.clip_length) / (self.num_clips + 1)
         return [self.skip_seconds + interval * i for i in range(1, self.num_clips + 1)]
 
-    def concatenate_clips(self, clips):
-        missing = [clip for clip in clips if not os.path.exists(clip)]
-        if missing:
-            raise FileNotFoundError(f"Missing clips: {missing}")
+    def build_encode_command(self, start_times):
+        """
+        One ffmpeg run for the whole preview: every clip is an input-seeked, length-limited
+        input, so only ~1 second is decoded per clip, and a concat filter joins them
+        before a single encode.
+        """
+        command = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+        for start_time in start_times:
+            command += ['-ss', str(start_time), '-t', str(self.clip_length), '-i', self.filename]
+
+        with_audio = self.with_audio
+        graph = []
+        concat_inputs = ""
+        for i in range(len(start_times)):
+            graph.append(f"[{i}:v:0]scale={self.width}:{self.height},setsar=1[v{i}]")
+            concat_inputs += f"[v{i}]"
+            if with_audio:
+                concat_inputs += f"[{i}:a:0]"
+        audio = 1 if with_audio else 0
+        graph.append(f"{concat_inputs}concat=n={len(start_times)}:v=1:a={audio}[preview]" + ("[preview_audio]" if audio else ""))
 
-        concat_file = os.path.join(self.temp_dir, "clips.txt")
-        with open(concat_file, 'w') as f:
-            for clip in sorted(clips):
-                safe_path = os.path.normpath(clip).replace("\\", "/")
-                f.write(f"file '{safe_path}'\n")
+        command += ['-filter_complex', ';'.join(graph), '-map', '[preview]', *self.get_video_codec_args()]
+        if with_audio:
+            command += ['-map', '[preview_audio]', '-c:a', 'aac', '-b:a', '192k']
+        else:
+            command.append('-an')
+        command.append(self.output_path)
+        return command
+
+    def get_copy_start_times(self, start_times):
+        """
+        Stream copy is only possible when the source is already H.264 at exactly the
+        preview size (640x360 by default; any other size is re-encoded, smaller ones too),
+        with AAC audio if audio is wanted and a keyframe within one clip length before
+        every clip start. Typical library files rarely qualify.
+        Returns the keyframe-aligned start times, or None when a re-encode is needed.
+        """
+        # Codecs and size are already known, so only a candidate source pays for the keyframe scan
+        media = self.get_media_info()
+        if media.video_codec != 'h264':
+            return None
+        if (media.width, media.height) != (self.width, self.height):
+            return None
+        if self.with_audio and media.audio_codec != 'aac':
+            return None
+
+        keyframes = media.keyframe_times()
+        copy_start_times = []
+        for start_time in start_times:
+            previous = [k for k in keyframes if k <= start_time]
+            if not previous or start_time - previous[-1] > self.clip_length:
+                return None
+            copy_start_times.append(previous[-1])
+        return copy_start_times
+
+    def build_copy_command(self, copy_start_times):
+        # The clip list goes to the concat demuxer over stdin, so nothing is written to disk
+        listing = "ffconcat version 1.0\n"
+        safe_path = self.filename.replace("\\", "/").replace("'", "'\\''")
+        for start_time in copy_start_times:
+            listing += f"file 'file:{safe_path}'\ninpoint {start_time}\noutpoint {start_time + self.clip_length}\n"
 
         command = [
-            self.ffmpeg,
-            '-f', 'concat',
-            '-safe', '0',
-            '-i', concat_file,
-            '-c:v', 'h264_nvenc' if nvenc else 'libx264',
-            '-cq:v' if nvenc else '-crf', '18',
-            '-preset', 'p4' if nvenc else 'fast',
-            '-loglevel', 'quiet'
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'concat', '-safe', '0', '-protocol_whitelist', 'file,pipe',
+            '-i', 'pipe:0',
+            '-map', '0:v:0', '-c:v', 'copy'
         ]
-        if self.include_audio:
-            command.extend(['-c:a', 'aac', '-b:a', '192k'])
+        if self.with_audio:
+            command += ['-map', '0:a:0', '-c:a', 'copy']
         else:
             command.append('-an')
-
         command.append(self.output_path)
+        return command, listing.encode()
 
+    def stream_copy(self, start_times):
         try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Failed to concatenate preview for scene {self.scene_id} — {self.scene_name}: {e}")
-            raise RuntimeError(f"FFmpeg failed to concatenate clips: {e}")
+            copy_start_times = self.get_copy_start_times(start_times)
+            if copy_start_times is None:
+                return False
+            command, listing = self.build_copy_command(copy_start_times)
+            # Remux only: needs a read slot but no decoder or encoder
+            with scheduler.reserve(self.filename, decode=0):
+                subprocess.run(command, input=listing, check=True)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            if verbose:
+                print(f"⚠️ Stream copy preview failed for scene {self.scene_id} — {self.scene_name}, re-encoding: {e}")
+            return False
+        if verbose:
+            print(f"⚡ Preview stream-copied for scene {self.scene_id} — {self.scene_name}")
+        return True
 
     def generate_preview(self):
         self.clean_previous_clips()
-        clips = self.generate_clips()
-        if not clips:
-            print(f"❌ No clips generated for scene {self.scene_id} — {self.scene_name}")
-            return
         try:
-            self.concatenate_clips(clips)
+            start_times = self.get_start_times(self.get_video_duration())
+            if not self.stream_copy(start_times):
+                with scheduler.reserve(self.filename, encode=1):
+                    subprocess.run(self.build_encode_command(start_times), check=True)
             if os.path.exists(self.output_path):
                 if verbose:
                     print(f"🎞️ Preview video created for ID {self.scene_id} — {self.scene_name} → {self.output_path}")
@@ -130,5 +159,5 @@ class PreviewVideoGenerator:
                 print(f"❌ Preview video not created for ID {self.scene_id} — {self.scene_name}")
         except Exception as e:
             print(f"❌ Preview generation failed for scene {self.scene_id} — {self.scene_name}: {e}")
-        finally:
-            self.clean_previous_clips()
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
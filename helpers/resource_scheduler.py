@@ -0,0 +1,173 @@
+# resource_scheduler.py
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import config
+from helpers.storage_locality import read_limit, volume_of
+from helpers.telemetry import metrics
+
+
+class ResizableSemaphore:
+    """
+    Counting semaphore whose capacity can be changed while it is in use.
+    Shrinking never interrupts current holders; new acquires just wait until
+    usage drops below the new capacity.
+
+    Threads wait in acquire(); asyncio tasks wait in acquire_async() on a future
+    that release() wakes, so both engines share one budget without a task ever
+    blocking its event loop.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self.condition = threading.Condition()
+        self.acquires = 0
+        self.waited = 0.0  # total seconds callers spent blocked in acquire()
+        self.async_waiters = []  # (loop, future) of tasks waiting in acquire_async()
+
+    def acquire(self, count=1):
+        # A request larger than the whole budget is capped so it can't wait forever
+        with self.condition:
+            count = min(count, self.capacity)
+            started = time.monotonic()
+            while self.in_use + count > self.capacity:
+                self.condition.wait()
+            self.in_use += count
+            self.acquires += 1
+            self.waited += time.monotonic() - started
+            return count
+
+    async def acquire_async(self, count=1):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        while True:
+            with self.condition:
+                count = min(count, self.capacity)
+                if self.in_use + count <= self.capacity:
+                    self.in_use += count
+                    self.acquires += 1
+                    self.waited += time.monotonic() - started
+                    return count
+                future = loop.create_future()
+                self.async_waiters.append((loop, future))
+            await future
+
+    def wake(self):
+        # Called with the condition held
+        self.condition.notify_all()
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def release(self, count=1):
+        with self.condition:
+            self.in_use = max(0, self.in_use - count)
+            self.wake()
+
+    def resize(self, capacity):
+        with self.condition:
+            self.capacity = max(1, capacity)
+            self.wake()
+
+
+class ResourceScheduler:
+    """
+    Node-wide budgets shared by every worker thread:
+    - decode: ffmpeg/videohashes processes decoding video
+    - encode: preview encoder sessions (NVENC caps concurrent sessions)
+    - read: readers per storage volume (translated root or mount), so one slow disk
+      or share isn't hammered; config.mount_read_limits overrides it per volume
+
+    Every ffmpeg launch reserves what it needs through reserve(), so the number of
+    processes stays bounded by the budgets however many scenes max_workers runs.
+    Resources are always taken in the order read, decode, encode and reservations
+    are never nested, so waiting can't deadlock.
+    """
+
+    def __init__(self, decode_slots, encoder_sessions, mount_read_slots):
+        self.decode = ResizableSemaphore(decode_slots)
+        self.encode = ResizableSemaphore(encoder_sessions)
+        self.mount_read_slots = mount_read_slots
+        self.mounts = {}
+        self.lock = threading.Lock()
+        self.wait_time = 0.0
+
+    def configure(self, decode_slots, encoder_sessions, mount_read_slots):
+        self.decode.resize(decode_slots)
+        self.encode.resize(encoder_sessions)
+        with self.lock:
+            self.mount_read_slots = mount_read_slots
+            for volume, semaphore in self.mounts.items():
+                semaphore.resize(read_limit(volume, mount_read_slots))
+
+    def read_slots(self, path):
+        volume = volume_of(path)
+        with self.lock:
+            if volume not in self.mounts:
+                self.mounts[volume] = ResizableSemaphore(read_limit(volume, self.mount_read_slots))
+            return self.mounts[volume]
+
+    @contextmanager
+    def reserve(self, path=None, decode=1, encode=0):
+        """
+        Blocks until a read slot on path's mount, `decode` decode slots and
+        `encode` encoder sessions are free, and holds them for the with-block.
+        """
+        held = []
+        started = time.monotonic()
+        try:
+            for semaphore, count in self.wanted(path, decode, encode):
+                held.append((semaphore, semaphore.acquire(count)))
+            self.note_wait(path, time.monotonic() - started)
+            metrics.add("media_processes_active", 1)
+            try:
+                yield
+            finally:
+                metrics.add("media_processes_active", -1)
+        finally:
+            for semaphore, count in reversed(held):
+                semaphore.release(count)
+
+    @asynccontextmanager
+    async def reserve_async(self, path=None, decode=1, encode=0):
+        """
+        reserve() for asyncio tasks: waits without blocking the event loop.
+        """
+        held = []
+        started = time.monotonic()
+        try:
+            for semaphore, count in self.wanted(path, decode, encode):
+                held.append((semaphore, await semaphore.acquire_async(count)))
+            self.note_wait(path, time.monotonic() - started)
+            metrics.add("media_processes_active", 1)
+            try:
+                yield
+            finally:
+                metrics.add("media_processes_active", -1)
+        finally:
+            for semaphore, count in reversed(held):
+                semaphore.release(count)
+
+    def wanted(self, path, decode, encode):
+        # In the fixed order read, decode, encode
+        if path:
+            yield self.read_slots(path), 1
+        if decode:
+            yield self.decode, decode
+        if encode:
+            yield self.encode, encode
+
+    def note_wait(self, path, waited):
+        with self.lock:
+            self.wait_time += waited
+        metrics.observe("scheduler_wait_seconds", waited)
+        if config.verbose and waited >= 1:
+            print(f"🚦 Waited {waited:.1f}s for capacity on {os.path.basename(path) if path else 'ffmpeg'}")
+
+
+scheduler = ResourceScheduler(config.decode_slots, config.encoder_sessions, config.mount_read_slots)
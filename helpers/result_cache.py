@@ -0,0 +1,202 @@
+# result_cache.py
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    oshash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    phash TEXT,
+    duration REAL,
+    streams TEXT,
+    artifacts TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+class ResultCache:
+    """
+    Per-node SQLite cache of work already done for a file, so a scene that comes
+    back (failed Stash update, restart mid-batch, re-queue) isn't decoded again.
+
+    Entries are keyed by oshash and only trusted while the file's size and mtime
+    still match. They hold the phash, probed duration, stream info and the
+    artifacts that were written. Old entries are evicted by age and by count,
+    least recently used first.
+    """
+
+    def __init__(self, path, max_entries=100000, max_age_days=90):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def file_key(self, filename):
+        stat = os.stat(filename)
+        return stat.st_size, int(stat.st_mtime)
+
+    def get(self, oshash, filename):
+        """
+        Cached entry for the file as a dict, or None when there is none or the
+        file changed since it was cached.
+        """
+        try:
+            size, mtime = self.file_key(filename)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT phash, duration, streams, artifacts FROM results WHERE oshash = ? AND size = ? AND mtime = ?",
+                (oshash, size, mtime)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE results SET accessed_at = ? WHERE oshash = ?", (time.time(), oshash))
+            self.db.commit()
+        phash, duration, streams, artifacts = row
+        return {
+            "phash": phash,
+            "duration": duration,
+            "streams": json.loads(streams) if streams else None,
+            "artifacts": json.loads(artifacts),
+        }
+
+    def put(self, oshash, filename, phash=None, duration=None, streams=None, artifacts=()):
+        """
+        Merges new results into the file's entry. Values left as None keep what was
+        cached before; artifacts are added to the recorded set.
+        """
+        if config.dry_run:
+            return
+        size, mtime = self.file_key(filename)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT phash, duration, streams, artifacts FROM results WHERE oshash = ? AND size = ? AND mtime = ?",
+                (oshash, size, mtime)
+            ).fetchone()
+            if row:
+                phash = phash or row[0]
+                duration = duration if duration is not None else row[1]
+                streams = streams if streams is not None else (json.loads(row[2]) if row[2] else None)
+                artifacts = sorted(set(json.loads(row[3])) | set(artifacts))
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (oshash, size, mtime, phash, duration, streams, artifacts, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT created_at FROM results WHERE oshash = ?), ?), ?)",
+                (oshash, size, mtime, phash, duration, json.dumps(streams) if streams is not None else None,
+                 json.dumps(sorted(artifacts)), oshash, now, now)
+            )
+            self.db.commit()
+
+    def add_artifact(self, oshash, filename, artifact):
+        self.put(oshash, filename, artifacts=[artifact])
+
+    def prune(self, max_entries=None, max_age_days=None):
+        """
+        Drops entries not used for max_age_days, then the least recently used
+        ones beyond max_entries. Returns the number of entries removed.
+        """
+        max_entries = self.max_entries if max_entries is None else max_entries
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        with self.lock:
+            removed = self.db.execute(
+                "DELETE FROM results WHERE accessed_at < ?", (time.time() - max_age_days * 86400,)
+            ).rowcount
+            removed += self.db.execute(
+                "DELETE FROM results WHERE oshash NOT IN (SELECT oshash FROM results ORDER BY accessed_at DESC LIMIT ?)",
+                (max_entries,)
+            ).rowcount
+            self.db.commit()
+        return removed
+
+    def stats(self):
+        with self.lock:
+            entries, hashed, oldest = self.db.execute(
+                "SELECT COUNT(*), COUNT(phash), MIN(accessed_at) FROM results"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "with_phash": hashed,
+            "oldest_access": oldest,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def show(self, oshash):
+        with self.lock:
+            self.db.row_factory = sqlite3.Row
+            try:
+                row = self.db.execute("SELECT * FROM results WHERE oshash = ?", (oshash,)).fetchone()
+            finally:
+                self.db.row_factory = None
+        return dict(row) if row else None
+
+    def clear(self):
+        with self.lock:
+            removed = self.db.execute("DELETE FROM results").rowcount
+            self.db.commit()
+        return removed
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """
+    The node's shared cache, opened (and pruned) on first use. None when
+    result_cache_path is empty.
+    """
+    global _cache
+    if not config.result_cache_path:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(config.result_cache_path, config.result_cache_max_entries, config.result_cache_max_age_days)
+            removed = _cache.prune()
+            if removed and config.verbose:
+                print(f"🧹 Pruned {removed} old entries from the result cache")
+    return _cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the local result cache")
+    parser.add_argument("--path", default=config.result_cache_path, help=f"Cache database (default: {config.result_cache_path})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show entry counts and database size")
+    show = commands.add_parser("show", help="Show the cached entry for an oshash")
+    show.add_argument("oshash")
+    prune = commands.add_parser("prune", help="Evict old and least recently used entries")
+    prune.add_argument("--max-entries", type=int, default=config.result_cache_max_entries)
+    prune.add_argument("--max-age-days", type=int, default=config.result_cache_max_age_days)
+    commands.add_parser("clear", help="Remove every entry")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.path)
+    if args.command == "stats":
+        stats = cache.stats()
+        oldest = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats["oldest_access"])) if stats["oldest_access"] else "-"
+        print(f"📦 {stats['entries']} entries ({stats['with_phash']} with phash), {stats['size_bytes'] / 1024:.0f} KiB, oldest access {oldest}")
+    elif args.command == "show":
+        entry = cache.show(args.oshash)
+        print(json.dumps(entry, indent=2) if entry else f"🚫 No entry for {args.oshash}")
+    elif args.command == "prune":
+        print(f"🧹 Removed {cache.prune(args.max_entries, args.max_age_days)} entries")
+    elif args.command == "clear":
+        print(f"🧹 Removed {cache.clear()} entries")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,112 @@
 # scene_discovery.py
 
 import random
-from helpers.stash_utils import stash
+from datetime import datetime, timedelta
+from helpers.stash_utils import stash, build_scene_filter, get_total_scene_count, note_scenes_claimed, find_scenes_missing_cover
+from helpers.media_info import STASH_FILE_FRAGMENT
+from helpers.telemetry import metrics
 import config
 
+def fetch_page(page):
+    # Fetch one page of scenes with the metadata process_scene needs, including the
+    # probe results Stash already has (duration, size, codecs) so nodes don't re-probe
+    with metrics.stage("discovery_page"):
+        return stash.find_scenes(
+            f=build_scene_filter(),
+            filter={
+                "sort": "created_at",           # Sort by creation date (newest first)
+                "direction": "DESC",
+                "per_page": config.per_page,    # Limit to configured batch size
+                "page": page                    # Use randomly selected page
+            },
+            fragment=f"id files{{{STASH_FILE_FRAGMENT}}} paths{{screenshot}}"
+        )
+
+def newest_update():
+    """
+    updated_at of the most recently created or changed scene in Stash (any
+    scene, hashed or not), or None for an empty library. Stash's own clock, so
+    a cursor started from it doesn't depend on this node's.
+    """
+    with metrics.stage("discovery_cursor"):
+        scenes = stash.find_scenes(
+            filter={"sort": "updated_at", "direction": "DESC", "per_page": 1},
+            fragment="id updated_at"
+        )
+    return scenes[0]['updated_at'] if scenes else None
+
+def fetch_updated_since(cursor):
+    """
+    The oldest page of scenes needing work that were created or changed at or
+    after cursor (one second of overlap, since Stash timestamps have whole
+    seconds), oldest first. A new scene's created_at is its updated_at, so this
+    also covers scenes re-queued by clearing a phash or an error tag.
+    """
+    scene_filter = build_scene_filter()
+    if cursor:
+        since = datetime.fromisoformat(cursor.replace('Z', '+00:00')) - timedelta(seconds=1)
+        scene_filter["updated_at"] = {"value": since.isoformat(timespec='seconds'), "modifier": "GREATER_THAN"}
+    with metrics.stage("discovery_new"):
+        return stash.find_scenes(
+            f=scene_filter,
+            filter={"sort": "updated_at", "direction": "ASC", "per_page": config.per_page},
+            fragment=f"id updated_at files{{{STASH_FILE_FRAGMENT}}} paths{{screenshot}}"
+        )
+
+def mark_missing_covers(scenes):
+    # One is_missing query for the batch instead of downloading every screenshot.
+    # Without the flag, process_scene checks the screenshot itself.
+    try:
+        with metrics.stage("discovery_covers"):
+            missing = find_scenes_missing_cover([s['id'] for s in scenes])
+    except Exception as e:
+        print(f"⚠️ Bulk cover check failed, covers will be checked per scene: {e}")
+        return
+    for scene in scenes:
+        scene['missing_cover'] = scene['id'] in missing
+
 def discover_scenes():
-    # Use the current value of config.config.per_page, which may be overridden by CLI
+    # Use the current value of config.per_page, which may be overridden by CLI
     """
     Discovers a random batch of scenes to process.
     - Filters scenes that do not yet have a phash
     - Excludes scenes already tagged with hashing_tag, hashing_error_tag, or cover_error_tag
+    - Excludes config.excluded_paths on the server
     - Randomly selects one page of scenes to avoid overlap across multiple systems
+    - Flags scenes without a cover image (missing_cover) with one query for the page
+    The cost is one page query per batch; the total comes from a cached count-only query.
     """
 
-    # Step 1: Query all matching scene IDs (lightweight query, only returns 'id')
-    # This helps determine how many total scenes are available for processing
-    all_scenes = stash.find_scenes(
-        f={
-            "phash": {"value": "", "modifier": "IS_NULL"},
-            "tags": {"value": [config.hashing_tag, config.hashing_error_tag, config.cover_error_tag], "modifier": "EXCLUDES"},
-        },
-        filter={"per_page": -1},  # Retrieve all matching scene IDs
-        fragment="id files{path}"
-    )
-
-    if config.excluded_paths:
-        all_scenes = [s for s in all_scenes if not any(ep in s['files'][0]['path'] for ep in config.excluded_paths)]
-
-    # Step 2: Count total matching scenes
-    total_count = len(all_scenes)
+    # Step 1: Get the number of matching scenes (count-only, cached across batches)
+    total_count = get_total_scene_count()
+    if total_count == 0:
+        # A cached zero may be stale if new scenes were added since, so confirm it
+        total_count = get_total_scene_count(refresh=True)
     if total_count == 0:
         print("🚫 No scenes found to process.")
         return []
 
-    # Step 3: Calculate total number of pages based on configured batch size
-    total_pages = max(1, (total_count + config.per_page - 1) // config.per_page)
+    for attempt in range(2):
+        # Step 2: Calculate total number of pages based on configured batch size
+        total_pages = max(1, (total_count + config.per_page - 1) // config.per_page)
 
-    # Step 4: Randomly select one page to process
-    # This helps distribute work across multiple systems without overlap
-    selected_page = random.randint(1, total_pages)
-    print(f"🎯 Selected page {selected_page} of {total_pages} (batch size: {config.per_page}, total: {total_count})")
+        # Step 3: Randomly select one page to process
+        # This helps distribute work across multiple systems without overlap
+        selected_page = random.randint(1, total_pages)
+        print(f"🎯 Selected page {selected_page} of {total_pages} (batch size: {config.per_page}, total: {total_count})")
 
-    # Step 5: Fetch the selected page of scenes with full metadata
-    # These scenes will be claimed and processed by this node
-    batch_scenes = stash.find_scenes(
-        f={
-            "phash": {"value": "", "modifier": "IS_NULL"},
-            "tags": {"value": [config.hashing_tag, config.hashing_error_tag, config.cover_error_tag], "modifier": "EXCLUDES"},
-        },
-        filter={
-            "sort": "created_at",           # Sort by creation date (newest first)
-            "direction": "DESC",
-            "per_page": config.per_page,           # Limit to configured batch size
-            "page": selected_page           # Use randomly selected page
-        },
-        fragment="id files{id path fingerprints{value type}} paths{screenshot}"
-    )
+        # Step 4: Fetch the selected page of scenes with full metadata
+        # These scenes will be claimed and processed by this node
+        batch_scenes = fetch_page(selected_page)
+        if batch_scenes:
+            note_scenes_claimed(len(batch_scenes))
+            mark_missing_covers(batch_scenes)
+            return batch_scenes
 
-    if config.excluded_paths:
-        batch_scenes = [s for s in batch_scenes if not any(ep in s['files'][0]['path'] for ep in config.excluded_paths)]
+        # The cached total was too high (other nodes drained the tail), recount and retry
+        total_count = get_total_scene_count(refresh=True)
+        if total_count == 0:
+            break
 
-    # Step 6: Return the batch of scenes to be processed
-    return batch_scenes
+    print("🚫 No scenes found to process.")
+    return []
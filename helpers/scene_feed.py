@@ -0,0 +1,108 @@
+# scene_feed.py
+
+import itertools
+import threading
+from collections import deque
+
+
+class SceneFeed:
+    """
+    Background producer for the worker pool.
+
+    Keeps the next batch ready while the current one drains: as soon as the number
+    of queued scenes drops to low_water, a new batch is discovered and claimed on
+    this thread, so workers pick up a new scene the moment they free up instead of
+    waiting for the slowest scene of the batch.
+
+    fetch_batch() returns the claimed scenes of one batch, an empty list when every
+    candidate was taken by another node (fetch again), or None when nothing is left.
+    When given, order() reorders everything queued each time a batch arrives, so
+    leftovers of the previous batch compete with the new scenes, and choose(queue)
+    picks the index get() hands out next instead of the head of the queue.
+    """
+
+    def __init__(self, fetch_batch, low_water, once=False, retry_delay=5, order=None, choose=None):
+        self.fetch_batch = fetch_batch
+        self.order = order
+        self.choose = choose
+        self.low_water = low_water
+        self.once = once
+        self.retry_delay = retry_delay
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.exhausted = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) > self.low_water and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+
+            try:
+                batch = self.fetch_batch()
+            except Exception as e:
+                print(f"⚠️ Failed to fetch the next batch, retrying in {self.retry_delay}s: {e}")
+                with self.condition:
+                    self.condition.wait_for(lambda: self.stopped, timeout=self.retry_delay)
+                continue
+
+            with self.condition:
+                if batch is None:
+                    self.exhausted = True
+                else:
+                    self.queue.extend((scene, index, len(batch)) for index, scene in enumerate(batch, start=1))
+                    if self.order:
+                        self.queue = deque(self.order(list(self.queue)))
+                    self.exhausted = self.once and bool(batch)
+                self.condition.notify_all()
+                if self.exhausted:
+                    return
+
+    def get(self, block=True):
+        """
+        Next (scene, index, batch_size), or None when nothing is queued right now
+        (block=False) or nothing is left at all.
+        """
+        with self.condition:
+            while block and not self.queue and not self.exhausted and not self.stopped:
+                self.condition.wait()
+            if not self.queue:
+                return None
+            if self.choose:
+                position = self.choose(self.queue)
+                item = self.queue[position]
+                del self.queue[position]
+            else:
+                item = self.queue.popleft()
+            self.condition.notify_all()
+            return item
+
+    def peek(self, count):
+        """
+        The next count queued scenes in queue order, left in the queue.
+        """
+        with self.condition:
+            return [scene for scene, _, _ in itertools.islice(self.queue, count)]
+
+    @property
+    def done(self):
+        with self.condition:
+            return (self.exhausted or self.stopped) and not self.queue
+
+    def stop(self):
+        """
+        Stops fetching and returns the scenes that were queued but never started.
+        """
+        with self.condition:
+            self.stopped = True
+            pending = [scene for scene, _, _ in self.queue]
+            self.queue.clear()
+            self.condition.notify_all()
+        return pending
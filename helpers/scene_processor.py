@@ -1,5 +1,6 @@
 # scene_processor.py
 
+import asyncio
 import os
 import re
 import subprocess
@@ -7,30 +8,252 @@ import json
 import string
 import base64
 import random
-import requests
 import shutil
-from json.decoder import JSONDecodeError
 from datetime import datetime
 
 from helpers.video_sprite_generator import VideoSpriteGenerator
 from helpers.preview_video_generator import PreviewVideoGenerator
+from helpers.single_pass import SinglePassPipeline
+from helpers.phash import PhashGenerator, compute_phash
+from helpers.cover_generator import CoverGenerator, cover_time
+from helpers.resource_scheduler import scheduler
+from helpers.result_cache import get_result_cache
+from helpers.duplicate_index import get_duplicate_index
+from helpers.media_info import MediaInfo, get_media_info
+from helpers.storage_locality import translate_path
+from helpers.staging_cache import staging
+from helpers.async_subprocess import run_command
+from helpers.telemetry import metrics
 
-from config import (
-    windows, binary, ffmpeg, ffprobe,
-    generate_sprite, generate_preview, sprite_path, preview_path,
-    preview_audio, preview_clips, preview_clip_length, preview_skip_seconds,
-    translations, dry_run, verbose,
-    hashing_tag, hashing_error_tag, cover_error_tag
-)
+import config
 
 from helpers.stash_utils import (
-    claim_scene, release_scene, tag_scene_error,
-    update_phash, update_cover, log_scene_failure
+    release_scene, tag_scene_error,
+    update_phash, update_cover, log_scene_failure, screenshot_is_placeholder
 )
 
+def extract_cover(scene_id, filename, filename_pretty, media, send=None):
+    generator = CoverGenerator(filename, config.ffmpeg, config.ffprobe, config.cover_candidates, media_info=media)
+
+    if config.dry_run:
+        print(f"[DRY RUN] Would extract cover image using: {' '.join(generator.build_command(cover_time(media.duration)))}")
+        return False
+
+    try:
+        encoded = base64.b64encode(generator.generate()).decode()
+        (send or (lambda data: update_cover(scene_id, data)))("data:image/jpg;base64," + encoded)
+        return True
+    except Exception as e:
+        log_scene_failure(scene_id, filename_pretty, "cover image generation", e)
+        tag_scene_error(scene_id, config.cover_error_tag, str(e))
+        return False
+
+def compute_scene_phash(filename, artifacts, media):
+    if config.phash_engine == "binary":
+        with scheduler.reserve(filename):
+            result = subprocess.run([config.binary, '-json', filename], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+        return json.loads(result.stdout.decode("utf-8"))['phash']
+    if 'phash_frames' in artifacts:
+        return compute_phash(artifacts['phash_frames'])
+    return PhashGenerator(filename, config.ffmpeg, config.ffprobe, media_info=media).generate()
+
+async def compute_binary_phash_async(filename):
+    # The videohashes binary as an asyncio subprocess, for the async engine
+    async with scheduler.reserve_async(filename):
+        output = await run_command([config.binary, '-json', filename], capture=True)
+    return json.loads(output.decode("utf-8"))['phash']
+
+def single_pass_pipeline(filename, filehash, sprite_generator, preview_generator, needs_cover, media, needs_phash):
+    if not config.single_pass or config.dry_run:
+        return None
+    # Only the sprite and preview decode the whole stream; a cover or phash alone is
+    # cheaper as the per-stage seeks, so they only ride along with a full decode
+    if not (sprite_generator or preview_generator):
+        return None
+    return SinglePassPipeline(
+        filename, filehash, config.ffmpeg, config.ffprobe,
+        sprite_generator=sprite_generator, preview_generator=preview_generator, cover=needs_cover,
+        phash=needs_phash and config.phash_engine == "native", media_info=media
+    )
+
+def run_single_pass(scene_id, filename, filename_pretty, filehash, sprite_generator, preview_generator, needs_cover, media, needs_phash=True):
+    """
+    Decodes the file once for every artifact that is still missing, when a sprite
+    or preview needs the full decode anyway. Returns None when the single pass is
+    disabled, not needed or fails, in which case the per-stage generators below
+    do the work as before.
+    """
+    pipeline = single_pass_pipeline(filename, filehash, sprite_generator, preview_generator, needs_cover, media, needs_phash)
+    if pipeline is None:
+        return None
+    try:
+        return pipeline.run()
+    except Exception as e:
+        print(f"⚠️ Single pass failed for scene {scene_id} — {filename_pretty}, falling back to per-stage generation: {e}")
+        pipeline.clean_up()
+        return None
+
+async def run_single_pass_async(job):
+    # run_single_pass() for the async engine
+    pipeline = single_pass_pipeline(
+        job.filename, job.filehash, job.sprite_generator, job.preview_generator,
+        job.single_pass_cover, job.media, not job.cached_phash
+    )
+    if pipeline is None:
+        return None
+    try:
+        return await pipeline.run_async()
+    except Exception as e:
+        print(f"⚠️ Single pass failed for scene {job.scene_id} — {job.filename_pretty}, falling back to per-stage generation: {e}")
+        await asyncio.to_thread(pipeline.clean_up)
+        return None
+
 def process_scene(scene, index=None, total_batch=None):
+    try:
+        with metrics.stage("scene", scene['id']):
+            result = run_scene(scene, index, total_batch)
+    finally:
+        staging.release(scene)
+    metrics.inc("scenes_total", result=result)
+    return result
+
+async def process_scene_async(scene, index=None, total_batch=None, client=None):
+    try:
+        with metrics.stage("scene", scene['id']):
+            result = await run_scene_async(scene, index, total_batch, client)
+    finally:
+        staging.release(scene)
+    metrics.inc("scenes_total", result=result)
+    return result
+
+class SceneJob:
+    """
+    What prepare_scene() found out about a scene and what is still missing,
+    handed to the single pass and then to finish_scene().
+    """
+
+    def __init__(self, scene, filename, filename_pretty, filehash):
+        self.scene = scene
+        self.scene_id = scene['id']
+        self.file_id = scene['files'][0]['id']
+        self.filename = filename
+        self.source = filename  # the translated path when filename is a staged copy
+        self.filename_pretty = filename_pretty
+        self.filehash = filehash
+        self.cache = None
+        self.duplicates = None
+        self.cached_phash = None
+        self.media = None
+        self.needs_cover = False
+        self.sprite_file = None
+        self.vtt_file = None
+        self.sprite_generator = None
+        self.preview_file = None
+        self.preview_generator = None
+        self.deferred = None  # set to a list to collect the Stash writes instead of sending them
+
+    def send_phash(self, phash):
+        if self.deferred is None:
+            update_phash(self.file_id, phash)
+        else:
+            self.deferred.append(("phash", phash))
+
+    def send_cover(self, cover_data):
+        if self.deferred is None:
+            return update_cover(self.scene_id, cover_data)
+        self.deferred.append(("cover", cover_data))
+        return True
+
+    def release(self):
+        # Deferred writes end with the release so a scene is never released before its phash is stored
+        if self.deferred is None:
+            release_scene(self.scene_id)
+        else:
+            self.deferred.append(("release", None))
+
+    @property
+    def single_pass_cover(self):
+        # The single pass grabs one fixed frame, so picking among candidates is left to the cover stage
+        return self.needs_cover and config.cover_candidates <= 1
+
+def run_scene(scene, index, total_batch):
+    """
+    The work of process_scene, one timed stage at a time. Returns how the scene
+    ended: "done", "missing_file" or "error".
+    """
+    job = prepare_scene(scene, index, total_batch)
+    if isinstance(job, str):
+        return job
+
+    with metrics.stage("single_pass", job.scene_id):
+        artifacts = run_single_pass(
+            job.scene_id, job.filename, job.filename_pretty, job.filehash, job.sprite_generator, job.preview_generator,
+            job.single_pass_cover, job.media, needs_phash=not job.cached_phash
+        ) or {}
+
+    return finish_scene(job, artifacts)
+
+async def run_scene_async(scene, index, total_batch, client=None):
+    """
+    run_scene() for the async engine. ffmpeg and videohashes run as asyncio
+    subprocesses; the short blocking parts (file checks, cache, probe, frame
+    assembly, phash math) run on the loop's small thread pool. With a client,
+    the phash, cover and release are sent over it once the scene is finished.
+    """
+    if client and 'missing_cover' not in scene and scene['paths'].get('screenshot'):
+        try:
+            with metrics.stage("cover_check", scene['id']):
+                scene['missing_cover'] = await client.screenshot_is_placeholder(scene['paths']['screenshot'])
+        except Exception:
+            pass  # prepare_scene checks again and reports the failure
+
+    await staging.wait_async(translate_path(scene['files'][0]['path']))
+    job = await asyncio.to_thread(prepare_scene, scene, index, total_batch)
+    if isinstance(job, str):
+        return job
+    if client and not config.dry_run:
+        job.deferred = []
+
+    with metrics.stage("single_pass", job.scene_id):
+        artifacts = await run_single_pass_async(job) or {}
+
+    phash = None
+    if config.phash_engine == "binary" and not job.cached_phash and not config.dry_run:
+        try:
+            with metrics.stage("phash", job.scene_id):
+                phash = await compute_binary_phash_async(job.filename)
+        except Exception as e:
+            log_scene_failure(job.scene_id, job.filename_pretty, "hashing", e)
+            tag_scene_error(job.scene_id, config.hashing_error_tag, str(e))
+            return "error"
+
+    result = await asyncio.to_thread(finish_scene, job, artifacts, phash)
+
+    for op, value in job.deferred or ():
+        try:
+            if op == "phash":
+                await client.set_phash(job.file_id, value)
+            elif op == "cover":
+                await client.update_cover(job.scene_id, value)
+            else:
+                release_scene(job.scene_id)
+        except Exception as e:
+            if op == "cover":
+                log_scene_failure(job.scene_id, job.filename_pretty, "cover image generation", e)
+                tag_scene_error(job.scene_id, config.cover_error_tag, str(e))
+                continue
+            log_scene_failure(job.scene_id, job.filename_pretty, "hashing", e)
+            tag_scene_error(job.scene_id, config.hashing_error_tag, str(e))
+            return "error"
+    return result
+
+def prepare_scene(scene, index, total_batch):
+    """
+    Everything before the first decode: path translation, cached results, the
+    media probe and which artifacts are missing. Returns a SceneJob, or how the
+    scene ended if it can't go further.
+    """
     scene_id = scene['id']
-    file_id = scene['files'][0]['id']
     filename = scene['files'][0]['path']
     filename_pretty = re.search(r'.*[/\\](.*?)$', filename).group(1)
 
@@ -40,108 +263,190 @@ def process_scene(scene, index=None, total_batch=None):
     else:
         print(f"[{timestamp}] 📦 Processing scene: ID {scene_id} — {filename_pretty}")
 
-    for t in translations:
-        filename = filename.replace(t['orig'], t['local'], 1)
+    filename = translate_path(filename)
 
     filehash = ""
     for fp in scene['files'][0].get('fingerprints', []):
         if fp['type'].lower() == "oshash":
             filehash = fp['value']
 
-    if not filehash or ":" in filehash or "\\" in filehash or "/" in filehash:
+    has_oshash = bool(filehash) and not any(c in filehash for c in (":", "\\", "/"))
+    if not has_oshash:
         filehash = ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
 
-    filename = os.path.normpath(filename)
     file_exists = os.path.exists(filename)
 
-    if verbose:
+    if config.verbose:
         print(f"🔍 Translated path: {filename}")
         print(f"📂 File exists: {file_exists}")
 
     if not file_exists:
         log_scene_failure(scene_id, filename_pretty, "file check", "File not found after translation")
-        tag_scene_error(scene_id, hashing_error_tag, "File not found after translation")
-        return
+        tag_scene_error(scene_id, config.hashing_error_tag, "File not found after translation")
+        return "missing_file"
+
+    # Work already done for this exact file on an earlier attempt
+    cache = get_result_cache() if has_oshash else None
+    cached = cache.get(filehash, filename) if cache else None
+    cached_phash = cached['phash'] if cached else None
+    if cached and config.verbose:
+        print(f"♻️ Cached results for {filename_pretty}: phash={cached_phash}, artifacts={', '.join(cached['artifacts']) or 'none'}")
+
+    # The same file (a byte-identical copy) hashed before for another scene
+    duplicates = get_duplicate_index() if has_oshash else None
+    known = duplicates.lookup(filehash, os.path.getsize(filename)) if duplicates and not cached_phash else None
+    if known:
+        cached_phash = known['phash']
+
+    # Probed once (or taken from Stash's own probe) and handed to every stage
+    try:
+        with metrics.stage("probe", scene_id):
+            media = MediaInfo.from_dict(filename, cached['streams'], ffprobe=config.ffprobe) if cached else None
+            media = media or get_media_info(filename, config.ffprobe, stash_file=scene['files'][0])
+    except Exception as e:
+        log_scene_failure(scene_id, filename_pretty, "media probe", e)
+        tag_scene_error(scene_id, config.hashing_error_tag, str(e))
+        return "error"
+    if config.verbose:
+        print(f"🎬 {media.video_codec or 'unknown codec'} {media.width}x{media.height}, {media.duration:.1f}s (from {media.source})")
+
+    # Covers belong to the scene, not the file, so this is checked per scene and never cached
+    needs_cover = False
+    try:
+        if 'missing_cover' in scene:
+            needs_cover = scene['missing_cover']
+        else:
+            with metrics.stage("cover_check", scene_id):
+                needs_cover = screenshot_is_placeholder(scene['paths'].get('screenshot'))
+    except Exception as e:
+        log_scene_failure(scene_id, filename_pretty, "cover image setup", e)
+        tag_scene_error(scene_id, config.cover_error_tag, str(e))
+
+    sprite_file = os.path.join(config.sprite_path, f"{filehash}_sprite.jpg")
+    vtt_file = os.path.join(config.sprite_path, f"{filehash}_thumbs.vtt")
+    preview_file = os.path.join(config.preview_path, f"{filehash}.mp4")
+    if known:
+        duplicates.reuse(known, scene_id, filename_pretty)
+
+    sprite_missing = config.generate_sprite and not os.path.exists(sprite_file)
+    preview_missing = config.generate_preview and not os.path.exists(preview_file)
+    source = filename
+    if sprite_missing or preview_missing or needs_cover or not cached_phash:
+        # Everything from here on reads the source file, from a local copy when staging is on
+        metrics.inc("source_bytes_total", os.path.getsize(filename))
+        with metrics.stage("staging", scene_id):
+            filename = staging.acquire(scene, filename)
+        media = media.for_path(filename)
 
-    claim_scene(scene_id)
+    sprite_generator = None
+    if sprite_missing:
+        sprite_generator = VideoSpriteGenerator(
+            filename, sprite_file, vtt_file, filehash, config.ffmpeg, config.ffprobe,
+            seek_mode=config.sprite_seek_mode, media_info=media
+        )
 
-    if dry_run:
-        print(f"[DRY RUN] Would run videohash on {filename}")
+    preview_generator = None
+    if preview_missing:
+        preview_generator = PreviewVideoGenerator(
+            filename, preview_file, filehash, config.ffmpeg, config.ffprobe,
+            config.preview_clips, config.preview_clip_length, config.preview_skip_seconds, config.preview_audio,
+            scene_id=scene_id, scene_name=filename_pretty, media_info=media
+        )
+
+    job = SceneJob(scene, filename, filename_pretty, filehash)
+    job.source = source
+    job.cache, job.duplicates, job.cached_phash, job.media, job.needs_cover = cache, duplicates, cached_phash, media, needs_cover
+    job.sprite_file, job.vtt_file, job.sprite_generator = sprite_file, vtt_file, sprite_generator
+    job.preview_file, job.preview_generator = preview_file, preview_generator
+    return job
+
+def finish_scene(job, artifacts, phash=None):
+    """
+    Everything after the single pass: the phash (unless given), Stash updates and
+    whatever artifact the single pass didn't produce. Returns how the scene ended.
+    """
+    scene_id, filename, filename_pretty, filehash = job.scene_id, job.filename, job.filename_pretty, job.filehash
+    cache, cached_phash, media, needs_cover = job.cache, job.cached_phash, job.media, job.needs_cover
+    sprite_file, sprite_generator = job.sprite_file, job.sprite_generator
+    preview_file, preview_generator = job.preview_file, job.preview_generator
+
+    if config.dry_run:
+        print(f"[DRY RUN] Would compute {config.phash_engine} phash for {filename}")
     else:
         try:
-            result = subprocess.run([binary, '-json', filename], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
-            results = json.loads(result.stdout.decode("utf-8"))
-            update_phash(file_id, results['phash'])
+            if not phash:
+                with metrics.stage("phash", scene_id):
+                    phash = cached_phash or compute_scene_phash(filename, artifacts, media)
+            if cache and not cached_phash:
+                # Cached before the Stash update so a failed update doesn't cost another decode
+                cache.put(filehash, filename, phash=phash, duration=media.duration, streams=media.as_dict())
+            job.send_phash(phash)
         except Exception as e:
             log_scene_failure(scene_id, filename_pretty, "hashing", e)
-            tag_scene_error(scene_id, hashing_error_tag, str(e))
-            return
+            tag_scene_error(scene_id, config.hashing_error_tag, str(e))
+            shutil.rmtree(os.path.abspath(f"single_pass_temp_{filehash}"), ignore_errors=True)
+            return "error"
 
-    try:
-        cover_image = scene['paths'].get('screenshot')
-        if cover_image and "<svg" in requests.get(cover_image).content.decode('latin_1').lower():
-            temp_dir = os.path.abspath(f"cover_temp_{filehash}")
-            os.makedirs(temp_dir, exist_ok=True)
-            image_filename = os.path.join(temp_dir, f"{filehash}_cover.jpg")
-            ffmpegcmd = [
-                ffmpeg, '-hide_banner', '-loglevel', 'error',
-                '-i', filename, '-ss', '00:00:30', '-vframes', '1',
-                image_filename, '-nostdin'
-            ]
-
-            if dry_run:
-                print(f"[DRY RUN] Would extract cover image using: {' '.join(ffmpegcmd)}")
-            else:
-                try:
-                    subprocess.run(ffmpegcmd, check=True)
-                    if not os.path.exists(image_filename):
-                        ffmpegcmd[ffmpegcmd.index('-ss') + 1] = '00:00:05'
-                        subprocess.run(ffmpegcmd, check=True)
-                    if not os.path.exists(image_filename):
-                        raise FileNotFoundError(f"Cover image not created: {image_filename}")
-                    with open(image_filename, "rb") as img:
-                        encoded = base64.b64encode(img.read()).decode()
-                    update_cover(scene_id, "data:image/jpg;base64," + encoded)
-                except Exception as e:
-                    log_scene_failure(scene_id, filename_pretty, "cover image generation", e)
-                    tag_scene_error(scene_id, cover_error_tag, str(e))
-                finally:
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-    except Exception as e:
-        log_scene_failure(scene_id, filename_pretty, "cover image setup", e)
-        tag_scene_error(scene_id, cover_error_tag, str(e))
-
-    if generate_sprite:
-        sprite_file = os.path.join(sprite_path, f"{filehash}_sprite.jpg")
-        vtt_file = os.path.join(sprite_path, f"{filehash}_thumbs.vtt")
-        if not os.path.exists(sprite_file):
-            if dry_run:
-                print(f"[DRY RUN] Would generate sprite for {filename_pretty} → {sprite_file}")
-            else:
-                try:
-                    generator = VideoSpriteGenerator(filename, sprite_file, vtt_file, filehash, ffmpeg, ffprobe)
-                    generator.generate_sprite()
-                except Exception as e:
-                    log_scene_failure(scene_id, filename_pretty, "sprite generation", e)
-                    tag_scene_error(scene_id, hashing_error_tag, str(e))
-                    return
-
-    if generate_preview:
-        preview_file = os.path.join(preview_path, f"{filehash}.mp4")
-        if not os.path.exists(preview_file):
-            if dry_run:
-                print(f"[DRY RUN] Would generate preview for {filename_pretty} → {preview_file}")
-            else:
-                try:
-                    generator = PreviewVideoGenerator(
-                        filename, preview_file, filehash, ffmpeg, ffprobe,
-                        preview_clips, preview_clip_length, preview_skip_seconds, preview_audio,
-                        scene_id=scene_id, scene_name=filename_pretty
-                    )
-                    generator.generate_preview()
-                except Exception as e:
-                    log_scene_failure(scene_id, filename_pretty, "preview generation", e)
-                    tag_scene_error(scene_id, hashing_error_tag, str(e))
-                    return
-
-    release_scene(scene_id)
+    if needs_cover:
+        if 'cover' in artifacts:
+            try:
+                job.send_cover("data:image/jpg;base64," + base64.b64encode(artifacts['cover']).decode())
+            except Exception as e:
+                log_scene_failure(scene_id, filename_pretty, "cover image generation", e)
+                tag_scene_error(scene_id, config.cover_error_tag, str(e))
+        else:
+            with metrics.stage("cover", scene_id):
+                extract_cover(scene_id, filename, filename_pretty, media, send=job.send_cover)
+
+    if sprite_generator:
+        if config.dry_run:
+            print(f"[DRY RUN] Would generate sprite for {filename_pretty} → {sprite_file}")
+        else:
+            try:
+                with metrics.stage("sprite", scene_id):
+                    if 'sprite_frames' in artifacts:
+                        sprite_generator.create_sprite_from_frames(artifacts['sprite_frames'], media.duration)
+                    else:
+                        sprite_generator.generate_sprite()
+                if cache:
+                    cache.add_artifact(filehash, filename, 'sprite')
+            except Exception as e:
+                log_scene_failure(scene_id, filename_pretty, "sprite generation", e)
+                tag_scene_error(scene_id, config.hashing_error_tag, str(e))
+                return "error"
+
+    if preview_generator:
+        if config.dry_run:
+            print(f"[DRY RUN] Would generate preview for {filename_pretty} → {preview_file}")
+        else:
+            try:
+                with metrics.stage("preview", scene_id):
+                    if 'preview' in artifacts:
+                        shutil.move(artifacts['preview'], preview_file)
+                        if config.verbose:
+                            print(f"🎞️ Preview video created for ID {scene_id} — {filename_pretty} → {preview_file}")
+                    else:
+                        preview_generator.generate_preview()
+                if cache and os.path.exists(preview_file):
+                    cache.add_artifact(filehash, filename, 'preview')
+            except Exception as e:
+                log_scene_failure(scene_id, filename_pretty, "preview generation", e)
+                tag_scene_error(scene_id, config.hashing_error_tag, str(e))
+                return "error"
+
+    if artifacts:
+        shutil.rmtree(os.path.abspath(f"single_pass_temp_{filehash}"), ignore_errors=True)
+
+    if job.duplicates and phash:
+        try:
+            job.duplicates.record(
+                filehash, os.path.getsize(filename), phash, media.duration, scene_id, job.source,
+                sprite=sprite_file if os.path.exists(sprite_file) else None,
+                vtt=job.vtt_file if os.path.exists(job.vtt_file) else None,
+                preview=preview_file if os.path.exists(preview_file) else None,
+            )
+        except Exception as e:
+            print(f"⚠️ Could not add scene {scene_id} to the duplicate index: {e}")
+
+    job.release()
+    return "done"
@@ -0,0 +1,139 @@
+# scene_scheduler.py
+
+import json
+import os
+import threading
+import time
+
+import config
+
+POLICIES = ("fifo", "sjf", "lpt", "fair")
+
+# Seconds per video-second per megapixel before this node has measured anything.
+# Only the ordering depends on it until real rates come in.
+DEFAULT_RATE = 0.05
+DEFAULT_BYTE_RATE = 2e-8  # seconds per byte, ~50 MB/s
+
+
+class CostModel:
+    """
+    Estimates how long a scene will take on this node from what discovery already
+    knows about its file: duration x resolution, scaled by a rate learned per video
+    codec, or the file size times a per-byte rate when duration or size is missing.
+
+    Rates are exponentially weighted averages of finished scenes and are saved to
+    cost_model_path, so a node starts with its own numbers after a restart.
+    """
+
+    def __init__(self, path=None, smoothing=0.2):
+        self.path = path
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.rates = {}  # codec (or "*" for all) -> seconds per video-second per megapixel
+        self.byte_rate = None
+        self.observations = 0
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable cost model {self.path}: {e}")
+            return
+        self.rates = data.get("rates", {})
+        self.byte_rate = data.get("byte_rate")
+        self.observations = data.get("observations", 0)
+
+    def save(self):
+        if not self.path or config.dry_run:
+            return
+        with self.lock:
+            data = {"rates": self.rates, "byte_rate": self.byte_rate, "observations": self.observations}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def features(self, scene):
+        file = scene['files'][0]
+        duration = file.get('duration') or 0
+        megapixels = (file.get('width') or 0) * (file.get('height') or 0) / 1e6
+        # Small files still pay for process start-up and seeks
+        return file.get('video_codec') or "unknown", duration * max(megapixels, 0.1), file.get('size') or 0
+
+    def estimate(self, scene):
+        codec, work, size = self.features(scene)
+        with self.lock:
+            if work:
+                return work * self.rates.get(codec, self.rates.get("*", DEFAULT_RATE))
+            if size:
+                return size * (self.byte_rate or DEFAULT_BYTE_RATE)
+        return None
+
+    def observe(self, scene, seconds):
+        codec, work, size = self.features(scene)
+
+        def blend(old, new):
+            return new if old is None else old + self.smoothing * (new - old)
+
+        with self.lock:
+            if work:
+                rate = seconds / work
+                self.rates[codec] = blend(self.rates.get(codec), rate)
+                self.rates["*"] = blend(self.rates.get("*"), rate)
+            if size:
+                self.byte_rate = blend(self.byte_rate, seconds / size)
+            self.observations += 1
+            save = self.observations % 10 == 0
+        if save:
+            self.save()
+
+
+class SceneOrder:
+    """
+    Orders the scenes waiting in the feed by estimated cost:
+    - fifo: as discovered
+    - sjf: shortest first, so most scenes get their phash early
+    - lpt: longest first, which packs a batch onto the workers with the lowest
+      makespan (long files no longer start last and run alone at the end)
+    - fair: shortest first, but every second a scene waits takes fair_aging
+      seconds off its cost, so long files are not starved across batches
+
+    Scenes with no estimate are treated like the median scene of the queue.
+    """
+
+    def __init__(self, model, policy="fair", aging=1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.model = model
+        self.policy = policy
+        self.aging = aging
+
+    def __call__(self, items):
+        if self.policy == "fifo" or len(items) < 2:
+            return items
+        now = time.monotonic()
+        estimates = []
+        for item in items:
+            scene = item[0]
+            if '_estimate' not in scene:
+                scene['_estimate'] = self.model.estimate(scene)
+                scene['_queued_at'] = now
+            estimates.append(scene['_estimate'])
+        known = [e for e in estimates if e is not None]
+        fallback = sorted(known)[len(known) // 2] if known else 0.0
+
+        def key(pair):
+            position, (item, estimate) = pair
+            cost = fallback if estimate is None else estimate
+            if self.policy == "lpt":
+                return (-cost, position)
+            if self.policy == "fair":
+                cost -= self.aging * (now - item[0]['_queued_at'])
+            return (cost, position)
+
+        ordered = sorted(enumerate(zip(items, estimates)), key=key)
+        return [item for _, (item, _) in ordered]
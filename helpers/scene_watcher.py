@@ -0,0 +1,102 @@
+# scene_watcher.py
+
+import threading
+import time
+from datetime import datetime
+
+import config
+from helpers.scene_discovery import discover_scenes, fetch_updated_since, mark_missing_covers, newest_update
+from helpers.stash_utils import get_total_scene_count, note_scenes_claimed
+
+
+class SceneWatcher:
+    """
+    Discovery for --watch, where the node runs as a daemon instead of exiting
+    when the backlog is empty.
+
+    At start the newest updated_at in Stash becomes the cursor, and the backlog
+    older than it is drained with the usual random pages (a reconciliation).
+    After that each poll asks only for scenes changed since the cursor, one page
+    sorted by updated_at, and moves the cursor to the newest scene returned, so
+    a poll costs the same however large the library is. New scenes and scenes
+    re-queued in Stash (phash or error tag cleared, expired lease) show up there.
+
+    Polls that find nothing wait longer each time, from watch_min_interval up to
+    watch_max_interval, and go back to the minimum as soon as something turns
+    up. Every watch_reconcile_interval, while idle, the backlog is drained again
+    to catch anything the cursor missed (a scene changed within the same second
+    as the cursor was taken, clock changes on the Stash server).
+
+    fetch_batch() is the SceneFeed's fetch: it only returns once there is
+    something to hand out, or None after stop().
+    """
+
+    def __init__(self, leases):
+        self.leases = leases
+        self.cursor = None
+        self.seen = {}  # scene id -> updated_at already returned at the cursor's second
+        self.reconciling = True
+        self.reconciled_at = 0.0
+        self.idle = config.watch_min_interval
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.cursor = newest_update()
+        print(f"👀 Watching for new scenes (cursor {self.cursor or 'empty library'}), draining the backlog first")
+
+    def stop(self):
+        self.stopped.set()
+
+    def fetch_batch(self):
+        while not self.stopped.is_set():
+            try:
+                self.leases.sweep_expired()
+            except Exception as e:
+                print(f"⚠️ Failed to sweep expired leases: {e}")
+
+            # New scenes first; the backlog pass only runs when nothing new is waiting
+            scenes = self.fetch_new()
+            if not scenes and self.reconciling:
+                scenes = discover_scenes()
+                if not scenes:
+                    self.reconciling = False
+                    self.reconciled_at = time.monotonic()
+                    print(f"✅ Backlog drained, polling for new scenes every {config.watch_min_interval}-{config.watch_max_interval}s")
+
+            if scenes:
+                self.idle = config.watch_min_interval
+                scenes = self.leases.claim(scenes)
+                self.leases.report()
+                return scenes
+
+            if time.monotonic() - self.reconciled_at >= config.watch_reconcile_interval:
+                print("🔁 Reconciling: looking through the whole backlog for scenes the cursor missed")
+                get_total_scene_count(refresh=True)
+                self.reconciling = True
+                continue
+
+            self.stopped.wait(self.idle)
+            self.idle = min(self.idle * 2, config.watch_max_interval)
+        return None
+
+    def fetch_new(self):
+        scenes = fetch_updated_since(self.cursor)
+        # The query overlaps the cursor's second; skip what was already handed out unchanged
+        scenes = [s for s in scenes if self.seen.get(s['id']) != s['updated_at']]
+        if not scenes:
+            return []
+
+        newest = max(scenes, key=lambda s: parse_time(s['updated_at']))['updated_at']
+        if self.cursor is None or parse_time(newest) > parse_time(self.cursor):
+            self.cursor = newest
+            self.seen = {}
+        self.seen.update((s['id'], s['updated_at']) for s in scenes if s['updated_at'] == self.cursor)
+
+        print(f"🆕 {len(scenes)} new or changed scenes (cursor now {self.cursor})")
+        note_scenes_claimed(len(scenes))
+        mark_missing_covers(scenes)
+        return scenes
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
@@ -0,0 +1,208 @@
+# single_pass.py
+
+import asyncio
+import os
+import shutil
+import subprocess
+import numpy as np
+
+from helpers.frame_extractor import select_expression
+from helpers.phash import phash_timestamps
+from helpers.resource_scheduler import scheduler
+from helpers.async_subprocess import run_command
+from helpers.media_info import get_media_info
+from helpers.cover_generator import cover_time
+
+
+class SinglePassPipeline:
+    """
+    Produces every per-scene artifact from a single demux/decode session.
+
+    One ffmpeg process opens the file once and a split filter fans the decoded
+    frames out to whichever branches are needed:
+    - sprite: 160x90 RGB24 tiles at the sprite generator's timestamps
+    - phash: 160px wide frames at the Stash/videohashes sample points
+    - cover: one full resolution JPEG
+    - preview: the trimmed clips concatenated and encoded once
+
+    Raw frames are handed back in memory; the preview is left in the temp dir
+    for the caller to move into place. Any failure raises so the caller can fall
+    back to the per-stage generators.
+    """
+
+    def __init__(self, filename, filehash, ffmpeg='ffmpeg', ffprobe='ffprobe',
+                 sprite_generator=None, preview_generator=None, cover=False, phash=False,
+                 phash_frames=25, phash_width=160, media_info=None):
+        self.filename = os.path.abspath(filename.strip('"').strip("'"))
+        self.temp_dir = os.path.abspath(f"single_pass_temp_{filehash}")
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.sprite_generator = sprite_generator
+        self.preview_generator = preview_generator
+        self.cover = cover
+        self.phash = phash
+        self.phash_frames = phash_frames
+        self.phash_width = phash_width
+        self.media_info = media_info
+
+    def probe(self):
+        # Display size from ffprobe (after autorotation); Stash's may be the stored one
+        if self.media_info is None:
+            self.media_info = get_media_info(self.filename, self.ffprobe)
+        return self.media_info.duration, self.media_info.width, self.media_info.height
+
+    def build_command(self, duration):
+        branches = []  # chains fed from one split of the decoded video
+        chains = []    # self-contained chains (preview clip trims, audio)
+        outputs = []
+
+        if self.sprite_generator:
+            gen = self.sprite_generator
+            expr = select_expression(gen.get_timestamps(duration))
+            branches.append(f"select='{expr}',scale={gen.max_width}:{gen.max_height}:flags=lanczos,format=rgb24[sprite]")
+            outputs += ['-map', '[sprite]', '-fps_mode', 'passthrough', '-f', 'rawvideo',
+                        os.path.join(self.temp_dir, 'sprite.rgb')]
+
+        if self.phash:
+            # One trim per sample point so each frame is picked exactly like Stash's `-ss t -i file`,
+            # converted straight to bgr24 like its BMP screenshots (swscale's rgb24 path rounds differently).
+            # Without -copyts ffmpeg already counts input timestamps from the container's start time, as -ss does,
+            # so the trims need no offset; resetting to the first video pts would be off when audio starts first
+            timestamps = phash_timestamps(duration, self.phash_frames)
+            branches.append(f"split={len(timestamps)}" + ''.join(f"[phash{i}]" for i in range(len(timestamps))))
+            for i, t in enumerate(timestamps):
+                chains.append(f"[phash{i}]trim=start={t},trim=end_frame=1,scale={self.phash_width}:-2,format=bgr24[phashframe{i}]")
+            chains.append(''.join(f"[phashframe{i}]" for i in range(len(timestamps))) + f"concat=n={len(timestamps)}:v=1:a=0[phash]")
+            outputs += ['-map', '[phash]', '-fps_mode', 'passthrough', '-f', 'rawvideo',
+                        os.path.join(self.temp_dir, 'phash.bgr')]
+
+        if self.cover:
+            branches.append(f"trim=start={cover_time(duration)},trim=end_frame=1[cover]")
+            outputs += ['-map', '[cover]', '-frames:v', '1', '-q:v', '2',
+                        os.path.join(self.temp_dir, 'cover.jpg')]
+
+        if self.preview_generator:
+            gen = self.preview_generator
+            start_times = gen.get_start_times(duration)
+            clips = len(start_times)
+            branches.append(f"split={clips}" + ''.join(f"[pclip{i}]" for i in range(clips)))
+            if gen.with_audio:
+                chains.append(f"[0:a]asplit={clips}" + ''.join(f"[aclip{i}]" for i in range(clips)))
+
+            concat_inputs = ""
+            for i, start_time in enumerate(start_times):
+                chains.append(
+                    f"[pclip{i}]trim=start={start_time:.6f}:duration={gen.clip_length},setpts=PTS-STARTPTS[pv{i}]"
+                )
+                concat_inputs += f"[pv{i}]"
+                if gen.with_audio:
+                    chains.append(
+                        f"[aclip{i}]atrim=start={start_time:.6f}:duration={gen.clip_length},asetpts=PTS-STARTPTS[pa{i}]"
+                    )
+                    concat_inputs += f"[pa{i}]"
+
+            if gen.with_audio:
+                chains.append(f"{concat_inputs}concat=n={clips}:v=1:a=1[pconcat][preview_audio]")
+            else:
+                chains.append(f"{concat_inputs}concat=n={clips}:v=1:a=0[pconcat]")
+            chains.append(f"[pconcat]scale={gen.width}:{gen.height}[preview]")
+
+            outputs += ['-map', '[preview]', '-fps_mode', 'passthrough', *gen.get_video_codec_args()]
+            if gen.with_audio:
+                outputs += ['-map', '[preview_audio]', '-c:a', 'aac', '-b:a', '192k']
+            else:
+                outputs.append('-an')
+            outputs.append(os.path.join(self.temp_dir, 'preview.mp4'))
+
+        labels = [f"[branch{i}]" for i in range(len(branches))]
+        graph = [f"[0:v]split={len(branches)}" + ''.join(labels)]
+        graph += [label + branch for label, branch in zip(labels, branches)]
+        graph += chains
+
+        return [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+            '-i', self.filename,
+            '-filter_complex', ';'.join(graph),
+            *outputs
+        ]
+
+    def read_frames(self, path, frame_size, count):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) != frame_size * count:
+            raise RuntimeError(f"Single pass produced {len(data) // frame_size} of {count} frames for {os.path.basename(path)}")
+        return [data[i:i + frame_size] for i in range(0, len(data), frame_size)]
+
+    @property
+    def needed(self):
+        return bool(self.sprite_generator or self.preview_generator or self.cover or self.phash)
+
+    def prepare(self):
+        # Fresh temp dir and the ffmpeg command line
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        duration, _, _ = self.probe()
+        return self.build_command(duration)
+
+    def run(self):
+        if not self.needed:
+            return {}
+        command = self.prepare()
+        with scheduler.reserve(self.filename, encode=1 if self.preview_generator else 0):
+            subprocess.run(command, check=True)
+        return self.collect()
+
+    async def run_async(self):
+        """
+        run() for the asyncio engine: ffmpeg runs as an asyncio subprocess under the
+        same node-wide reservations, and reading the frames back happens off the loop.
+        """
+        if not self.needed:
+            return {}
+        command = self.prepare()
+        async with scheduler.reserve_async(self.filename, encode=1 if self.preview_generator else 0):
+            await run_command(command)
+        return await asyncio.to_thread(self.collect)
+
+    def collect(self):
+        # Reads back what ffmpeg wrote to the temp dir
+        duration, _, _ = self.probe()
+        results = {'duration': duration, 'streams': self.media_info.as_dict()}
+
+        if self.sprite_generator:
+            gen = self.sprite_generator
+            results['sprite_frames'] = self.read_frames(
+                os.path.join(self.temp_dir, 'sprite.rgb'), gen.max_width * gen.max_height * 3, gen.total_shots
+            )
+
+        if self.phash:
+            # The height comes from what ffmpeg wrote, not the probed size: ffmpeg
+            # autorotates, and Stash may report a rotated file's stored dimensions
+            path = os.path.join(self.temp_dir, 'phash.bgr')
+            row_size = self.phash_width * 3
+            phash_height = os.path.getsize(path) // (row_size * self.phash_frames)
+            if not phash_height:
+                raise RuntimeError("Single pass produced no phash frames")
+            frames = self.read_frames(path, row_size * phash_height, self.phash_frames)
+            results['phash_frames'] = [
+                np.frombuffer(frame, dtype=np.uint8).reshape(phash_height, self.phash_width, 3)[:, :, ::-1]
+                for frame in frames
+            ]
+
+        if self.cover:
+            cover_file = os.path.join(self.temp_dir, 'cover.jpg')
+            if not os.path.exists(cover_file):
+                raise RuntimeError("Single pass did not produce a cover image")
+            with open(cover_file, 'rb') as f:
+                results['cover'] = f.read()
+
+        if self.preview_generator:
+            preview_file = os.path.join(self.temp_dir, 'preview.mp4')
+            if not os.path.exists(preview_file):
+                raise RuntimeError("Single pass did not produce a preview video")
+            results['preview'] = preview_file
+
+        return results
+
+    def clean_up(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
@@ -0,0 +1,258 @@
+# staging_cache.py
+
+import asyncio
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from helpers.resource_scheduler import scheduler
+from helpers.storage_locality import filesystem_mount, translate_path
+from helpers.telemetry import metrics
+
+# The cache only ever creates or removes files in this folder of staging_path
+STAGING_DIR = "stash_staging"
+
+
+class StagedFile:
+    def __init__(self, source, path, size, users=0):
+        self.source = source
+        self.path = path
+        self.size = size
+        self.users = users  # scenes reading the copy, which keep it from being evicted
+        self.ready = threading.Event()
+        self.ok = False
+
+
+class StagingCache:
+    """
+    Copies source files to a local scratch directory (the stash_staging folder
+    of staging_path, ideally on an SSD) so every stage reads the local copy. The network then sees one large
+    sequential read per file instead of sprite, preview and cover seeks from
+    several processes at once.
+
+    A background thread copies the next staging_ahead queued scenes in order, one
+    at a time, while the workers process the current ones. A scene whose file
+    isn't staged yet when it starts copies it itself (still one sequential read),
+    or waits for the copy already running. Copies take a read slot on the source
+    volume and keep the source's mtime, so the result cache still matches them.
+
+    Copies stay until space is needed and are evicted least recently used first,
+    but never while a scene reads them. The total is capped at staging_max_gb,
+    and staging_min_free_gb is left free on the disk. A file that doesn't fit is
+    read in place, as are files already on the staging disk.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = OrderedDict()  # source -> StagedFile, least recently used first
+        self.used_bytes = 0
+        self.skipped = set()  # sources too large to stage or that failed to copy
+        self.feed = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.stats = {"staged": 0, "bytes": 0, "seconds": 0.0, "hits": 0, "misses": 0, "evicted": 0}
+
+    @property
+    def enabled(self):
+        return bool(config.staging_path)
+
+    @property
+    def directory(self):
+        return os.path.join(config.staging_path, STAGING_DIR)
+
+    def start(self, feed):
+        if not self.enabled:
+            return
+        # Copies left by an earlier run can't be matched to their sources any more
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self.feed = feed
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        metrics.gauge_callback("staging_bytes", lambda: self.used_bytes)
+        print(f"🚚 Staging source files in {self.directory} (up to {config.staging_max_gb} GB, {config.staging_ahead} ahead)")
+
+    def stop(self):
+        if not self.enabled or self.thread is None:
+            return
+        self.stopped.set()
+        self.wake.set()
+        self.thread.join(timeout=5)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def wants(self, source):
+        # Only worth it for files on another disk than the scratch directory
+        if not self.enabled or config.dry_run:
+            return False
+        return filesystem_mount(source) != filesystem_mount(config.staging_path)
+
+    def run(self):
+        while not self.stopped.is_set():
+            source = self.next_source()
+            if source and self.stage(source):
+                continue
+            # Nothing to copy, or no room until a scene finishes with its copy
+            self.wake.wait(0.5)
+            self.wake.clear()
+
+    def next_source(self):
+        for scene in self.feed.peek(config.staging_ahead):
+            source = translate_path(scene['files'][0]['path'])
+            with self.lock:
+                if source in self.files or source in self.skipped:
+                    continue
+            if self.wants(source) and os.path.exists(source):
+                return source
+        return None
+
+    def acquire(self, scene, source):
+        """
+        Path the stages should read for source: its staged copy (waiting for or
+        making the copy if needed), or source itself when it isn't staged. Held
+        until release(scene).
+        """
+        if not self.wants(source):
+            return source
+        with self.lock:
+            entry = self.files.get(source)
+            if entry:
+                entry.users += 1
+                self.files.move_to_end(source)
+                self.stats["hits"] += 1
+        if entry is None:
+            with self.lock:
+                self.stats["misses"] += 1
+            entry = self.stage(source, users=1)
+            if entry is None:
+                return source
+        scene['_staged'] = entry
+        entry.ready.wait()
+        return entry.path if entry.ok else source
+
+    async def wait_async(self, source):
+        # For the async engine: wait out a copy in progress without holding a pool thread
+        with self.lock:
+            entry = self.files.get(source)
+        while entry and not entry.ready.is_set():
+            await asyncio.sleep(0.1)
+
+    def release(self, scene):
+        entry = scene.pop('_staged', None)
+        if entry:
+            with self.lock:
+                entry.users -= 1
+            self.wake.set()
+
+    def stage(self, source, users=0):
+        try:
+            size = os.path.getsize(source)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.files.get(source)
+            if entry:
+                # Another thread got here first; wait for its copy
+                entry.users += users
+                return entry
+            if not self.make_room(size):
+                if size > config.staging_max_gb * 1e9:
+                    self.skipped.add(source)
+                if config.verbose:
+                    print(f"🚚 No room to stage {os.path.basename(source)} ({size / 1e9:.1f} GB), reading it in place")
+                return None
+            name = hashlib.sha1(source.encode()).hexdigest()[:16] + "_" + os.path.basename(source)
+            entry = StagedFile(source, os.path.join(self.directory, name), size, users)
+            self.files[source] = entry
+            self.used_bytes += size
+
+        try:
+            self.copy(entry)
+            entry.ok = True
+        except Exception as e:
+            print(f"⚠️ Failed to stage {source}, reading it in place: {e}")
+            with self.lock:
+                self.skipped.add(source)
+                if self.files.get(source) is entry:
+                    del self.files[source]
+                    self.used_bytes -= size
+            for path in (entry.path, entry.path + ".part"):
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            entry.ready.set()
+        return entry
+
+    def make_room(self, size):
+        # Called with the lock held
+        limit = config.staging_max_gb * 1e9
+        if size > limit:
+            return False
+
+        def short():
+            free = shutil.disk_usage(config.staging_path).free
+            return self.used_bytes + size > limit or free - size < config.staging_min_free_gb * 1e9
+
+        for source in list(self.files):
+            if not short():
+                return True
+            entry = self.files[source]
+            if entry.users or not entry.ready.is_set():
+                continue
+            del self.files[source]
+            self.used_bytes -= entry.size
+            self.stats["evicted"] += 1
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        return not short()
+
+    def copy(self, entry):
+        # One sequential pass with large reads, under the source volume's read budget
+        started = time.monotonic()
+        temp_path = entry.path + ".part"
+        semaphore = scheduler.read_slots(entry.source)
+        semaphore.acquire()
+        try:
+            buffer = bytearray(config.staging_buffer_mb << 20)
+            view = memoryview(buffer)
+            with open(entry.source, "rb", buffering=0) as src, open(temp_path, "wb", buffering=0) as dst:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                while True:
+                    count = src.readinto(buffer)
+                    if not count:
+                        break
+                    dst.write(view[:count])
+        finally:
+            semaphore.release()
+        stat = os.stat(entry.source)
+        os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temp_path, entry.path)
+
+        seconds = time.monotonic() - started
+        with self.lock:
+            self.stats["staged"] += 1
+            self.stats["bytes"] += entry.size
+            self.stats["seconds"] += seconds
+        metrics.inc("staging_bytes_total", entry.size)
+        metrics.observe("staging_copy_seconds", seconds)
+        if config.verbose:
+            print(f"🚚 Staged {os.path.basename(entry.source)}: {entry.size / 1e6:.0f} MB in {seconds:.1f}s "
+                  f"({entry.size / 1e6 / max(seconds, 1e-6):.0f} MB/s)")
+
+    def report(self):
+        stats = self.stats
+        if not stats["staged"]:
+            return
+        rate = stats["bytes"] / 1e6 / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"🚚 Staged {stats['staged']} files, {stats['bytes'] / 1e9:.1f} GB at {rate:.0f} MB/s; "
+              f"{stats['hits']} read ahead, {stats['misses']} copied on demand, {stats['evicted']} evicted")
+
+
+staging = StagingCache()
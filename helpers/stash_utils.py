@@ -1,10 +1,75 @@
 # stash_utils.py
 
 from stashapi.stashapp import StashInterface
-from config import hashing_tag, hashing_error_tag, cover_error_tag, dry_run, stash_scheme, stash_host, stash_port, stash_api_key, excluded_paths
+from requests.adapters import HTTPAdapter
+import requests
+from config import hashing_tag, hashing_error_tag, cover_error_tag, stash_scheme, stash_host, stash_port, stash_api_key, excluded_paths, scene_count_ttl, tag_flush_interval, spool_path, spool_max_backoff, spool_dead_letter_path
+from helpers.update_spool import UpdateSpool
+from helpers.media_info import STASH_FILE_FRAGMENT
+from helpers.telemetry import metrics
 from datetime import datetime
+import config
+import re
+import threading
+import time
+
+def keep_graphql_errors(client):
+    """
+    stashapi only logs the GraphQL errors of a failed request; this appends them to
+    the exception it raises, so is_transport_error() can spot a locked database and
+    the spool's dead-letter file records why Stash refused an update.
+    """
+    handle = getattr(client, "_handle_GQL_response", None)
+    if handle is None:
+        return
+
+    def handle_response(response):
+        try:
+            return handle(response)
+        except Exception as e:
+            try:
+                messages = [error.get("message", "") for error in response.json().get("errors", [])]
+            except (ValueError, AttributeError):
+                messages = []
+            if not messages:
+                raise
+            raise Exception(f"{e} {'; '.join(messages)}") from e
+
+    client._handle_GQL_response = handle_response
 
 stash = StashInterface({"scheme": stash_scheme, "host": stash_host, "port": stash_port, "apikey": stash_api_key})
+keep_graphql_errors(stash)
+metrics.instrument_graphql(stash)
+
+# One keep-alive pool for everything sent to Stash: the stashapi client's own session
+# (which also carries the API key)
+http = getattr(stash, "s", None) or requests.Session()
+
+def size_http_pool():
+    """
+    Size the pool so every scene that can be in flight can hold a connection. Called
+    again once the CLI arguments are applied, since they change the worker counts.
+    """
+    scenes = max(config.max_workers,
+                 config.auto_workers_max if config.auto_concurrency else 0,
+                 config.async_max_scenes if config.engine == "async" else 0)
+    http.mount(f"{stash_scheme}://", HTTPAdapter(pool_connections=4, pool_maxsize=max(10, scenes * 2)))
+
+size_http_pool()
+
+FIND_SCENE_IDS_QUERY = """
+query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType, $scene_ids: [Int!]) {
+    findScenes(filter: $filter, scene_filter: $scene_filter, scene_ids: $scene_ids) {
+        scenes { id }
+    }
+}
+"""
+
+# Status code at the start of stashapi's "query failed" exceptions
+HTTP_STATUS_RE = re.compile(r'^(\d{3}) ')
+
+# Cached result of the count-only query, shared across loop iterations
+_scene_count = {"value": None, "fetched": 0.0}
 
 def log_scene_failure(scene_id, filename_pretty, step, error):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -19,25 +84,219 @@ def reset_terminal():
     if platform.system() != "Windows":
         print("\033[0;37m", end="")  # Reset + white text
 
-def get_total_scene_count():
-    scenes = stash.find_scenes(
-        f={
-            "phash": {"value": "", "modifier": "IS_NULL"},
-            "tags": {"value": [hashing_tag, hashing_error_tag, cover_error_tag], "modifier": "EXCLUDES"},
-        },
-        filter={"sort": "created_at", "direction": "DESC", "per_page": -1},
-        fragment="id files{path}"
-    )
-    if excluded_paths:
-        scenes = [s for s in scenes if not any(ep in s['files'][0]['path'] for ep in excluded_paths)]
-    return len(scenes)
+def build_scene_filter():
+    """
+    Scene filter for work that still needs a phash. excluded_paths are applied by
+    Stash (path EXCLUDES) rather than by downloading every scene and filtering here.
+    Stash only accepts one path criterion per filter level, so further exclusions
+    are nested through AND.
+    """
+    scene_filter = {
+        "phash": {"value": "", "modifier": "IS_NULL"},
+        "tags": {"value": [hashing_tag, hashing_error_tag, cover_error_tag], "modifier": "EXCLUDES"},
+    }
+    level = scene_filter
+    for index, path in enumerate(excluded_paths):
+        if index:
+            level["AND"] = {}
+            level = level["AND"]
+        level["path"] = {"value": path, "modifier": "EXCLUDES"}
+    return scene_filter
+
+def get_total_scene_count(refresh=False):
+    """
+    Number of scenes left to process, from a count-only query (one id per request).
+    The value is cached for scene_count_ttl seconds and adjusted locally as batches
+    are claimed, so it doesn't cost a query per batch.
+    """
+    stale = time.monotonic() - _scene_count["fetched"] > scene_count_ttl
+    if refresh or stale or _scene_count["value"] is None:
+        with metrics.stage("discovery_count"):
+            count, _ = stash.find_scenes(
+                f=build_scene_filter(),
+                filter={"per_page": 1},
+                fragment="id",
+                get_count=True
+            )
+        _scene_count["value"] = count
+        _scene_count["fetched"] = time.monotonic()
+    return _scene_count["value"]
+
+def note_scenes_claimed(count):
+    # Claimed scenes drop out of the filter, so keep the cached total roughly in step
+    if _scene_count["value"] is not None:
+        _scene_count["value"] = max(0, _scene_count["value"] - count)
+
+class TagMutationBatcher:
+    """
+    Coalesces tag changes into bulkSceneUpdate calls: one call per (tag, mode)
+    covering every pending scene, instead of one call per scene per tag.
+
+    Only the latest change per (scene, tag) is kept, so a claim followed by a
+    release inside the same window collapses to the release. Pending changes go
+    out on flush() (called per batch) or after flush_interval seconds.
+    """
+
+    def __init__(self, flush_interval=2.0):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # one flush at a time, so changes reach Stash in order
+        self.pending = {}  # (tag_id, mode) -> {scene_id: None}, insertion ordered
+        self.timer = None
+
+    def add(self, scene_ids, tag_id, mode):
+        opposite = "REMOVE" if mode == "ADD" else "ADD"
+        with self.lock:
+            cancelled = self.pending.get((tag_id, opposite), {})
+            queued = self.pending.setdefault((tag_id, mode), {})
+            for scene_id in scene_ids:
+                cancelled.pop(scene_id, None)
+                queued[scene_id] = None
+            if self.flush_interval and self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.send_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+            # Error tags first so a scene never sits untagged between REMOVE and ADD
+            for (tag_id, mode), scene_ids in sorted(pending.items(), key=lambda item: item[0][1] != "ADD"):
+                if not scene_ids:
+                    continue
+                try:
+                    stash.update_scenes({"ids": list(scene_ids), "tag_ids": {"ids": [tag_id], "mode": mode}})
+                except Exception as e:
+                    print(f"⚠️ Failed to {mode.lower()} tag {tag_id} on {len(scene_ids)} scenes, will retry: {e}")
+                    self.requeue(tag_id, mode, scene_ids)
+
+    def requeue(self, tag_id, mode, scene_ids):
+        # Put failed changes back unless a newer change for the same scene/tag arrived meanwhile
+        opposite = "REMOVE" if mode == "ADD" else "ADD"
+        with self.lock:
+            newer = self.pending.get((tag_id, opposite), {})
+            retry = [scene_id for scene_id in scene_ids if scene_id not in newer]
+        if retry:
+            self.add(retry, tag_id, mode)
+
+tag_batcher = TagMutationBatcher(tag_flush_interval)
+
+def set_phashes(updates):
+    """
+    Sets the phash of many files in one request, as aliased fileSetFingerprints mutations.
+    """
+    for start in range(0, len(updates), 50):
+        chunk = updates[start:start + 50]
+        params = ", ".join(f"$input{i}: FileSetFingerprintsInput!" for i in range(len(chunk)))
+        fields = " ".join(f"f{i}: fileSetFingerprints(input: $input{i})" for i in range(len(chunk)))
+        stash.call_GQL(f"mutation SetPhashes({params}) {{ {fields} }}", {
+            f"input{i}": {"id": file_id, "fingerprints": [{"type": "phash", "value": phash}]}
+            for i, (file_id, phash) in enumerate(chunk)
+        })
+
+def replay_updates(records, ack):
+    """
+    Sends a batch of spooled updates: phashes in bulk, then covers, then tag changes
+    coalesced into one bulk update per tag and mode. Tags go last so a scene is never
+    released before its phash is stored. Raises on the first failure; everything
+    acknowledged up to that point stays sent, and the spool narrows the rest down
+    to the rejected record.
+    """
+    phashes = [r for r in records if r['op'] == 'phash']
+    if phashes:
+        set_phashes([(r['args']['file_id'], r['args']['phash']) for r in phashes])
+        ack([r['seq'] for r in phashes])
+
+    for record in (r for r in records if r['op'] == 'cover'):
+        stash.update_scene({"id": record['args']['scene_id'], "cover_image": record['args']['cover_data']})
+        ack([record['seq']])
+
+    tags = [r for r in records if r['op'] == 'tag']
+    if tags:
+        latest = {}  # (scene_id, tag_id) -> mode, last change wins
+        for record in tags:
+            latest[(record['args']['scene_id'], record['args']['tag_id'])] = record['args']['mode']
+        grouped = {}
+        for (scene_id, tag_id), mode in latest.items():
+            grouped.setdefault((tag_id, mode), []).append(scene_id)
+        # Error tags first so a scene never sits untagged between REMOVE and ADD
+        for (tag_id, mode), scene_ids in sorted(grouped.items(), key=lambda item: item[0][1] != "ADD"):
+            stash.update_scenes({"ids": scene_ids, "tag_ids": {"ids": [tag_id], "mode": mode}})
+        ack([r['seq'] for r in tags])
+
+def is_transport_error(error):
+    """
+    True when sending the request again later can succeed: Stash unreachable,
+    restarting or overloaded (429, 5xx), or its database busy. Any other GraphQL
+    error, and a rejected API key (401), is the same on every retry.
+    """
+    if isinstance(error, (requests.exceptions.RequestException, ConnectionError, TimeoutError)):
+        return True
+    # stashapi raises failed requests as "<status> <reason> query failed. <version>"
+    match = HTTP_STATUS_RE.match(str(error))
+    if not match:
+        return False
+    status = int(match.group(1))
+    # A locked SQLite database comes back as 200 OK, told apart by the error keep_graphql_errors() appends
+    return status == 429 or status >= 500 or (status == 200 and "database is locked" in str(error))
+
+spool = UpdateSpool(spool_path, replay_updates, tag_flush_interval, spool_max_backoff,
+                    spool_dead_letter_path, is_transport_error) if spool_path else None
+
+# Scenes whose hashing_tag REMOVE is queued, so a lease renewal can't re-tag them
+_released = set()
+_release_lock = threading.Lock()
+
+def spool_tag(scene_id, tag_id, mode, durable=True):
+    if spool:
+        spool.append("tag", durable=durable, scene_id=scene_id, tag_id=tag_id, mode=mode)
+    else:
+        tag_batcher.add([scene_id], tag_id, mode)
+
+def queue_release(scene_id):
+    with _release_lock:
+        _released.add(scene_id)
+        spool_tag(scene_id, hashing_tag, "REMOVE")
+
+def renew_leases(scene_ids):
+    """
+    Re-adds hashing_tag to held scenes, which bumps their updated_at, through the
+    same ordered path as releases (the spool, or the tag batcher), so a release
+    queued after a renewal always lands after it. Scenes whose release is already
+    queued are skipped. Renewals aren't journaled: after a restart the leases are
+    gone anyway. Returns the renewed scene ids.
+    """
+    with _release_lock:
+        renewing = [scene_id for scene_id in scene_ids if scene_id not in _released]
+        for scene_id in renewing:
+            spool_tag(scene_id, hashing_tag, "ADD", durable=False)
+    if renewing and not spool:
+        tag_batcher.flush()
+    return renewing
+
+def forget_release(scene_id):
+    # Called once the lease is dropped; a scene that isn't held is never renewed
+    with _release_lock:
+        _released.discard(scene_id)
+
+def flush_tag_updates():
+    tag_batcher.flush()
+    if spool:
+        left = spool.drain()
+        if left:
+            print(f"💾 {left} updates could not be sent yet and stay spooled in {spool_path} for the next start")
 
 def tag_scene_error(scene_id, error_tag, error_msg=None):
-    if dry_run:
+    if config.dry_run:
         print(f"[DRY RUN] Would tag scene {scene_id} with error tag {error_tag}")
         return
-    stash.update_scenes({"ids": scene_id, "tag_ids": {"ids": error_tag, "mode": "ADD"}})
-    stash.update_scenes({"ids": scene_id, "tag_ids": {"ids": hashing_tag, "mode": "REMOVE"}})
+    spool_tag(scene_id, error_tag, "ADD")
+    queue_release(scene_id)
     if error_msg:
         try:
             with open("error_log.txt", "a", encoding="utf-8") as log:
@@ -46,35 +305,78 @@ def tag_scene_error(scene_id, error_tag, error_msg=None):
             with open("error_log.txt", "a", encoding="utf-8", errors="replace") as log:
                 log.write(f"Scene {scene_id}: {error_msg}\n")
 
-def claim_scene(scene_id):
-    if dry_run:
-        print(f"[DRY RUN] Would claim scene {scene_id}")
+def claim_scenes(scene_ids):
+    # Claims go out immediately so other nodes stop picking these scenes
+    if config.dry_run:
+        print(f"[DRY RUN] Would claim scenes {', '.join(str(s) for s in scene_ids)}")
         return
-    stash.update_scenes({"ids": scene_id, "tag_ids": {"ids": hashing_tag, "mode": "ADD"}})
+    with _release_lock:
+        _released.difference_update(scene_ids)
+    tag_batcher.add(scene_ids, hashing_tag, "ADD")
+    tag_batcher.flush()
+
+def claim_scene(scene_id):
+    claim_scenes([scene_id])
+
+def reclaim_scenes(scene_ids):
+    # Expired leases of other nodes go back through the batcher, after anything queued before
+    tag_batcher.add(scene_ids, hashing_tag, "REMOVE")
+    tag_batcher.flush()
 
 def release_scene(scene_id):
-    if dry_run:
+    if config.dry_run:
         print(f"[DRY RUN] Would release scene {scene_id}")
         return
-    stash.update_scenes({"ids": scene_id, "tag_ids": {"ids": hashing_tag, "mode": "REMOVE"}})
+    queue_release(scene_id)
 
 def update_phash(file_id, phash):
-    if dry_run:
+    if config.dry_run:
         print(f"[DRY RUN] Would update phash for file {file_id} to {phash}")
         return
+    if spool:
+        spool.append("phash", file_id=file_id, phash=phash)
+        return
     stash.file_set_fingerprints(file_id, [{"type": "phash", "value": phash}])
 
 def update_cover(scene_id, cover_data):
-    if dry_run:
+    if config.dry_run:
         print(f"[DRY RUN] Would update cover image for scene {scene_id}")
         return True
+    if spool:
+        spool.append("cover", scene_id=scene_id, cover_data=cover_data)
+        return True
     return stash.update_scene({"id": scene_id, "cover_image": cover_data})
 
+def find_scenes_missing_cover(scene_ids):
+    """
+    Ids of the given scenes that have no cover image, from one query for the whole batch.
+    """
+    if not scene_ids:
+        return set()
+    result = stash.call_GQL(FIND_SCENE_IDS_QUERY, {
+        "filter": {"per_page": -1},
+        "scene_filter": {"is_missing": "cover"},
+        "scene_ids": [int(scene_id) for scene_id in scene_ids],
+    })
+    return {s['id'] for s in result['findScenes']['scenes']}
+
+def screenshot_is_placeholder(url):
+    """
+    Whether Stash serves its SVG placeholder for a scene's screenshot. Only the first
+    kilobyte is requested (and read, should the server ignore the Range header).
+    """
+    if not url:
+        return False
+    with http.get(url, headers={"Range": "bytes=0-1023"}, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        if "svg" in response.headers.get("Content-Type", "").lower():
+            return True
+        head = next(response.iter_content(1024), b"")
+    return b"<svg" in head.lower()
+
 def get_scenes_to_process():
     return stash.find_scenes(
-        f={"phash": {"value": "", "modifier": "IS_NULL"},
-           "tags": {"value": [hashing_tag, hashing_error_tag, cover_error_tag], "modifier": "EXCLUDES"}},
+        f=build_scene_filter(),
         filter={"sort": "created_at", "direction": "DESC", "per_page": -1},
-        fragment="id files{id path fingerprints{value type}} paths{screenshot}"
+        fragment=f"id files{{{STASH_FILE_FRAGMENT}}} paths{{screenshot}}"
     )
-
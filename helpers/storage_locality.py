@@ -0,0 +1,140 @@
+# storage_locality.py
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+from helpers.telemetry import metrics
+
+
+def translate_path(path):
+    """
+    Local path of a Stash path, through config.translations.
+    """
+    for t in config.translations:
+        path = path.replace(t['orig'], t['local'], 1)
+    return os.path.normpath(path)
+
+
+def filesystem_mount(path):
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def volume_of(path):
+    """
+    The storage volume a local path lives on: the longest translated root it is
+    under (S:/, P:/, /mnt/nas2 ...) or the staging directory, or its filesystem
+    mount for paths outside every translation.
+    """
+    path = os.path.normpath(path)
+    best = None
+    roots = [t['local'] for t in config.translations] + ([config.staging_path] if config.staging_path else [])
+    for root in roots:
+        root = os.path.normpath(root)
+        if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and (best is None or len(root) > len(best)):
+            best = root
+    return best or filesystem_mount(path)
+
+
+def read_limit(volume, default=None):
+    if config.staging_path and volume == os.path.normpath(config.staging_path):
+        return config.staging_read_slots
+    # config.mount_read_limits keys are written like the translations ('S:/'), so compare normalized
+    for root, limit in config.mount_read_limits.items():
+        if os.path.normpath(root) == volume:
+            return limit
+    return default or config.mount_read_slots
+
+
+class StorageLocality:
+    """
+    Spreads in-flight scenes over the storage volumes behind config.translations.
+
+    Every scene is grouped by the volume its translated file lives on. When a
+    worker frees up, choose() starts the highest-priority queued scene on the
+    volume that is least busy relative to its read limit, so separate drives or
+    NAS volumes are read in parallel instead of every worker seeking on one disk.
+    With a single volume this is plain queue order.
+
+    Scenes, bytes and busy time (wall time with at least one scene on the volume)
+    are counted per volume for report() and the mount_* metrics.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}       # volume -> scenes in flight
+        self.busy_since = {}   # volume -> time the volume went from idle to busy
+        self.stats = {}        # volume -> {"scenes", "bytes", "busy"}
+
+    def scene_volume(self, scene):
+        if '_volume' not in scene:
+            scene['_volume'] = volume_of(translate_path(scene['files'][0]['path']))
+        return scene['_volume']
+
+    def choose(self, items):
+        """
+        Index of the queued (scene, index, batch_size) item to start next.
+        """
+        if not config.interleave_mounts or len(items) < 2:
+            return 0
+        with self.lock:
+            active = dict(self.active)
+        best, best_load = 0, None
+        for position, item in enumerate(items):
+            volume = self.scene_volume(item[0])
+            load = active.get(volume, 0) / max(1, read_limit(volume))
+            if best_load is None or load < best_load:
+                best, best_load = position, load
+                if load == 0:
+                    break
+        return best
+
+    @contextmanager
+    def track(self, scene):
+        volume = self.scene_volume(scene)
+        size = scene['files'][0].get('size') or 0
+        with self.lock:
+            if not self.active.get(volume):
+                self.busy_since[volume] = time.monotonic()
+            self.active[volume] = self.active.get(volume, 0) + 1
+        metrics.add("mount_scenes_in_flight", 1, mount=volume)
+        try:
+            yield volume
+        finally:
+            now = time.monotonic()
+            with self.lock:
+                self.active[volume] -= 1
+                stats = self.stats.setdefault(volume, {"scenes": 0, "bytes": 0, "busy": 0.0})
+                stats["scenes"] += 1
+                stats["bytes"] += size
+                if not self.active[volume]:
+                    busy = now - self.busy_since.pop(volume)
+                    stats["busy"] += busy
+                    metrics.inc("mount_busy_seconds_total", busy, mount=volume)
+            metrics.add("mount_scenes_in_flight", -1, mount=volume)
+            metrics.inc("mount_scenes_total", mount=volume)
+            metrics.inc("mount_bytes_total", size, mount=volume)
+
+    def report(self):
+        now = time.monotonic()
+        with self.lock:
+            rows = []
+            for volume, stats in sorted(self.stats.items()):
+                busy = stats["busy"] + (now - self.busy_since[volume] if volume in self.busy_since else 0.0)
+                rows.append((volume, stats["scenes"], stats["bytes"], busy))
+        if not rows:
+            return
+        for volume, scenes, size, busy in rows:
+            throughput = size / busy / 1e6 if busy else 0.0
+            print(f"💽 {volume}: {scenes} scenes, {size / 1e9:.1f} GB in {busy:.0f}s busy ({throughput:.1f} MB/s)")
+
+
+locality = StorageLocality()
@@ -0,0 +1,269 @@
+# telemetry.py
+
+import json
+import platform
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from quick API calls to long preview encodes
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+OPERATION_RE = re.compile(r'\b(?:query|mutation)\s+(\w+)')
+
+
+def label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Telemetry:
+    """
+    Node-wide counters, gauges and histograms, shared by every worker thread.
+
+    Everything is kept in memory and costs a dict update per event. Two optional
+    outputs read from it:
+    - a Prometheus text endpoint at http://<node>:<metrics_port>/metrics
+    - a JSON-lines event log with one line per timed stage and API call
+
+    Gauges can also be callbacks (queue depth, in-flight scenes), evaluated on scrape.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # name -> {label key: value}
+        self.gauges = {}      # name -> {label key: value}
+        self.callbacks = {}   # name -> function
+        self.histograms = {}  # name -> {label key: Histogram}
+        self.help = {}
+        self.node = platform.node()
+        self.started = time.time()
+        self.log = None
+        self.server = None
+
+    def configure(self, port=0, log_path=""):
+        if log_path and self.log is None:
+            self.log = open(log_path, "a", encoding="utf-8")
+        if port and self.server is None:
+            self.serve(port)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[label_key(labels)] = value
+
+    def add(self, name, delta, **labels):
+        with self.lock:
+            series = self.gauges.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + delta
+
+    def gauge_callback(self, name, function):
+        with self.lock:
+            self.callbacks[name] = function
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def total(self, name):
+        # Sum of a counter over all its labels
+        with self.lock:
+            return sum(self.counters.get(name, {}).values())
+
+    def histogram_total(self, name, **labels):
+        # (count, sum) of one histogram series, (0, 0.0) before its first observation
+        with self.lock:
+            histogram = self.histograms.get(name, {}).get(label_key(labels))
+            return (histogram.count, histogram.sum) if histogram else (0, 0.0)
+
+    def event(self, event, **fields):
+        if self.log is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "node": self.node, "event": event, **fields}, default=str)
+        with self.lock:
+            if self.log is None:
+                return
+            self.log.write(line + "\n")
+            self.log.flush()
+
+    @contextmanager
+    def stage(self, stage, scene_id=None):
+        """
+        Times a process_scene stage into stage_seconds{stage} and the event log.
+        A stage that raises is counted in stage_errors_total.
+        """
+        started = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe("stage_seconds", seconds, stage=stage)
+            if not ok:
+                self.inc("stage_errors_total", stage=stage)
+            self.event("stage", stage=stage, scene_id=scene_id, seconds=round(seconds, 4), ok=ok)
+
+    @contextmanager
+    def api_call(self, query):
+        """
+        Times one GraphQL request per operation name, into stash_api_seconds{operation}
+        and the event log.
+        """
+        match = OPERATION_RE.search(query)
+        operation = match.group(1) if match else "anonymous"
+        started = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe("stash_api_seconds", seconds, operation=operation)
+            if not ok:
+                self.inc("stash_api_errors_total", operation=operation)
+            self.event("api", operation=operation, seconds=round(seconds, 4), ok=ok)
+
+    def instrument_graphql(self, client):
+        """
+        Wraps a stashapi client's call_GQL so every GraphQL request goes through api_call().
+        """
+        call = client.call_GQL
+        telemetry = self
+
+        def timed_call(query, variables={}, callback=None):
+            with telemetry.api_call(query):
+                return call(query, variables, callback=callback)
+
+        client.call_GQL = timed_call
+
+    def render(self):
+        """
+        The current values in the Prometheus text exposition format.
+        """
+        with self.lock:
+            callbacks = dict(self.callbacks)
+        gauges_from_callbacks = {}
+        for name, function in callbacks.items():
+            try:
+                gauges_from_callbacks[name] = {(): function()}
+            except Exception:
+                continue
+
+        lines = []
+
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            header("uptime_seconds", "gauge")
+            lines.append(f"uptime_seconds {time.time() - self.started:.3f}")
+            for name, series in sorted(self.counters.items()):
+                header(name, "counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(key)} {value}")
+            for name, series in sorted({**self.gauges, **gauges_from_callbacks}.items()):
+                header(name, "gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"📈 Serving metrics on http://{self.node}:{port}/metrics")
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.log:
+            with self.lock:
+                self.log.close()
+                self.log = None
+
+
+metrics = Telemetry()
+metrics.describe("scenes_total", "Scenes finished, by result")
+metrics.describe("stage_seconds", "Wall time of each process_scene stage")
+metrics.describe("stage_errors_total", "Stages that raised")
+metrics.describe("stash_api_seconds", "Wall time of each GraphQL request, by operation")
+metrics.describe("stash_api_errors_total", "GraphQL requests that failed, by operation")
+metrics.describe("source_bytes_total", "Size of the source files opened for decoding")
+metrics.describe("media_processes_active", "ffmpeg/ffprobe/videohashes runs holding a scheduler reservation")
+metrics.describe("scheduler_wait_seconds", "Time spent waiting for decode, encode or read capacity")
+metrics.describe("scene_queue_depth", "Claimed scenes waiting for a worker")
+metrics.describe("scenes_in_flight", "Scenes being processed right now")
+metrics.describe("mount_scenes_in_flight", "Scenes being processed per storage volume")
+metrics.describe("mount_scenes_total", "Scenes finished per storage volume")
+metrics.describe("mount_bytes_total", "Source bytes of finished scenes per storage volume")
+metrics.describe("mount_busy_seconds_total", "Wall time with at least one scene in flight per storage volume")
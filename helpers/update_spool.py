@@ -0,0 +1,175 @@
+# update_spool.py
+
+import json
+import os
+import threading
+import time
+
+
+class UpdateSpool:
+    """
+    Durable write-behind queue for results headed to Stash.
+
+    Workers append() each update to an append-only JSONL journal (fsynced) and
+    move on. A background thread hands everything pending to replay() in
+    batches. Whatever replay() reports as applied is acknowledged in the journal.
+    Only transport errors (transient(error) is true, e.g. Stash unreachable) are
+    retried, with exponential backoff. Any other failure means some record in the
+    batch is rejected for good: the batch is bisected down to that record, which
+    is written to the dead-letter file and acknowledged, and the rest go through.
+    Updates that were never acknowledged are loaded and replayed on the next start.
+
+    Journal lines are either {"seq": n, "op": ..., "args": {...}} or {"ack": [n, ...]}.
+    The journal is compacted whenever nothing is pending.
+    """
+
+    def __init__(self, path, replay, flush_interval=2, max_backoff=60, dead_letter_path=None, transient=None):
+        self.path = path
+        self.replay = replay
+        self.dead_letter_path = dead_letter_path or os.path.splitext(path)[0] + '.failed.jsonl'
+        self.transient = transient or (lambda error: True)
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.condition = threading.Condition()
+        self.pending = {}  # seq -> record, insertion ordered
+        self.seq = 0
+        self.first_pending = None
+        self.flush_now = False
+        self.thread = None
+        self.load()
+        self.journal = open(self.path, 'a', encoding='utf-8')
+        if self.pending:
+            print(f"💾 Replaying {len(self.pending)} updates left in {self.path}")
+            self.start()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        records, acked = {}, set()
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if 'ack' in entry:
+                    acked.update(entry['ack'])
+                else:
+                    records[entry['seq']] = entry
+        self.pending = {seq: record for seq, record in records.items() if seq not in acked}
+        self.seq = max(records, default=0)
+        self.first_pending = time.monotonic() if self.pending else None
+        self.rewrite()
+
+    def rewrite(self):
+        # Atomically replace the journal with just the pending records
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as journal:
+            for record in self.pending.values():
+                journal.write(json.dumps(record) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self.path)
+
+    def write(self, entry):
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def append(self, op, durable=True, **args):
+        # Records that are not durable are sent in order like the rest but never
+        # journaled, so a restart doesn't replay them
+        with self.condition:
+            self.seq += 1
+            record = {'seq': self.seq, 'op': op, 'args': args}
+            if durable:
+                self.write(record)
+            self.pending[self.seq] = record
+            if self.first_pending is None:
+                self.first_pending = time.monotonic()
+            self.condition.notify_all()
+        self.start()
+
+    def ack(self, seqs):
+        with self.condition:
+            seqs = [seq for seq in seqs if seq in self.pending]
+            if not seqs:
+                return
+            for seq in seqs:
+                del self.pending[seq]
+            if self.pending:
+                self.write({'ack': seqs})
+            else:
+                # Nothing left, start the journal over
+                self.journal.close()
+                self.rewrite()
+                self.journal = open(self.path, 'a', encoding='utf-8')
+                self.first_pending = None
+            self.condition.notify_all()
+
+    def start(self):
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def due(self):
+        if not self.pending:
+            return False
+        return self.flush_now or time.monotonic() - self.first_pending >= self.flush_interval
+
+    def run(self):
+        backoff = 1
+        while True:
+            with self.condition:
+                while not self.due():
+                    self.condition.wait(timeout=self.flush_interval)
+                batch = list(self.pending.values())
+                self.first_pending = time.monotonic()
+
+            try:
+                self.send(batch)
+                backoff = 1
+            except Exception as e:
+                print(f"⚠️ Stash update failed, {len(self.pending)} updates spooled, retrying in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def send(self, records):
+        # Raises only on transport errors; rejected records are bisected out and dead-lettered
+        try:
+            self.replay(records, self.ack)
+            return
+        except Exception as e:
+            if self.transient(e):
+                raise
+            error = e
+        with self.condition:
+            records = [record for record in records if record['seq'] in self.pending]
+        if len(records) == 1:
+            self.dead_letter(records[0], error)
+        elif records:
+            middle = len(records) // 2
+            self.send(records[:middle])
+            self.send(records[middle:])
+
+    def dead_letter(self, record, error):
+        print(f"☠️ Stash rejected spooled {record['op']} update {record['seq']}, moved to {self.dead_letter_path}: {error}")
+        entry = dict(record, error=str(error), failed_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as dead_letters:
+            dead_letters.write(json.dumps(entry) + '\n')
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+        self.ack([record['seq']])
+
+    def drain(self, timeout=30):
+        """
+        Flushes immediately and waits up to timeout seconds for the spool to empty.
+        Returns the number of updates still pending (kept on disk for the next start).
+        """
+        with self.condition:
+            self.flush_now = True
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: not self.pending, timeout=timeout)
+            self.flush_now = False
+            return len(self.pending)
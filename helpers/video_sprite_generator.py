@@ -1,17 +1,18 @@
 # video_sprite_generator.py
 
-import subprocess
+import numpy as np
 from PIL import Image
 import os
-import shutil
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 from config import verbose
+from helpers.frame_extractor import FrameExtractor
+from helpers.resource_scheduler import scheduler
+from helpers.media_info import get_media_info
+from helpers.encoder_calibration import encoders
 
 class VideoSpriteGenerator:
-    def __init__(self, video_path, sprite_path, vtt_path, filehash, ffmpeg='ffmpeg', ffprobe='ffprobe', total_shots=81, max_width=160, max_height=90, columns=9, rows=9):
+    def __init__(self, video_path, sprite_path, vtt_path, filehash, ffmpeg='ffmpeg', ffprobe='ffprobe', total_shots=81, max_width=160, max_height=90, columns=9, rows=9, seek_mode='exact', media_info=None):
         self.video_path = os.path.abspath(video_path.strip('"').strip("'"))
-        self.temp_dir = os.path.abspath(f"screenshots_{filehash}")
         self.sprite_path = os.path.abspath(sprite_path)
         self.vtt_path = os.path.abspath(vtt_path)
         self.total_shots = total_shots
@@ -21,69 +22,76 @@ class VideoSpriteGenerator:
         self.rows = rows
         self.ffmpeg = ffmpeg
         self.ffprobe = ffprobe
+        self.seek_mode = seek_mode
+        self.media_info = media_info
+
+    def get_media_info(self):
+        if self.media_info is None:
+            self.media_info = get_media_info(self.video_path, self.ffprobe)
+        return self.media_info
 
     def get_video_duration(self):
-        result = subprocess.run(
-            [self.ffprobe, '-v', 'error', '-show_entries', 'format=duration',
-             '-of', 'default=noprint_wrappers=1:nokey=1', self.video_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        try:
-            return float(result.stdout)
-        except:
-            return False
+        return self.get_media_info().duration
 
     def clean_previous_files(self):
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
         if os.path.exists(self.vtt_path):
             os.remove(self.vtt_path)
 
+    def new_canvas(self):
+        # The whole sprite lives in one preallocated RGB24 array (~3.5 MB for 9x9 tiles of 160x90)
+        return np.zeros((self.max_height * self.rows, self.max_width * self.columns, 3), dtype=np.uint8)
+
+    def paste_frame(self, canvas, idx, frame):
+        frame_size = self.max_width * self.max_height * 3
+        if len(frame) != frame_size:
+            raise ValueError(f"Screenshot {idx} is {len(frame)} bytes, expected {frame_size}")
+        x = (idx % self.columns) * self.max_width
+        y = (idx // self.columns) * self.max_height
+        canvas[y:y + self.max_height, x:x + self.max_width] = np.frombuffer(frame, dtype=np.uint8).reshape(
+            self.max_height, self.max_width, 3
+        )
+
     def take_screenshots(self):
+        """
+        Pulls every screenshot out of one ffmpeg process as scaled RGB24 frames and
+        writes them straight into the sprite canvas. Returns the canvas, or None for a
+        zero-length file; a file that can't be probed raises.
+        """
         self.clean_previous_files()
-        os.makedirs(self.temp_dir, exist_ok=True)
 
         duration = self.get_video_duration()
         if not duration:
-            return False
+            return None
 
-        interval = duration / self.total_shots
+        extractor = FrameExtractor(self.video_path, self.ffmpeg, self.max_width, self.max_height, mode=self.seek_mode,
+                                   input_args=encoders.decode_args())
+        with scheduler.reserve(self.video_path):
+            frames = extractor.extract(self.get_timestamps(duration))
+
+        canvas = self.new_canvas()
+        iterator = tqdm(enumerate(frames), desc="🧩 Assembling Sprite", unit="tile", total=len(frames)) if verbose else enumerate(frames)
+        for idx, frame in iterator:
+            self.paste_frame(canvas, idx, frame)
 
-        def extract_and_resize(i):
-            time = i * interval
-            output_file = os.path.join(self.temp_dir, f'frame_{i:03d}.jpg')
-            command = [
-                self.ffmpeg,
-                '-ss', str(time),
-                '-i', self.video_path,
-                '-frames:v', '1',
-                '-q:v', '2',
-                output_file,
-                '-loglevel', 'quiet'
-            ]
-            subprocess.run(command, check=True)
-            with Image.open(output_file) as img:
-                img = img.resize((self.max_width, self.max_height), Image.Resampling.LANCZOS)
-                img.save(output_file)
-            return (i, time)
+        self.write_vtt(duration)
+        return canvas
 
+    def get_timestamps(self, duration):
+        interval = duration / self.total_shots
+        return [i * interval for i in range(self.total_shots)]
+
+    def write_vtt(self, duration):
+        interval = duration / self.total_shots
         with open(self.vtt_path, 'w') as vtt_file:
             vtt_file.write("WEBVTT\n\n")
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(extract_and_resize, i) for i in range(self.total_shots)]
-                iterator = tqdm(futures, desc="🖼️ Extracting Screenshots", unit="frame") if verbose else futures
-                for future in iterator:
-                    i, time = future.result()
-                    end_time = time + interval
-                    start_time_str = self.format_time(time)
-                    end_time_str = self.format_time(end_time)
-                    x = (i % self.columns) * self.max_width
-                    y = (i // self.columns) * self.max_height
-                    vtt_file.write(f"{start_time_str} --> {end_time_str}\n")
-                    vtt_file.write(f"{os.path.basename(self.sprite_path)}#xywh={x},{y},{self.max_width},{self.max_height}\n\n")
-
-        return True
+            for i, time in enumerate(self.get_timestamps(duration)):
+                end_time = time + interval
+                start_time_str = self.format_time(time)
+                end_time_str = self.format_time(end_time)
+                x = (i % self.columns) * self.max_width
+                y = (i // self.columns) * self.max_height
+                vtt_file.write(f"{start_time_str} --> {end_time_str}\n")
+                vtt_file.write(f"{os.path.basename(self.sprite_path)}#xywh={x},{y},{self.max_width},{self.max_height}\n\n")
 
     def format_time(self, seconds):
         millisec = int((seconds % 1) * 1000)
@@ -92,33 +100,27 @@ class VideoSpriteGenerator:
         hours, minutes = divmod(minutes, 60)
         return f"{hours:02}:{minutes:02}:{seconds:02}.{millisec:03}"
 
-    def create_sprite(self):
-        images = [
-            Image.open(os.path.join(self.temp_dir, img))
-            for img in sorted(os.listdir(self.temp_dir))
-            if img.endswith('.jpg')
-        ]
-        if not images:
-            raise ValueError("Something went wrong, no images found to create sprite")
+    def create_sprite(self, canvas):
+        # Single JPEG encode of the finished canvas
+        Image.fromarray(canvas).save(self.sprite_path)
 
-        sprite_width = self.max_width * self.columns
-        sprite_height = self.max_height * self.rows
-        sprite = Image.new('RGB', (sprite_width, sprite_height))
+    def create_sprite_from_frames(self, frames, duration):
+        """
+        Builds the sprite and VTT from raw RGB24 tiles that were already decoded
+        elsewhere (e.g. by the single-pass pipeline), skipping the screenshot step.
+        """
+        if len(frames) != self.total_shots:
+            raise ValueError(f"Expected {self.total_shots} sprite frames, got {len(frames)}")
 
-        iterator = tqdm(enumerate(images), desc="🧩 Assembling Sprite", unit="tile", total=len(images)) if verbose else enumerate(images)
-        for idx, img in iterator:
-            x = (idx % self.columns) * self.max_width
-            y = (idx // self.columns) * self.max_height
-            sprite.paste(img, (x, y))
+        canvas = self.new_canvas()
+        for idx, frame in enumerate(frames):
+            self.paste_frame(canvas, idx, frame)
+        self.create_sprite(canvas)
 
-        sprite.save(self.sprite_path)
-
-    def clean_up(self):
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+        self.clean_previous_files()
+        self.write_vtt(duration)
 
     def generate_sprite(self):
-        result = self.take_screenshots()
-        if result:
-            self.create_sprite()
-        self.clean_up()
+        canvas = self.take_screenshots()
+        if canvas is not None:
+            self.create_sprite(canvas)
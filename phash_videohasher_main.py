@@ -1,17 +1,27 @@
 # main.py
 
 import argparse
-import re
 import os
-import shutil
 import time
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import config
 from helpers.scene_discovery import discover_scenes
 from helpers.scene_processor import process_scene
-from helpers.stash_utils import get_total_scene_count, tag_scene_error, reset_terminal, claim_scene
+from helpers.stash_utils import get_total_scene_count, reset_terminal, flush_tag_updates, release_scene, size_http_pool
+from helpers.lease_manager import LeaseManager
+from helpers.scene_feed import SceneFeed
+from helpers.resource_scheduler import scheduler
+from helpers.telemetry import metrics
+from helpers.concurrency_controller import ConcurrencyController
+from helpers.scene_scheduler import CostModel, SceneOrder
+from helpers.storage_locality import locality
+from helpers.async_engine import AsyncEngine
+from helpers.encoder_calibration import encoders
+from helpers.duplicate_index import get_duplicate_index
+from helpers.scene_watcher import SceneWatcher
+from helpers.staging_cache import staging
 
 def apply_cli_args(args):
     config.windows = args.windows
@@ -20,14 +30,57 @@ def apply_cli_args(args):
     config.dry_run = args.dry_run
     config.verbose = args.verbose
     config.once = args.once
+    if args.watch:
+        config.watch = True
+    if args.sprite_seek_mode:
+        config.sprite_seek_mode = args.sprite_seek_mode
+    if args.phash_engine:
+        config.phash_engine = args.phash_engine
+    if args.no_single_pass:
+        config.single_pass = False
     if args.batch_size:
         config.per_page = args.batch_size
     if args.max_workers:
         config.max_workers = args.max_workers
+    if args.lease_ttl:
+        config.lease_ttl = args.lease_ttl
+    if args.preview_encoder:
+        config.preview_encoder = args.preview_encoder
+    if args.hwaccel:
+        config.hwaccel = args.hwaccel
+    if args.cover_candidates:
+        config.cover_candidates = args.cover_candidates
+    if args.auto_concurrency:
+        config.auto_concurrency = True
+    if args.engine:
+        config.engine = args.engine
+    if args.async_max_scenes:
+        config.async_max_scenes = args.async_max_scenes
+    if args.scheduling:
+        config.scheduling_policy = args.scheduling
+    if args.no_interleave_mounts:
+        config.interleave_mounts = False
+    if args.staging_path:
+        config.staging_path = args.staging_path
+    if args.staging_max_gb:
+        config.staging_max_gb = args.staging_max_gb
+    if args.metrics_port:
+        config.metrics_port = args.metrics_port
+    if args.metrics_log:
+        config.metrics_log_path = args.metrics_log
+    if args.duplicate_distance is not None:
+        config.duplicate_distance = args.duplicate_distance
+    if args.decode_slots:
+        config.decode_slots = args.decode_slots
+    if args.encoder_sessions:
+        config.encoder_sessions = args.encoder_sessions
+    if args.mount_read_slots:
+        config.mount_read_slots = args.mount_read_slots
+    scheduler.configure(config.decode_slots, config.encoder_sessions, config.mount_read_slots)
 
 def clean_temp_dirs():
     for folder in os.listdir():
-        if folder.startswith("preview_temp_") or folder.startswith("screenshots_") or folder.startswith("cover_temp_"):
+        if folder.startswith("preview_temp_") or folder.startswith("screenshots_") or folder.startswith("cover_temp_") or folder.startswith("single_pass_temp_"):
             try:
                 shutil.rmtree(folder)
                 if config.verbose:
@@ -36,6 +89,39 @@ def clean_temp_dirs():
                 if config.verbose:
                     print(f"⚠️ Failed to remove {folder}: {e}")
 
+def process_leased_scene(leases, cost_model, scene, index, total_batch):
+    # The heartbeat keeps the lease alive while process_scene runs
+    try:
+        if leases.is_lost(scene['id']):
+            print(f"⏭️ Skipping scene {scene['id']}, another node already hashed it")
+            release_scene(scene['id'])
+            return
+        started = time.monotonic()
+        with locality.track(scene):
+            result = process_scene(scene, index, total_batch)
+        if result == "done":
+            cost_model.observe(scene, time.monotonic() - started)
+    finally:
+        leases.drop(scene['id'])
+
+def fetch_batch(leases):
+    """
+    Discovers and leases the next batch for the feed. Returns None when no scenes are left.
+    """
+    try:
+        leases.sweep_expired()
+    except Exception as e:
+        print(f"⚠️ Failed to sweep expired leases: {e}")
+
+    scenes = discover_scenes()
+    if not scenes:
+        return None
+
+    print(f"🎯 Selected page with {len(scenes)} scenes (out of {get_total_scene_count()} total)")
+    scenes = leases.claim(scenes)
+    leases.report()
+    return scenes
+
 def main():
     parser = argparse.ArgumentParser(description="Stash Scene Processor CLI")
     parser.add_argument("--windows", action="store_true", help="Use Windows-style paths and binaries")
@@ -43,55 +129,134 @@ def main():
     parser.add_argument("--generate-preview", action="store_true", help="Enable preview video generation")
     parser.add_argument("--batch-size", type=int, help="Number of scenes to process per run (default: 25)")
     parser.add_argument("--max-workers", type=int, help="Number of threads for parallel processing (default: 4)")
+    parser.add_argument("--decode-slots", type=int, help="Video decodes running at once across all workers (default: half the CPU cores)")
+    parser.add_argument("--encoder-sessions", type=int, help="Preview encodes running at once across all workers (default: 2)")
+    parser.add_argument("--mount-read-slots", type=int, help="Processes reading from one storage mount at once (default: 2)")
+    parser.add_argument("--no-interleave-mounts", action="store_true", help="Start scenes in queue order instead of spreading them over storage volumes")
+    parser.add_argument("--staging-path", help="Copy source files to this local directory ahead of processing and read them there (default: off)")
+    parser.add_argument("--staging-max-gb", type=float, help="Size cap of the staged copies in GB (default: 50)")
     parser.add_argument("--dry-run", action="store_true", help="Simulate processing without writing changes")
     parser.add_argument("--verbose", action="store_true", help="Enable detailed output and progress bars")
     parser.add_argument("--once", action="store_true", help="Run a single batch and exit")
+    parser.add_argument("--watch", action="store_true", help="Keep running when no scenes are left and pick up new scenes as Stash adds them")
+    parser.add_argument("--sprite-seek-mode", choices=["keyframe", "exact"], help="Sprite screenshots at the nearest keyframe (fast, tiles may not match their VTT times) or exact timestamps (default: exact)")
+    parser.add_argument("--phash-engine", choices=["native", "binary"], help="Compute phash in-process (native) or with the videohashes binary (default: binary)")
+    parser.add_argument("--lease-ttl", type=int, help="Seconds a scene claim stays valid without a heartbeat (default: 900)")
+    parser.add_argument("--cover-candidates", type=int, help="Frames to compare when picking a cover, skipping black and blurry ones (default: 1)")
+    parser.add_argument("--preview-encoder", help="Preview encoder: auto (calibrated per host) or an ffmpeg encoder such as libx264 or h264_nvenc (default: auto)")
+    parser.add_argument("--hwaccel", help="Decoder for sprite screenshots: auto (calibrated per host), none or an ffmpeg -hwaccel method (default: auto)")
+    parser.add_argument("--recalibrate", action="store_true", help="Measure the encoders and decoders again instead of using the cached results")
+    parser.add_argument("--scheduling", choices=["fifo", "sjf", "lpt", "fair"], help="Order of claimed scenes by estimated cost (default: fair)")
+    parser.add_argument("--engine", choices=["threads", "async"], help="Run scenes on a thread each or as asyncio tasks (default: threads)")
+    parser.add_argument("--async-max-scenes", type=int, help="Scenes in flight at once with --engine async (default: 64)")
+    parser.add_argument("--auto-concurrency", action="store_true", help="Adjust in-flight scenes and decode slots to the live load")
+    parser.add_argument("--duplicate-distance", type=int, help="Largest phash distance reported as a near-duplicate of a file hashed before, -1 to turn off (default: 4)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics (default: off)")
+    parser.add_argument("--metrics-log", help="Append per-stage timings and API calls as JSON lines to this file")
+    parser.add_argument("--no-single-pass", action="store_true", help="Generate each artifact with its own ffmpeg run instead of one decode per file when a sprite or preview is missing")
 
     args = parser.parse_args()
     apply_cli_args(args)
+    size_http_pool()
+    metrics.configure(config.metrics_port, config.metrics_log_path)
+    if config.generate_sprite or config.generate_preview:
+        # Only the sprite and preview stages use the calibrated encoder and decoder
+        encoders.configure(config.ffmpeg, recalibrate=args.recalibrate)
 
-    while True:
-        clean_temp_dirs()
+    leases = LeaseManager()
+    clean_temp_dirs()
 
-        scenes = discover_scenes()
-        if not scenes:
-            print("✅ No scenes to process. Exiting.")
-            reset_terminal()
-            break
+    cost_model = CostModel(config.cost_model_path)
+    order = SceneOrder(cost_model, config.scheduling_policy, config.fair_aging)
+    use_async = config.engine == "async"
+    low_water = config.async_max_scenes if use_async else config.max_workers
+    watcher = None
+    if config.watch and config.once:
+        print("⚠️ --watch has no effect with --once")
+    elif config.watch:
+        watcher = SceneWatcher(leases)
+        watcher.start()
+    fetch = watcher.fetch_batch if watcher else lambda: fetch_batch(leases)
+    feed = SceneFeed(fetch, low_water=low_water, once=config.once, order=order, choose=locality.choose)
+    feed.start()
+    staging.start(feed)
 
-        total_batch = len(scenes)
-        total_database = get_total_scene_count()
-        print(f"🎯 Selected page with {total_batch} scenes (out of {total_database} total)")
+    controller = None
+    if config.auto_concurrency and use_async:
+        print("⚠️ --auto-concurrency only tunes the thread engine; the async engine is bounded by async_max_scenes and the resource budgets")
+    elif config.auto_concurrency:
+        # The pool is sized for the upper bound; config.max_workers limits how many scenes run
+        config.max_workers = min(max(config.max_workers, config.auto_workers_min), config.auto_workers_max)
+        controller = ConcurrencyController(feed)
+        controller.start()
+    executor = None
+    running = set()
+    metrics.gauge_callback("scene_queue_depth", lambda: len(feed.queue))
+    if not use_async:
+        executor = ThreadPoolExecutor(max_workers=config.auto_workers_max if controller else config.max_workers)
+        metrics.gauge_callback("scenes_in_flight", lambda: len(running))
+    try:
+        if use_async:
+            AsyncEngine(feed, leases, cost_model).run()
+        else:
+            while True:
+                # Top up free worker slots; only block on the feed when nothing is running
+                while len(running) < config.max_workers:
+                    item = feed.get(block=not running)
+                    if item is None:
+                        break
+                    running.add(executor.submit(process_leased_scene, leases, cost_model, *item))
 
-        for scene in scenes:
-            try:
-                claim_scene(scene['id'])
-            except Exception as e:
-                print(f"⚠️ Failed to tag scene {scene['id']} during batch tagging: {e}")
+                if not running and feed.done:
+                    break
 
-        try:
-            with ThreadPoolExecutor(max_workers=config.max_workers) as executor:
-                futures = []
-                for index, scene in enumerate(scenes, start=1):
-                    filename_pretty = re.search(r'.*[/\\](.*?)$', scene['files'][0]['path']).group(1)
-                    futures.append(executor.submit(process_scene, scene, index, total_batch))
+                # Wake up periodically so newly prefetched scenes fill idle slots
+                done, running = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"❌ Unexpected error while processing a scene: {e}")
 
-                for future in futures:
-                    future.result()
-
-        except KeyboardInterrupt:
-            print("\n🛑 Interrupted by user. Shutting down gracefully...")
+    except KeyboardInterrupt:
+        print("\n🛑 Interrupted by user. Shutting down gracefully...")
+        if watcher:
+            watcher.stop()
+        for scene in feed.stop():
+            release_scene(scene['id'])
+            leases.drop(scene['id'])
+        if executor:
             executor.shutdown(wait=False, cancel_futures=True)
-            reset_terminal()
-            break
-
-        if config.once:
-            print("✅ Finished single batch. Exiting due to --once flag.")
-            reset_terminal()
-            break
+        if controller:
+            controller.stop()
+        staging.stop()
+        leases.stop()
+        flush_tag_updates()
+        cost_model.save()
+        metrics.close()
+        reset_terminal()
+        return
 
-        print("⏳ Waiting 5 seconds before next batch... Press Ctrl+C to cancel.")
-        time.sleep(5)
+    if executor:
+        executor.shutdown()
+    if controller:
+        controller.stop()
+    staging.stop()
+    leases.stop()
+    flush_tag_updates()
+    cost_model.save()
+    leases.report()
+    locality.report()
+    staging.report()
+    duplicates = get_duplicate_index()
+    if duplicates:
+        duplicates.summary()
+    if config.once:
+        print("✅ Finished single batch. Exiting due to --once flag.")
+    else:
+        print("✅ No scenes to process. Exiting.")
+    metrics.close()
+    reset_terminal()
 
 if __name__ == '__main__':
     main()
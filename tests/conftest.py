@@ -0,0 +1,56 @@
+# conftest.py
+
+import hashlib
+import os
+import shutil
+import sys
+
+import pytest
+
+# The helpers import config and each other from the repository root, like the main script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from benchmark.fake_stash import FakeStash
+
+# Several helpers bind config values or connect to Stash at import, so like the benchmark,
+# point them at the in-memory Stash and keep their files out of the working tree first
+server = FakeStash().start()
+config.stash_scheme = "http"
+config.stash_host = server.host
+config.stash_port = server.port
+config.stash_api_key = ""
+config.hashing_tag, config.hashing_error_tag, config.cover_error_tag = 1, 2, 3
+config.excluded_paths = []
+config.spool_path = ""
+config.result_cache_path = ""
+config.duplicate_index_path = ""
+config.cost_model_path = ""
+
+
+def media_item(name, **fields):
+    # One synthetic file as FakeStash.load() takes it
+    item = {"path": name, "size": 1 << 20, "duration": 60.0, "width": 640, "height": 360,
+            "video_codec": "h264", "audio_codec": "aac", "frame_rate": 25.0, "oshash": hashlib.md5(name.encode()).hexdigest()[:16]}
+    item.update(fields)
+    return item
+
+
+@pytest.fixture
+def fake_stash():
+    """
+    The in-memory Stash the helpers talk to, emptied again after the test.
+    """
+    yield server
+    server.load([], "")
+    server.reset_counters()
+
+
+def find_tool(path, name):
+    # The configured binary, else one on PATH; skips the test when neither exists
+    if os.path.exists(path):
+        return path
+    found = shutil.which(name)
+    if not found:
+        pytest.skip(f"{name} is not available")
+    return found
@@ -0,0 +1,91 @@
+# record_phash_golden.py
+
+"""
+Records what the videohashes binary outputs for each frame fixture in
+tests/fixtures/phash, so test_phash.py can check the native phash against it
+without the binary.
+
+Each fixture is a PNG of the 5x5 montage Stash hashes (25 tiles of 160x90). It is
+turned into a lossless clip that shows tile i around the i-th sample point, and
+that clip is hashed with videohashes. Run from the repository root after adding a
+fixture:
+
+    python tests/record_phash_golden.py [--ffmpeg PATH] [--binary PATH]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from helpers.phash import COLUMNS, ROWS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "phash")
+GOLDEN = os.path.join(FIXTURES, "golden.json")
+CLIP_SECONDS = 25
+CLIP_FPS = 25
+
+
+def load_tiles(name):
+    # The 25 frames of a fixture montage, in sample order
+    montage = np.asarray(Image.open(os.path.join(FIXTURES, name)).convert("RGB"))
+    height, width = montage.shape[0] // ROWS, montage.shape[1] // COLUMNS
+    return [montage[row * height:(row + 1) * height, column * width:(column + 1) * width]
+            for row in range(ROWS) for column in range(COLUMNS)]
+
+
+def build_clip(tiles, path, ffmpeg):
+    """
+    Writes a lossless clip in which every sample point of phash_timestamps() falls
+    on its tile, with the tile shown for the whole step around it.
+    """
+    offset, step = 0.05 * CLIP_SECONDS, 0.9 * CLIP_SECONDS / len(tiles)
+    height, width = tiles[0].shape[:2]
+    process = subprocess.Popen([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(CLIP_FPS), '-i', 'pipe:0',
+        '-c:v', 'ffv1', '-pix_fmt', 'bgr0', path
+    ], stdin=subprocess.PIPE)
+    for index in range(CLIP_SECONDS * CLIP_FPS):
+        tile = round((index / CLIP_FPS - offset) / step)
+        process.stdin.write(tiles[min(max(tile, 0), len(tiles) - 1)].tobytes())
+    process.stdin.close()
+    if process.wait():
+        raise RuntimeError(f"ffmpeg failed to build {path}")
+
+
+def videohashes_phash(binary, path):
+    result = subprocess.run([binary, '-json', path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+    return json.loads(result.stdout.decode("utf-8"))['phash']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record videohashes phashes for the test fixtures")
+    parser.add_argument("--ffmpeg", default=config.ffmpeg)
+    parser.add_argument("--binary", default=config.binary)
+    args = parser.parse_args()
+
+    golden = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in sorted(os.listdir(FIXTURES)):
+            if not name.endswith(".png"):
+                continue
+            clip = os.path.join(temp_dir, name + ".mkv")
+            build_clip(load_tiles(name), clip, args.ffmpeg)
+            golden[name] = videohashes_phash(args.binary, clip)
+            print(f"#️⃣ {name}: {golden[name]}")
+    with open(GOLDEN, 'w', encoding='utf-8') as f:
+        json.dump(golden, f, indent=2)
+        f.write('\n')
+
+
+if __name__ == "__main__":
+    main()
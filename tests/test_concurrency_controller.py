@@ -0,0 +1,81 @@
+# test_concurrency_controller.py
+
+import pytest
+
+import config
+from helpers.concurrency_controller import ConcurrencyController, LoadSample
+from helpers.resource_scheduler import scheduler
+
+
+def load(cpu=0.5, iowait=0.0, decode_wait=0.0, encode_wait=0.0, scenes=10, scene_seconds=60.0):
+    return LoadSample(cpu, iowait, decode_wait, encode_wait, scenes, scene_seconds, 3600)
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(config, "max_workers", 4)
+    monkeypatch.setattr(config, "decode_slots", 4)
+    monkeypatch.setattr(config, "auto_workers_max", 16)
+    monkeypatch.setattr(config, "auto_decode_slots_max", 8)
+    monkeypatch.setattr(config, "auto_tolerance", 0.20)
+    yield ConcurrencyController()
+    scheduler.configure(config.decode_slots, config.encoder_sessions, config.mount_read_slots)
+
+
+def test_steps_up_with_cpu_to_spare(controller):
+    controller.decide(load())
+    assert config.max_workers == 5
+    assert controller.last_change == ("max_workers", 4, 10.0, 60.0)
+
+
+def test_latency_in_line_with_the_step_is_kept(controller):
+    controller.decide(load())
+    # 5 scenes in flight instead of 4 at the same throughput: each takes 5/4 as long
+    controller.decide(load(cpu=0.8, scene_seconds=75.0))
+    assert config.max_workers == 5
+    assert not controller.hold
+
+
+def test_latency_beyond_the_step_is_reverted(controller):
+    controller.decide(load())
+    # Throughput held, but scenes slowed far past 5/4: the extra scene only contends
+    controller.decide(load(cpu=0.8, scene_seconds=100.0))
+    assert config.max_workers == 4
+    assert controller.hold == 3
+    assert controller.last_change is None
+
+
+def test_decode_step_must_not_slow_scenes(controller):
+    controller.decide(load(decode_wait=5.0))
+    assert config.decode_slots == 5
+    controller.decide(load(cpu=0.8, scene_seconds=80.0))
+    assert config.decode_slots == 4
+
+
+def test_throughput_drop_is_reverted(controller):
+    controller.decide(load())
+    controller.decide(load(cpu=0.8, scenes=7, scene_seconds=60.0))
+    assert config.max_workers == 4
+    assert controller.hold == 3
+
+
+def test_step_down_is_not_judged_on_latency(controller):
+    controller.decide(load(iowait=0.5))
+    assert config.max_workers == 3
+    controller.decide(load(cpu=0.8, scene_seconds=120.0))
+    assert config.max_workers == 3
+
+
+def test_no_finished_scenes_defers_judgement(controller):
+    controller.decide(load())
+    controller.decide(load(cpu=0.8, scenes=0, scene_seconds=None))
+    assert controller.last_change == ("max_workers", 4, 10.0, 60.0)
+
+
+def test_saturated_cpu_lowers_decoders_then_workers(controller, monkeypatch):
+    monkeypatch.setattr(config, "decode_slots", 2)
+    monkeypatch.setattr(config, "auto_decode_slots_min", 1)
+    controller.decide(load(cpu=0.95))
+    assert (config.decode_slots, config.max_workers) == (1, 4)
+    controller.decide(load(cpu=0.95))
+    assert (config.decode_slots, config.max_workers) == (1, 3)
@@ -0,0 +1,88 @@
+# test_duplicate_index.py
+
+import json
+import random
+
+import pytest
+
+import config
+from helpers.duplicate_index import DuplicateIndex, HammingIndex
+
+
+def flip(value, bits):
+    # value with the given bit positions inverted
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def random_hashes(count, seed=1):
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+@pytest.fixture
+def index():
+    hashes = random_hashes(5000)
+    hamming = HammingIndex()
+    hamming.build(list(range(len(hashes))), hashes)
+    return hamming, hashes
+
+
+@pytest.mark.parametrize("distance", range(0, 9))
+def test_search_at_and_beyond_the_distance(index, distance):
+    hamming, hashes = index
+    # Spread the flipped bits over every chunk, the hardest case for multi-index hashing
+    query = flip(hashes[42], [(i * 17) % 64 for i in range(distance)])
+    found = dict(hamming.search(query, config.duplicate_distance))
+    if distance <= config.duplicate_distance:
+        assert found.get(42) == distance
+    else:
+        assert 42 not in found
+
+
+def test_search_matches_a_scan(index):
+    hamming, hashes = index
+    rng = random.Random(2)
+    for _ in range(20):
+        query = flip(rng.choice(hashes), rng.sample(range(64), rng.randint(0, 10)))
+        for max_distance in (0, 3, 4, 7, 8):
+            expected = {i: bin(h ^ query).count("1") for i, h in enumerate(hashes) if bin(h ^ query).count("1") <= max_distance}
+            assert dict(hamming.search(query, max_distance)) == expected
+
+
+def test_pending_hashes_are_searched_and_merged(index, monkeypatch):
+    hamming, hashes = index
+    monkeypatch.setattr("helpers.duplicate_index.MERGE_PENDING", 3)
+    base = flip(hashes[7], range(0, 64, 2))  # far from everything indexed so far
+    hamming.add(9001, base)
+    assert dict(hamming.search(flip(base, [1, 5]), 4)) == {9001: 2}
+    hamming.add(9002, flip(base, [60]))
+    hamming.add(9003, flip(base, range(10)))  # third add merges the pending list into the tables
+    assert not hamming.pending
+    assert dict(hamming.search(base, 4)) == {9001: 0, 9002: 1}
+    assert len(hamming) == len(hashes) + 3
+
+
+def test_search_closest_first(index):
+    hamming, hashes = index
+    hamming.add(9001, flip(hashes[3], [0, 20, 40]))
+    assert [distance for _, distance in hamming.search(hashes[3], 4)] == [0, 3]
+
+
+def test_near_duplicates_are_reported_up_to_the_distance(tmp_path, monkeypatch):
+    report = tmp_path / "duplicates.jsonl"
+    monkeypatch.setattr(config, "duplicate_report_path", str(report))
+    monkeypatch.setattr(config, "duplicate_distance", 4)
+    duplicates = DuplicateIndex(str(tmp_path / "index.sqlite3"))
+    original = 0x0123456789ABCDEF
+    duplicates.record("a" * 16, 100, format(original, "x"), 60.0, 1, "/media/original.mp4")
+    duplicates.record("b" * 16, 100, format(flip(original, [0, 16, 32, 48]), "x"), 60.0, 2, "/media/reencode.mp4")
+    duplicates.record("c" * 16, 100, format(flip(original, [1, 17, 33, 49, 63]), "x"), 60.0, 3, "/media/other.mp4")
+
+    entries = [json.loads(line) for line in report.read_text().splitlines()]
+    assert [(entry["scene_id"], [m["scene_id"] for m in entry["matches"]]) for entry in entries] == [("2", ["1"])]
+    assert entries[0]["matches"][0]["distance"] == 4
+    assert duplicates.counts == {"exact": 0, "near": 1}
+    assert duplicates.lookup("a" * 16, 100)["path"] == "/media/original.mp4"
+    assert duplicates.lookup("a" * 16, 101) is None
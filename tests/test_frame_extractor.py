@@ -0,0 +1,73 @@
+# test_frame_extractor.py
+
+import io
+import queue
+import subprocess
+
+import pytest
+
+import config
+from conftest import find_tool
+from helpers.frame_extractor import FrameExtractor, select_expression
+
+FPS = 25
+FRAMES = 100
+GOP = 10
+SIZE = (32, 18)
+
+SHOWINFO = b"""\
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] n:   0 pts:      0 pts_time:0 (before the config line, ignored)
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] config in time_base: 1/90000, frame_rate: 25/1
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] config out time_base: 0/0, frame_rate: 0/0
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] n:   0 pts:   3600 pts_time:0.04    duration:   3600 duration_time:0.04    fmt:rgb24 s:32x18 i:P iskey:1 type:I
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] color_range:unknown color_space:unknown color_primaries:unknown color_trc:unknown
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] n:   1 pts: 184500 pts_time:2.05    duration:   3600 duration_time:0.04    fmt:rgb24 s:32x18 i:P iskey:0 type:P
+[Parsed_showinfo_2 @ 0x7ff79c00f0c0] n:   2 pts:  -1800 pts_time:-0.02   duration:   3600 duration_time:0.04    fmt:rgb24 s:32x18 i:P iskey:0 type:B
+"""
+
+
+def test_select_expression_sorts_and_picks_first_frame():
+    assert select_expression([2.5, 0.0]) == (
+        "gte(t,0.000000)*not(gte(prev_t,0.000000))+gte(t,2.500000)*not(gte(prev_t,2.500000))")
+
+
+def test_read_timestamps_maps_pts_through_the_time_base():
+    times = queue.Queue()
+    FrameExtractor("clip.mkv").read_timestamps(io.BytesIO(SHOWINFO), times)
+    assert [times.get() for _ in range(4)] == [pytest.approx(0.04), pytest.approx(2.05), pytest.approx(-0.02), None]
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    """
+    A clip whose frame n is a solid colour (2n, 255 - 2n, 0), with a keyframe every
+    GOP frames and a non-zero start time, and the ffmpeg that made it.
+    """
+    ffmpeg = find_tool(config.ffmpeg, "ffmpeg")
+    path = str(tmp_path_factory.mktemp("frames") / "indexed.mp4")
+    frames = b''.join(bytes((2 * n, 255 - 2 * n, 0)) * (SIZE[0] * SIZE[1]) for n in range(FRAMES))
+    subprocess.run([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{SIZE[0]}x{SIZE[1]}', '-r', str(FPS), '-i', 'pipe:0',
+        '-c:v', 'libx264rgb', '-qp', '0', '-g', str(GOP), '-keyint_min', str(GOP), '-sc_threshold', '0', '-bf', '0',
+        '-output_ts_offset', '1.5', path
+    ], input=frames, check=True)
+    return path, ffmpeg
+
+
+def frame_indices(clip, mode, timestamps):
+    path, ffmpeg = clip
+    extractor = FrameExtractor(path, ffmpeg, *SIZE, mode=mode)
+    return [frame[0] // 2 for frame in extractor.extract(timestamps)]
+
+
+def test_exact_mode_takes_the_first_frame_at_or_after(clip):
+    # Unsorted, repeated, on and between frame times, and past the end (the last frame)
+    timestamps = [2.0, 0.0, 0.01, 0.5, 3.96, 0.01, 10.0]
+    assert frame_indices(clip, "exact", timestamps) == [50, 0, 1, 13, 99, 1, 99]
+
+
+def test_keyframe_mode_takes_the_nearest_keyframe(clip):
+    # Keyframes every 0.4s; past the last one at 3.6s, the last keyframe
+    timestamps = [0.5, 0.75, 2.0, 0.1, 3.9]
+    assert frame_indices(clip, "keyframe", timestamps) == [10, 20, 50, 0, 90]
@@ -0,0 +1,109 @@
+# test_lease_manager.py
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+from conftest import media_item
+from helpers import stash_utils
+from helpers.lease_manager import LeaseManager
+from helpers.stash_utils import flush_tag_updates, is_transport_error, release_scene, replay_updates, tag_batcher
+from helpers.update_spool import UpdateSpool
+
+HASHING = str(config.hashing_tag)
+
+
+@pytest.fixture
+def leases(fake_stash, monkeypatch):
+    # No flush timer: tag changes only go out when a test flushes them
+    monkeypatch.setattr(tag_batcher, "flush_interval", 0)
+    fake_stash.load([media_item(f"scene{n}.mp4") for n in range(1, 5)], "/media/")
+    manager = LeaseManager(ttl=600)
+    yield manager
+    manager.stop()
+    tag_batcher.flush()
+
+
+@pytest.fixture
+def spooled(tmp_path, monkeypatch):
+    spool = UpdateSpool(str(tmp_path / "spool.jsonl"), replay_updates, flush_interval=0.05, max_backoff=0.05,
+                        transient=is_transport_error)
+    monkeypatch.setattr(stash_utils, "spool", spool)
+    return spool
+
+
+def tagged(fake_stash):
+    return {scene_id for scene_id, scene in fake_stash.scenes.items() if HASHING in scene["tags"]}
+
+
+def claim(leases, fake_stash, *scene_ids):
+    claimed = leases.claim([{"id": scene_id} for scene_id in scene_ids])
+    assert [scene["id"] for scene in claimed] == list(scene_ids)
+    assert tagged(fake_stash) == set(scene_ids)
+
+
+def test_renewal_skips_released_scenes(leases, fake_stash):
+    claim(leases, fake_stash, "1", "2")
+    release_scene("1")
+    flush_tag_updates()
+    # A heartbeat between the release and dropping the lease must not tag it again
+    leases.renew()
+    flush_tag_updates()
+    assert tagged(fake_stash) == {"2"}
+
+
+def test_release_after_a_queued_renewal_wins(leases, fake_stash, monkeypatch):
+    claim(leases, fake_stash, "1", "2")
+    # Hold the renewal in the batcher, as if the release raced the heartbeat's flush
+    with monkeypatch.context() as held:
+        held.setattr(tag_batcher, "flush", lambda: None)
+        leases.renew()
+        release_scene("1")
+    tag_batcher.flush()
+    assert tagged(fake_stash) == {"2"}
+
+
+def test_spooled_renewal_is_ordered_and_not_journaled(leases, fake_stash, spooled):
+    claim(leases, fake_stash, "1", "2", "3")
+    with spooled.condition:
+        # Renewal and release reach the flusher as one batch
+        leases.renew()
+        release_scene("1")
+    assert spooled.drain(5) == 0
+    assert tagged(fake_stash) == {"2", "3"}
+
+    release_scene("2")
+    assert spooled.drain(5) == 0
+    leases.renew()
+    assert spooled.drain(5) == 0
+    assert tagged(fake_stash) == {"3"}
+
+    with spooled.condition:
+        leases.renew()
+        with open(spooled.path, encoding='utf-8') as journal:
+            journaled = [json.loads(line) for line in journal]
+    assert not [entry for entry in journaled if entry.get("op") == "tag" and entry["args"]["mode"] == "ADD"]
+    assert spooled.drain(5) == 0
+
+
+def test_dropped_scene_can_be_claimed_again(leases, fake_stash):
+    claim(leases, fake_stash, "1")
+    release_scene("1")
+    leases.drop("1")
+    flush_tag_updates()
+    assert tagged(fake_stash) == set()
+    claim(leases, fake_stash, "1")
+    leases.renew()
+    assert tagged(fake_stash) == {"1"}
+
+
+def test_sweep_reclaims_expired_leases_of_other_nodes(leases, fake_stash):
+    claim(leases, fake_stash, "1")
+    stale = (datetime.now() - timedelta(hours=1)).astimezone().isoformat(timespec='seconds')
+    for scene_id in ("1", "3"):
+        fake_stash.scenes[scene_id]["tags"].add(HASHING)
+        fake_stash.scenes[scene_id]["updated_at"] = stale
+    assert leases.sweep_expired(force=True) == 1
+    assert tagged(fake_stash) == {"1"}  # our own lease stays
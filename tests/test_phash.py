@@ -0,0 +1,172 @@
+# test_phash.py
+
+import json
+import math
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+import config
+from conftest import find_tool
+from helpers.media_info import MediaInfo, get_media_info
+from helpers import phash
+from helpers.phash import PhashGenerator, _dct, _resize_weights, build_montage, compute_phash, phash_timestamps
+from helpers.single_pass import SinglePassPipeline
+from record_phash_golden import FIXTURES, GOLDEN, build_clip, load_tiles
+
+
+def fixture_names():
+    return sorted(name for name in os.listdir(FIXTURES) if name.endswith(".png"))
+
+
+def load_golden():
+    with open(GOLDEN, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_resize_weights_identity():
+    assert (_resize_weights(4, 4) == np.eye(4, dtype=np.int64) * 256).all()
+
+
+def test_resize_weights_downscale():
+    # Four taps per output pixel, the out-of-range tap clamped onto the edge pixel
+    assert _resize_weights(4, 2).tolist() == [[256, 192, 64, 0], [0, 64, 192, 256]]
+
+
+def test_resize_weights_upscale():
+    # Go's int() truncates toward zero, so the first row loses its negative tap like nfnt/resize
+    assert _resize_weights(2, 4).tolist() == [[192, 0], [192, 64], [64, 192], [0, 256]]
+
+
+def test_dct_matches_dct_ii():
+    values = np.array([3.0, -1.5, 7.25, 0.0, 12.0, 5.5, -4.0, 9.0])
+    n = len(values)
+    expected = [sum(values[i] * math.cos(math.pi / n * (i + 0.5) * k) for i in range(n)) for k in range(n)]
+    assert np.allclose(_dct(values), expected)
+
+
+def test_dct_last_axis():
+    rows = np.arange(64, dtype=np.float64).reshape(8, 8) ** 1.5
+    assert np.allclose(_dct(rows), [_dct(row) for row in rows])
+
+
+@pytest.mark.parametrize("name", fixture_names())
+def test_compute_phash_matches_videohashes(name):
+    # Hashes recorded from the binary by record_phash_golden.py, so no binary is needed here
+    golden = load_golden()
+    if name not in golden:
+        pytest.skip(f"no videohashes phash recorded for {name}; run tests/record_phash_golden.py with the binary")
+    assert compute_phash(load_tiles(name)) == golden[name]
+
+
+def test_compute_phash_is_stable():
+    # Values from this implementation, not videohashes: they only catch accidental changes
+    assert compute_phash(load_tiles("gradient.png")) == "830303070d3f3f7d"
+    assert compute_phash(load_tiles("steps.png")) == "af10c7788788d2a7"
+
+
+def test_compute_phash_raw_frames():
+    frames = load_tiles("testsrc2.png")
+    assert compute_phash([frame.tobytes() for frame in frames], (160, 90)) == compute_phash(frames)
+
+
+def test_compute_phash_frame_count():
+    with pytest.raises(ValueError):
+        compute_phash(load_tiles("gradient.png")[:24])
+
+
+def test_build_montage_fills_rows(monkeypatch):
+    monkeypatch.setattr(phash, "COLUMNS", 3)
+    monkeypatch.setattr(phash, "ROWS", 2)
+    montage = build_montage([np.full((2, 4, 3), index, dtype=np.uint8) for index in range(6)])
+    assert montage.shape == (4, 12, 3)
+    assert montage[::2, ::4, 0].tolist() == [[0, 1, 2], [3, 4, 5]]
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    """
+    A small synthetic clip with motion, a non-zero start time and an AAC track
+    that starts before the video, with the ffmpeg and ffprobe paths to read it.
+    """
+    ffmpeg = find_tool(config.ffmpeg, "ffmpeg")
+    ffprobe = find_tool(config.ffprobe, "ffprobe")
+    path = str(tmp_path_factory.mktemp("phash") / "clip.mp4")
+    subprocess.run([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate=25',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', '12', '-c:v', 'mpeg4', '-q:v', '3', '-c:a', 'aac', '-output_ts_offset', '1.5', path
+    ], check=True)
+    return path, ffmpeg, ffprobe
+
+
+def single_pass_frames(path, ffmpeg, ffprobe):
+    pipeline = SinglePassPipeline(path, "golden", ffmpeg, ffprobe, phash=True, media_info=get_media_info(path, ffprobe))
+    try:
+        return pipeline.run()['phash_frames']
+    finally:
+        pipeline.clean_up()
+
+
+def videohashes_phash(path):
+    binary = find_tool(config.binary, "videohashes")
+    result = subprocess.run([binary, '-json', path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+    return json.loads(result.stdout.decode("utf-8"))['phash']
+
+
+@pytest.mark.parametrize("name", fixture_names())
+def test_fixture_clip_grabs_match_tiles(name, tmp_path):
+    # The clip record_phash_golden.py hashes must hand Stash's screenshots exactly the fixture's tiles
+    ffmpeg = find_tool(config.ffmpeg, "ffmpeg")
+    ffprobe = find_tool(config.ffprobe, "ffprobe")
+    tiles = load_tiles(name)
+    path = str(tmp_path / "fixture.mkv")
+    build_clip(tiles, path, ffmpeg)
+    generator = PhashGenerator(path, ffmpeg, ffprobe)
+    for tile, t in zip(tiles, phash_timestamps(generator.get_video_duration())):
+        assert (tile == generator.extract_frame(t)).all(), f"frame at {t:.3f}s differs"
+
+
+def test_single_pass_frames_match_seeks(clip, tmp_path, monkeypatch):
+    # Each single-pass sample must be the frame Stash's `-ss t -i file` screenshot gets
+    path, ffmpeg, ffprobe = clip
+    monkeypatch.chdir(tmp_path)  # the pipeline's temp dir
+    frames = single_pass_frames(path, ffmpeg, ffprobe)
+    generator = PhashGenerator(path, ffmpeg, ffprobe)
+    for frame, t in zip(frames, phash_timestamps(generator.get_video_duration())):
+        assert (frame == generator.extract_frame(t)).all(), f"frame at {t:.3f}s differs"
+
+
+def test_phash_generator_matches_videohashes(clip):
+    path, ffmpeg, ffprobe = clip
+    assert PhashGenerator(path, ffmpeg, ffprobe).generate() == videohashes_phash(path)
+
+
+def test_single_pass_phash_matches_videohashes(clip, tmp_path, monkeypatch):
+    path, ffmpeg, ffprobe = clip
+    monkeypatch.chdir(tmp_path)
+    assert compute_phash(single_pass_frames(path, ffmpeg, ffprobe)) == videohashes_phash(path)
+
+
+def test_single_pass_frames_of_a_rotated_file(tmp_path, monkeypatch):
+    # Stash's sizes can be the stored ones; the frames must still match the autorotated seeks
+    ffmpeg = find_tool(config.ffmpeg, "ffmpeg")
+    stored, path = str(tmp_path / "stored.mp4"), str(tmp_path / "rotated.mp4")
+    subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate=25',
+                    '-t', '10', '-c:v', 'mpeg4', '-q:v', '3', stored], check=True)
+    subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-display_rotation', '90', '-i', stored,
+                    '-c', 'copy', path], check=True)
+    media = MediaInfo(path, 10.0, 320, 180, 'mpeg4', source='stash')
+    monkeypatch.chdir(tmp_path)
+    pipeline = SinglePassPipeline(path, "rotated", ffmpeg, phash=True, media_info=media)
+    try:
+        frames = pipeline.run()['phash_frames']
+    finally:
+        pipeline.clean_up()
+    generator = PhashGenerator(path, ffmpeg, media_info=media)
+    assert frames[0].shape == (284, 160, 3)
+    for frame, t in zip(frames, phash_timestamps(media.duration)):
+        assert (frame == generator.extract_frame(t)).all(), f"frame at {t:.3f}s differs"
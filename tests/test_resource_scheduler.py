@@ -0,0 +1,103 @@
+# test_resource_scheduler.py
+
+import asyncio
+import threading
+import time
+
+from helpers.resource_scheduler import ResizableSemaphore
+
+
+def acquire_in_thread(semaphore, count=1):
+    # Starts a thread blocked in acquire(); the event is set once it holds the slots
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (semaphore.acquire(count), acquired.set()), daemon=True)
+    thread.start()
+    return acquired
+
+
+def test_capacity_bounds_holders():
+    semaphore = ResizableSemaphore(2)
+    semaphore.acquire()
+    semaphore.acquire()
+    waiter = acquire_in_thread(semaphore)
+    assert not waiter.wait(0.05)
+    semaphore.release()
+    assert waiter.wait(1)
+    assert semaphore.in_use == 2
+    assert semaphore.acquires == 3
+    assert semaphore.waited > 0
+
+
+def test_oversized_request_is_capped():
+    semaphore = ResizableSemaphore(2)
+    assert semaphore.acquire(5) == 2
+    semaphore.release(2)
+    assert semaphore.in_use == 0
+
+
+def test_capacity_is_at_least_one():
+    semaphore = ResizableSemaphore(0)
+    assert semaphore.capacity == 1
+    semaphore.resize(-3)
+    assert semaphore.capacity == 1
+
+
+def test_shrinking_keeps_holders_and_blocks_new_acquires():
+    semaphore = ResizableSemaphore(3)
+    for _ in range(3):
+        semaphore.acquire()
+    semaphore.resize(1)
+    assert semaphore.in_use == 3  # nobody is interrupted
+    waiter = acquire_in_thread(semaphore)
+    semaphore.release()
+    semaphore.release()
+    assert not waiter.wait(0.05)  # one still held fills the new capacity
+    semaphore.release()
+    assert waiter.wait(1)
+
+
+def test_growing_wakes_waiters():
+    semaphore = ResizableSemaphore(1)
+    semaphore.acquire()
+    waiters = [acquire_in_thread(semaphore) for _ in range(2)]
+    assert not any(waiter.wait(0.05) for waiter in waiters)
+    semaphore.resize(3)
+    assert all(waiter.wait(1) for waiter in waiters)
+
+
+def test_async_waiter_is_woken_by_a_thread_release():
+    semaphore = ResizableSemaphore(1)
+    semaphore.acquire()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            # Keeps running while acquire_async waits, so the loop isn't blocked
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        threading.Timer(0.05, semaphore.release).start()
+        started = time.monotonic()
+        count = await asyncio.wait_for(semaphore.acquire_async(), 2)
+        ticker.cancel()
+        return count, ticks, time.monotonic() - started
+
+    count, ticks, waited = asyncio.run(main())
+    assert count == 1 and semaphore.in_use == 1
+    assert ticks > 3 and waited >= 0.04
+
+
+def test_async_waiter_is_woken_by_a_resize():
+    semaphore = ResizableSemaphore(1)
+    semaphore.acquire()
+
+    async def main():
+        threading.Timer(0.02, semaphore.resize, args=(2,)).start()
+        return await asyncio.wait_for(semaphore.acquire_async(), 2)
+
+    assert asyncio.run(main()) == 1
+    assert semaphore.in_use == 2
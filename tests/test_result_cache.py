@@ -0,0 +1,85 @@
+# test_result_cache.py
+
+import os
+import time
+
+import pytest
+
+from helpers.result_cache import ResultCache
+
+OSHASH = "0123456789abcdef"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache.sqlite3"))
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / "scene.mp4"
+    path.write_bytes(b"\0" * 1024)
+    os.utime(path, (1_700_000_000, 1_700_000_000))
+    return str(path)
+
+
+def test_entry_is_keyed_by_oshash_size_and_mtime(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe", duration=61.5, streams={"width": 640})
+    assert cache.get(OSHASH, media) == {"phash": "cafebabe", "duration": 61.5, "streams": {"width": 640}, "artifacts": []}
+    assert cache.get("fedcba9876543210", media) is None
+
+
+def test_touched_file_misses(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe")
+    os.utime(media, (1_700_000_100, 1_700_000_100))
+    assert cache.get(OSHASH, media) is None
+
+
+def test_resized_file_misses(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe")
+    with open(media, "ab") as f:
+        f.write(b"\0")
+    os.utime(media, (1_700_000_000, 1_700_000_000))
+    assert cache.get(OSHASH, media) is None
+
+
+def test_sub_second_mtime_changes_are_ignored(cache, media):
+    # The key stores whole seconds, so filesystems with coarser timestamps still hit
+    cache.put(OSHASH, media, phash="cafebabe")
+    os.utime(media, (1_700_000_000.4, 1_700_000_000.4))
+    assert cache.get(OSHASH, media)["phash"] == "cafebabe"
+
+
+def test_missing_file_misses(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe")
+    os.remove(media)
+    assert cache.get(OSHASH, media) is None
+
+
+def test_put_merges_into_the_entry(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe", duration=61.5)
+    cache.add_artifact(OSHASH, media, "sprite")
+    cache.put(OSHASH, media, artifacts=["preview"])
+    assert cache.get(OSHASH, media) == {"phash": "cafebabe", "duration": 61.5, "streams": None,
+                                        "artifacts": ["preview", "sprite"]}
+
+
+def test_changed_file_replaces_the_entry(cache, media):
+    cache.put(OSHASH, media, phash="cafebabe", artifacts=["sprite"])
+    os.utime(media, (1_700_000_100, 1_700_000_100))
+    cache.put(OSHASH, media, phash="deadbeef")
+    assert cache.get(OSHASH, media) == {"phash": "deadbeef", "duration": None, "streams": None, "artifacts": []}
+    assert cache.stats()["entries"] == 1
+
+
+def test_prune_drops_old_then_least_recently_used(cache, media):
+    for n in range(4):
+        cache.put(f"{n:016x}", media, phash=str(n))
+        time.sleep(0.01)
+    with cache.lock:
+        cache.db.execute("UPDATE results SET accessed_at = ? WHERE oshash = ?", (time.time() - 100 * 86400, f"{0:016x}"))
+        cache.db.commit()
+    cache.get(f"{1:016x}", media)  # most recently used
+    assert cache.prune(max_entries=2, max_age_days=90) == 2
+    assert cache.get(f"{1:016x}", media) and cache.get(f"{3:016x}", media)
+    assert cache.get(f"{0:016x}", media) is None and cache.get(f"{2:016x}", media) is None
@@ -0,0 +1,129 @@
+# test_scene_feed.py
+
+import threading
+import time
+
+import pytest
+
+from helpers.scene_feed import SceneFeed
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Batches:
+    """
+    fetch_batch() stand-in: hands out the given batches (lists of scene ids, [] or
+    an exception) in order, then None, and counts the calls.
+    """
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if not self.batches:
+            return None
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return [{"id": scene_id} for scene_id in batch]
+
+
+def drain(feed):
+    ids = []
+    while (item := feed.get()) is not None:
+        ids.append(item[0]["id"])
+    return ids
+
+
+@pytest.fixture
+def feeds():
+    started = []
+
+    def make(fetch, **kwargs):
+        feed = SceneFeed(fetch, retry_delay=0.01, **kwargs)
+        feed.start()
+        started.append(feed)
+        return feed
+
+    yield make
+    for feed in started:
+        feed.stop()
+
+
+def test_prefetches_at_the_low_water_mark(feeds):
+    fetch = Batches([1, 2, 3, 4], [5, 6, 7, 8])
+    feed = feeds(fetch, low_water=2)
+    wait_until(lambda: len(feed.queue) == 4)
+    time.sleep(0.05)
+    assert fetch.calls == 1  # above low water, nothing more is fetched
+
+    assert feed.get()[0]["id"] == 1
+    time.sleep(0.05)
+    assert fetch.calls == 1
+    assert feed.get()[0]["id"] == 2  # two left: the next batch is fetched while they run
+    wait_until(lambda: len(feed.queue) == 6)
+    assert fetch.calls == 2
+
+
+def test_items_carry_their_batch_position(feeds):
+    feed = feeds(Batches([1, 2], [3]), low_water=0)
+    assert [feed.get()[1:] for _ in range(3)] == [(1, 2), (2, 2), (1, 1)]
+
+
+def test_refetches_after_empty_batches_and_errors(feeds):
+    fetch = Batches([], RuntimeError("502 Bad Gateway query failed."), [1])
+    feed = feeds(fetch, low_water=1)
+    assert drain(feed) == [1]
+    assert feed.done
+    assert fetch.calls == 4
+
+
+def test_once_stops_after_the_first_batch(feeds):
+    fetch = Batches([], [1, 2], [3])
+    feed = feeds(fetch, low_water=5, once=True)
+    assert drain(feed) == [1, 2]
+    assert fetch.calls == 2
+
+
+def test_order_covers_leftovers_and_choose_picks(feeds):
+    fetch = Batches([3, 1], [4, 2])
+    release = threading.Event()
+
+    def gated():
+        if fetch.calls == 1:
+            release.wait(2)
+        return fetch()
+
+    by_id = lambda items: sorted(items, key=lambda item: item[0]["id"])
+    feed = feeds(gated, low_water=1, order=by_id, choose=lambda queue: len(queue) - 1)
+    wait_until(lambda: len(feed.queue) == 2)
+    assert feed.peek(2) == [{"id": 1}, {"id": 3}]
+    assert feed.get()[0]["id"] == 3  # choose takes the tail
+    release.set()
+    wait_until(lambda: len(feed.queue) == 3)
+    # The leftover is ordered in with the new batch
+    assert feed.peek(3) == [{"id": 1}, {"id": 2}, {"id": 4}]
+
+
+def test_get_without_blocking(feeds):
+    release = threading.Event()
+    feed = feeds(lambda: release.wait(2) and None, low_water=1)
+    assert feed.get(block=False) is None
+    release.set()
+    assert feed.get() is None
+    assert feed.done
+
+
+def test_stop_returns_the_queued_scenes(feeds):
+    feed = feeds(Batches([1, 2, 3]), low_water=0)
+    wait_until(lambda: len(feed.queue) == 3)
+    feed.get()
+    assert feed.stop() == [{"id": 2}, {"id": 3}]
+    assert feed.get() is None and feed.done
@@ -0,0 +1,111 @@
+# test_scene_scheduler.py
+
+import pytest
+
+from helpers import scene_scheduler
+from helpers.scene_scheduler import DEFAULT_BYTE_RATE, DEFAULT_RATE, CostModel, SceneOrder
+
+
+def scene(scene_id, duration=60.0, width=1920, height=1080, codec="h264", size=10**8):
+    return {"id": scene_id, "files": [{"duration": duration, "width": width, "height": height,
+                                       "video_codec": codec, "size": size}]}
+
+
+def ids(items):
+    return [item[0]["id"] for item in items]
+
+
+def queue(*scenes):
+    return [(s, index, len(scenes)) for index, s in enumerate(scenes, start=1)]
+
+
+class Clock:
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        monkeypatch.setattr(scene_scheduler.time, "monotonic", lambda: self.now)
+
+
+def test_estimate_before_any_observation():
+    model = CostModel()
+    assert model.estimate(scene(1, duration=100, width=1000, height=1000)) == pytest.approx(100 * DEFAULT_RATE)
+    # Tiny frames still count as 0.1 megapixels
+    assert model.estimate(scene(2, duration=100, width=160, height=90)) == pytest.approx(10 * DEFAULT_RATE)
+    assert model.estimate(scene(3, duration=None, size=10**9)) == pytest.approx(10**9 * DEFAULT_BYTE_RATE)
+    assert model.estimate(scene(4, duration=None, size=None)) is None
+
+
+def test_rates_are_learned_per_codec():
+    model = CostModel(smoothing=0.5)
+    model.observe(scene(1, duration=100, width=1000, height=1000, codec="hevc"), 30.0)
+    assert model.rates == {"hevc": pytest.approx(0.3), "*": pytest.approx(0.3)}
+    model.observe(scene(2, duration=100, width=1000, height=1000, codec="hevc"), 10.0)
+    assert model.rates["hevc"] == pytest.approx(0.2)  # halfway to the new rate
+    # Codecs not seen yet use the rate over every codec
+    assert model.estimate(scene(3, duration=10, width=1000, height=1000, codec="av1")) == pytest.approx(2.0)
+    assert model.byte_rate == pytest.approx((30.0 + 0.5 * (10.0 - 30.0)) / 10**8)
+
+
+def test_model_is_saved_every_ten_observations(tmp_path):
+    path = str(tmp_path / "cost_model.json")
+    model = CostModel(path)
+    for n in range(9):
+        model.observe(scene(n), 12.0)
+    assert not (tmp_path / "cost_model.json").exists()
+    model.observe(scene(9), 12.0)
+    restored = CostModel(path)
+    assert restored.rates == pytest.approx(model.rates)
+    assert restored.observations == 10
+
+
+def test_unreadable_model_is_ignored(tmp_path):
+    path = tmp_path / "cost_model.json"
+    path.write_text("{not json")
+    assert CostModel(str(path)).rates == {}
+
+
+@pytest.fixture
+def scenes():
+    # Estimated costs 3, 1, 2 and one without an estimate
+    return [scene("a", duration=30), scene("b", duration=10), scene("c", duration=20),
+            scene("x", duration=None, size=None)]
+
+
+def test_fifo_keeps_discovery_order(scenes):
+    assert ids(SceneOrder(CostModel(), "fifo")(queue(*scenes))) == ["a", "b", "c", "x"]
+
+
+def test_sjf_runs_shortest_first(scenes):
+    # No estimate counts as the median (c), and ties keep their queue order
+    assert ids(SceneOrder(CostModel(), "sjf")(queue(*scenes))) == ["b", "c", "x", "a"]
+
+
+def test_lpt_runs_longest_first(scenes):
+    assert ids(SceneOrder(CostModel(), "lpt")(queue(*scenes))) == ["a", "c", "x", "b"]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SceneOrder(CostModel(), "random")
+
+
+def test_fair_ages_waiting_scenes(monkeypatch):
+    clock = Clock(monkeypatch)
+    order = SceneOrder(CostModel(), "fair", aging=0.1)
+    long_scene = scene("long", duration=100)  # estimate 100s x 2.07 MP x 0.05 ~ 10.4s, short ones ~ 1.04s
+    items = order(queue(long_scene, scene("s1", duration=10)))
+    assert ids(items) == ["s1", "long"]
+
+    # A later batch of short scenes: the long one has waited 100s, 10s off its cost
+    clock.now += 100
+    items = order(items[1:] + queue(scene("s2", duration=10), scene("s3", duration=10)))
+    assert ids(items) == ["long", "s2", "s3"]
+    # The estimate and queue time are kept on the scene across reorders
+    assert long_scene["_queued_at"] == 1000.0
+
+
+def test_sjf_does_not_age(monkeypatch):
+    clock = Clock(monkeypatch)
+    order = SceneOrder(CostModel(), "sjf")
+    items = order(queue(scene("long", duration=100), scene("s1", duration=10)))
+    clock.now += 3600
+    assert ids(order(items[1:] + queue(scene("s2", duration=10)))) == ["s2", "long"]
@@ -0,0 +1,73 @@
+# test_scene_watcher.py
+
+import pytest
+
+from conftest import media_item
+from helpers.scene_watcher import SceneWatcher
+
+
+def at(second):
+    return f"2026-01-01T12:00:{second:02d}+00:00"
+
+
+@pytest.fixture
+def library(fake_stash):
+    fake_stash.load([media_item(f"scene{n}.mp4") for n in range(1, 6)], "/media/")
+
+    def touch(scene_id, second):
+        with fake_stash.lock:
+            fake_stash.scenes[scene_id]["updated_at"] = at(second)
+
+    for scene_id in fake_stash.scenes:
+        touch(scene_id, 0)
+    return touch
+
+
+@pytest.fixture
+def watcher(library):
+    # Past the first poll, which hands out the cursor's own second
+    watcher = SceneWatcher(leases=None)
+    watcher.start()
+    watcher.fetch_new()
+    return watcher
+
+
+def new_ids(watcher):
+    return [scene["id"] for scene in watcher.fetch_new()]
+
+
+def test_cursor_starts_at_the_newest_update(library):
+    watcher = SceneWatcher(leases=None)
+    watcher.start()
+    assert watcher.cursor == at(0)
+    # The first poll overlaps the cursor's second
+    assert new_ids(watcher) == ["1", "2", "3", "4", "5"]
+    assert new_ids(watcher) == []
+
+
+def test_scene_in_the_cursor_second_is_not_missed(watcher, library):
+    library("1", 10)
+    assert new_ids(watcher) == ["1"]
+    assert watcher.cursor == at(10)
+    assert new_ids(watcher) == []  # same second, already handed out
+    library("2", 10)  # changed later within the cursor's second
+    assert new_ids(watcher) == ["2"]
+    assert watcher.seen == {"1": at(10), "2": at(10)}
+
+
+def test_cursor_moves_to_the_newest_scene(watcher, library):
+    library("3", 20)
+    library("4", 15)
+    assert new_ids(watcher) == ["4", "3"]  # oldest first
+    assert watcher.cursor == at(20)
+    assert watcher.seen == {"3": at(20)}
+    library("4", 25)
+    assert new_ids(watcher) == ["4"]
+    assert watcher.seen == {"4": at(25)}
+
+
+def test_hashed_scenes_are_not_returned(watcher, library, fake_stash):
+    library("5", 30)
+    fake_stash.scenes["5"]["file"]["fingerprints"].append({"type": "phash", "value": "cafebabe"})
+    library("1", 31)
+    assert new_ids(watcher) == ["1"]
@@ -0,0 +1,115 @@
+# test_staging_cache.py
+
+import os
+
+import pytest
+
+import config
+from helpers import staging_cache
+from helpers.staging_cache import StagingCache
+
+SIZE = 1000
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """
+    Four 1000-byte source files on a "network" volume and a scratch directory
+    with room for three of them.
+    """
+    source_dir = tmp_path / "nas"
+    source_dir.mkdir()
+    monkeypatch.setattr(config, "staging_path", str(tmp_path / "scratch"))
+    monkeypatch.setattr(config, "staging_max_gb", 3 * SIZE / 1e9)
+    monkeypatch.setattr(config, "staging_min_free_gb", 0)
+    monkeypatch.setattr(config, "dry_run", False)
+    # Everything under tmp_path shares one filesystem; pretend the sources don't
+    monkeypatch.setattr(staging_cache, "filesystem_mount",
+                        lambda path: "nas" if str(path).startswith(str(source_dir)) else "scratch")
+    paths = {}
+    for name in "abcd":
+        path = source_dir / f"{name}.mp4"
+        path.write_bytes(name.encode() * SIZE)
+        os.utime(path, (1_700_000_000, 1_700_000_000))
+        paths[name] = str(path)
+    return paths
+
+
+@pytest.fixture
+def cache(sources):
+    cache = StagingCache()
+    os.makedirs(cache.directory)
+    return cache
+
+
+def read(cache, sources, name):
+    # Acquire, read and release one scene's file like a worker does
+    scene = {}
+    path = cache.acquire(scene, sources[name])
+    with open(path, "rb") as f:
+        data = f.read()
+    cache.release(scene)
+    return path, data
+
+
+def staged(cache):
+    return [os.path.basename(source) for source in cache.files]
+
+
+def test_copy_on_demand_keeps_content_and_mtime(cache, sources):
+    path, data = read(cache, sources, "a")
+    assert os.path.dirname(path) == cache.directory
+    assert data == b"a" * SIZE
+    assert int(os.stat(path).st_mtime) == 1_700_000_000  # the result cache key still matches
+    read(cache, sources, "a")
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+    assert cache.used_bytes == SIZE
+
+
+def test_least_recently_used_copy_is_evicted(cache, sources):
+    for name in "abc":
+        read(cache, sources, name)
+    read(cache, sources, "a")  # a is now the most recently used
+    read(cache, sources, "d")
+    assert staged(cache) == ["c.mp4", "a.mp4", "d.mp4"]
+    assert cache.stats["evicted"] == 1
+    assert len(os.listdir(cache.directory)) == 3
+    assert cache.used_bytes == 3 * SIZE
+
+
+def test_copies_in_use_are_not_evicted(cache, sources):
+    held = [{} for _ in range(3)]
+    for scene, name in zip(held, "abc"):
+        cache.acquire(scene, sources[name])
+    # No room while every copy is read: d is read in place, and tried again later
+    assert cache.acquire({}, sources["d"]) == sources["d"]
+    assert sources["d"] not in cache.skipped
+    cache.release(held[1])
+    assert os.path.dirname(cache.acquire({}, sources["d"])) == cache.directory
+    assert staged(cache) == ["a.mp4", "c.mp4", "d.mp4"]
+
+
+def test_file_larger_than_the_cap_is_read_in_place(cache, sources, monkeypatch):
+    monkeypatch.setattr(config, "staging_max_gb", SIZE / 2 / 1e9)
+    assert cache.acquire({}, sources["a"]) == sources["a"]
+    assert sources["a"] in cache.skipped
+    assert not cache.files
+
+
+def test_failed_copy_is_read_in_place(cache, sources, monkeypatch):
+    def copy(entry):
+        with open(entry.path + ".part", "wb") as f:
+            f.write(b"partial")
+        raise OSError("Input/output error")
+
+    monkeypatch.setattr(cache, "copy", copy)
+    assert cache.acquire({}, sources["a"]) == sources["a"]
+    assert sources["a"] in cache.skipped
+    assert cache.used_bytes == 0 and os.listdir(cache.directory) == []
+
+
+def test_files_on_the_scratch_disk_are_not_staged(cache, tmp_path):
+    local = tmp_path / "scratch" / "local.mp4"
+    local.write_bytes(b"x")
+    assert cache.acquire({}, str(local)) == str(local)
+    assert not cache.files
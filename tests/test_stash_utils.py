@@ -0,0 +1,66 @@
+# test_stash_utils.py
+
+import config
+from conftest import media_item
+from helpers import stash_utils
+from helpers.stash_utils import build_scene_filter, get_total_scene_count, http, size_http_pool
+
+
+def path_levels(scene_filter):
+    # The path criterion of each AND level, outermost first
+    levels = []
+    while scene_filter:
+        levels.append(scene_filter.get("path"))
+        scene_filter = scene_filter.get("AND")
+    return levels
+
+
+def test_filter_without_exclusions(monkeypatch):
+    monkeypatch.setattr(stash_utils, "excluded_paths", [])
+    scene_filter = build_scene_filter()
+    assert scene_filter["phash"] == {"value": "", "modifier": "IS_NULL"}
+    assert scene_filter["tags"] == {"value": [1, 2, 3], "modifier": "EXCLUDES"}
+    assert "path" not in scene_filter and "AND" not in scene_filter
+
+
+def test_one_exclusion_stays_at_the_top(monkeypatch):
+    monkeypatch.setattr(stash_utils, "excluded_paths", ["/media/trash"])
+    scene_filter = build_scene_filter()
+    assert scene_filter["path"] == {"value": "/media/trash", "modifier": "EXCLUDES"}
+    assert "AND" not in scene_filter
+
+
+def test_further_exclusions_nest_through_and(monkeypatch):
+    paths = ["/media/a", "/media/b", "/media/c"]
+    monkeypatch.setattr(stash_utils, "excluded_paths", paths)
+    scene_filter = build_scene_filter()
+    # Stash takes one path criterion per level, so each level holds exactly one
+    assert path_levels(scene_filter) == [{"value": path, "modifier": "EXCLUDES"} for path in paths]
+    assert set(scene_filter["AND"]) == {"path", "AND"}
+
+
+def test_stash_applies_every_exclusion(monkeypatch, fake_stash):
+    fake_stash.load([media_item(f"{name}.mp4") for name in ("keep", "skip_a", "skip_b", "skip_c", "also_keep")], "/media/")
+    monkeypatch.setattr(stash_utils, "excluded_paths", ["skip_a", "skip_b", "skip_c"])
+    assert get_total_scene_count(refresh=True) == 2
+
+
+def test_http_pool_follows_the_cli_settings(monkeypatch):
+    def pool_size():
+        return http.get_adapter(f"{config.stash_scheme}://{config.stash_host}")._pool_maxsize
+
+    monkeypatch.setattr(config, "max_workers", 12)
+    monkeypatch.setattr(config, "auto_concurrency", False)
+    monkeypatch.setattr(config, "engine", "threads")
+    size_http_pool()
+    assert pool_size() == 24
+    monkeypatch.setattr(config, "auto_concurrency", True)
+    monkeypatch.setattr(config, "auto_workers_max", 20)
+    size_http_pool()
+    assert pool_size() == 40
+    monkeypatch.setattr(config, "engine", "async")
+    monkeypatch.setattr(config, "async_max_scenes", 64)
+    size_http_pool()
+    assert pool_size() == 128
+    monkeypatch.undo()
+    size_http_pool()
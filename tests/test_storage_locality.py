@@ -0,0 +1,84 @@
+# test_storage_locality.py
+
+from contextlib import ExitStack
+
+import pytest
+
+import config
+from helpers.storage_locality import StorageLocality, volume_of
+
+
+@pytest.fixture(autouse=True)
+def volumes(monkeypatch):
+    monkeypatch.setattr(config, "translations", [
+        {"orig": "/data/nas/", "local": "/mnt/nas/"},
+        {"orig": "/data/fast/", "local": "/mnt/nas/fast/"},
+        {"orig": "/data/usb/", "local": "/mnt/usb/"},
+    ])
+    monkeypatch.setattr(config, "mount_read_limits", {"/mnt/nas/": 4})
+    monkeypatch.setattr(config, "mount_read_slots", 1)
+    monkeypatch.setattr(config, "staging_path", "")
+    monkeypatch.setattr(config, "interleave_mounts", True)
+
+
+def queued(*paths):
+    return [({"id": str(n), "files": [{"path": path, "size": 1000}]}, n, len(paths)) for n, path in enumerate(paths, start=1)]
+
+
+def test_volume_is_the_longest_translated_root():
+    assert volume_of("/mnt/nas/fast/a.mp4") == "/mnt/nas/fast"
+    assert volume_of("/mnt/nas/fastlane/a.mp4") == "/mnt/nas"
+    assert volume_of("/mnt/usb/a.mp4") == "/mnt/usb"
+
+
+def test_idle_volumes_keep_queue_order():
+    assert StorageLocality().choose(queued("/data/usb/1.mp4", "/data/nas/2.mp4")) == 0
+
+
+def test_prefers_a_volume_nobody_reads():
+    locality = StorageLocality()
+    items = queued("/data/usb/1.mp4", "/data/usb/2.mp4", "/data/nas/3.mp4", "/data/fast/4.mp4")
+    with locality.track(items[0][0]):
+        assert locality.choose(items[1:]) == 1
+
+
+def test_load_is_relative_to_the_read_limit():
+    locality = StorageLocality()
+    usb, nas, next_usb, next_nas = queued("/data/usb/1.mp4", "/data/nas/2.mp4", "/data/usb/3.mp4", "/data/nas/4.mp4")
+    with locality.track(usb[0]), locality.track(nas[0]):
+        # One reader on the NAS uses a quarter of its 4 slots, one on the USB disk all of its 1
+        assert locality.choose([next_usb, next_nas]) == 1
+
+
+def test_equal_load_keeps_queue_order():
+    locality = StorageLocality()
+    usb, nas, next_usb, next_nas = queued("/data/usb/1.mp4", "/data/nas/2.mp4", "/data/usb/3.mp4", "/data/nas/4.mp4")
+    with ExitStack() as tracked:
+        tracked.enter_context(locality.track(usb[0]))
+        for _ in range(4):
+            tracked.enter_context(locality.track(nas[0]))
+        # Both volumes at their read limit
+        assert locality.choose([next_usb, next_nas]) == 0
+
+
+def test_disabled_or_single_item(monkeypatch):
+    locality = StorageLocality()
+    items = queued("/data/usb/1.mp4", "/data/nas/2.mp4")
+    with locality.track(items[0][0]):
+        assert locality.choose(items[:1]) == 0
+        monkeypatch.setattr(config, "interleave_mounts", False)
+        assert locality.choose(items) == 0
+
+
+def test_track_counts_per_volume():
+    locality = StorageLocality()
+    items = queued("/data/usb/1.mp4", "/data/usb/2.mp4", "/data/nas/3.mp4")
+    with locality.track(items[0][0]) as volume:
+        assert volume == "/mnt/usb"
+        with locality.track(items[1][0]):
+            assert locality.active == {"/mnt/usb": 2}
+    with locality.track(items[2][0]):
+        pass
+    assert {volume: stats["scenes"] for volume, stats in locality.stats.items()} == {"/mnt/usb": 2, "/mnt/nas": 1}
+    assert locality.stats["/mnt/usb"]["bytes"] == 2000
+    assert not locality.busy_since
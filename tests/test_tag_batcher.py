@@ -0,0 +1,91 @@
+# test_tag_batcher.py
+
+import pytest
+
+from helpers import stash_utils
+from helpers.stash_utils import TagMutationBatcher
+
+
+class Calls(list):
+    """
+    Every bulk update as (tag, mode, scene ids); queued failures are raised first.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.failures = []
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = Calls()
+    failures = calls.failures
+
+    def update_scenes(update):
+        if failures:
+            raise failures.pop(0)
+        calls.append((update["tag_ids"]["ids"][0], update["tag_ids"]["mode"], update["ids"]))
+
+    monkeypatch.setattr(stash_utils.stash, "update_scenes", update_scenes)
+    return calls
+
+
+@pytest.fixture
+def batcher():
+    return TagMutationBatcher(flush_interval=0)
+
+
+def test_one_bulk_update_per_tag_and_mode(batcher, sent):
+    for scene_id in ("1", "2", "3"):
+        batcher.add([scene_id], 10, "REMOVE")
+    batcher.add(["2", "4"], 20, "ADD")
+    batcher.add(["1"], 10, "REMOVE")  # already pending, sent once
+    batcher.flush()
+    # ADDs go first so a scene never sits untagged between REMOVE and ADD
+    assert sent == [(20, "ADD", ["2", "4"]), (10, "REMOVE", ["1", "2", "3"])]
+
+
+def test_latest_change_per_scene_and_tag_wins(batcher, sent):
+    batcher.add(["1", "2"], 10, "ADD")
+    batcher.add(["1"], 10, "REMOVE")  # a claim and release in one window collapse to the release
+    batcher.add(["2"], 20, "REMOVE")  # another tag is unaffected
+    batcher.flush()
+    assert sent == [(10, "ADD", ["2"]), (10, "REMOVE", ["1"]), (20, "REMOVE", ["2"])]
+
+
+def test_nothing_pending_sends_nothing(batcher, sent):
+    batcher.add(["1"], 10, "ADD")
+    batcher.add(["1"], 10, "REMOVE")
+    batcher.add(["1"], 10, "ADD")
+    batcher.flush()
+    batcher.flush()
+    assert sent == [(10, "ADD", ["1"])]
+
+
+def test_failed_update_is_requeued(batcher, sent):
+    sent.failures.append(Exception("502 Bad Gateway query failed."))
+    batcher.add(["1", "2"], 10, "REMOVE")
+    batcher.flush()
+    assert sent == [] and batcher.pending == {(10, "REMOVE"): {"1": None, "2": None}}
+    batcher.flush()
+    assert sent == [(10, "REMOVE", ["1", "2"])]
+
+
+def test_requeue_keeps_newer_changes(batcher, sent, monkeypatch):
+    # A change queued while the failed update was in flight must not be overwritten
+    def update_scenes(update):
+        batcher.add(["1"], 10, "ADD")
+        raise Exception("502 Bad Gateway query failed.")
+
+    monkeypatch.setattr(stash_utils.stash, "update_scenes", update_scenes)
+    batcher.add(["1", "2"], 10, "REMOVE")
+    batcher.flush()
+    assert batcher.pending == {(10, "ADD"): {"1": None}, (10, "REMOVE"): {"2": None}}
+
+
+def test_flush_timer_sends_on_its_own(sent):
+    batcher = TagMutationBatcher(flush_interval=0.01)
+    batcher.add(["1"], 10, "ADD")
+    batcher.timer.join(1)
+    assert sent == [(10, "ADD", ["1"])]
+    assert batcher.timer is None
@@ -0,0 +1,142 @@
+# test_update_spool.py
+
+import json
+
+import pytest
+import requests
+
+from helpers.stash_utils import is_transport_error, stash
+from helpers.update_spool import UpdateSpool
+
+
+def stash_response(status, reason, body):
+    # A requests response as Stash sends it, for stashapi's own handling
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response._content = json.dumps(body).encode()
+    return response
+
+
+def stash_error(status, reason, body):
+    with pytest.raises(Exception) as raised:
+        stash._handle_GQL_response(stash_response(status, reason, body))
+    return raised.value
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as lines:
+        return [json.loads(line) for line in lines]
+
+
+@pytest.mark.parametrize("status, reason, body, transient", [
+    (502, "Bad Gateway", {}, True),
+    (503, "Service Unavailable", {}, True),
+    (429, "Too Many Requests", {}, True),
+    (200, "OK", {"data": None, "errors": [{"message": "database is locked"}]}, True),
+    (401, "Unauthorized", {}, False),
+    (422, "Unprocessable Entity", {"errors": [{"message": "Cannot query field \"bogus\""}]}, False),
+    (200, "OK", {"data": None, "errors": [{"message": "scene with id 7 not found"}]}, False),
+])
+def test_stashapi_errors(status, reason, body, transient):
+    error = stash_error(status, reason, body)
+    assert str(error).startswith(f"{status} {reason} query failed")
+    assert is_transport_error(error) is transient
+
+
+def test_connection_errors_are_transient():
+    assert is_transport_error(requests.exceptions.ConnectionError("Connection refused"))
+    assert is_transport_error(TimeoutError())
+    assert not is_transport_error(ValueError("Unsupported query"))
+
+
+def test_graphql_errors_are_kept():
+    error = stash_error(200, "OK", {"data": None, "errors": [{"message": "a"}, {"message": "b"}]})
+    assert str(error).endswith(" a; b")
+
+
+def make_spool(tmp_path, replay, **kwargs):
+    return UpdateSpool(str(tmp_path / "spool.jsonl"), replay, flush_interval=0.05, max_backoff=0.05,
+                       transient=is_transport_error, **kwargs)
+
+
+def test_replays_and_compacts(tmp_path):
+    sent = []
+
+    def replay(records, ack):
+        sent.extend(record['args']['n'] for record in records)
+        ack([record['seq'] for record in records])
+
+    spool = make_spool(tmp_path, replay)
+    for n in range(5):
+        spool.append("tag", n=n)
+    assert spool.drain(5) == 0
+    assert sorted(sent) == list(range(5))
+    # Nothing pending, so the journal starts over empty
+    assert read_lines(spool.path) == []
+
+
+def test_unacknowledged_records_survive_a_restart(tmp_path):
+    path = tmp_path / "spool.jsonl"
+    path.write_text("\n".join(json.dumps(entry) for entry in [
+        {"seq": 1, "op": "phash", "args": {"n": 1}},
+        {"seq": 2, "op": "tag", "args": {"n": 2}},
+        {"ack": [1]},
+        {"seq": 3, "op": "cover", "args": {"n": 3}},
+    ]) + '\n{"seq": 4, "op"')  # torn last line
+    replayed = []
+
+    def replay(records, ack):
+        replayed.extend(record['seq'] for record in records)
+        ack([record['seq'] for record in records])
+
+    spool = make_spool(tmp_path, replay)
+    assert spool.drain(5) == 0
+    assert replayed == [2, 3]
+    spool.append("tag", n=5)
+    assert spool.drain(5) == 0
+    assert replayed[-1] == 4  # numbering carries on after the highest journaled seq
+
+
+def test_rejected_record_is_bisected_out_and_dead_lettered(tmp_path):
+    bad = stash_error(200, "OK", {"data": None, "errors": [{"message": "scene with id 7 not found"}]})
+    sent, batches = [], []
+
+    def replay(records, ack):
+        batches.append(len(records))
+        for record in records:
+            if record['args']['n'] == 7:
+                raise bad
+            sent.append(record['args']['n'])
+            ack([record['seq']])
+
+    spool = make_spool(tmp_path, replay)
+    with spool.condition:
+        # Queue everything before the flusher wakes up, so it sees one batch
+        for n in range(10):
+            spool.append("tag", n=n)
+    assert spool.drain(5) == 0
+    assert sorted(sent) == [n for n in range(10) if n != 7]
+    assert len(batches) > 1
+    dead = read_lines(spool.dead_letter_path)
+    assert [entry['args']['n'] for entry in dead] == [7]
+    assert "scene with id 7 not found" in dead[0]['error']
+
+
+def test_transport_errors_are_retried(tmp_path):
+    down = [stash_error(502, "Bad Gateway", {}),
+            stash_error(200, "OK", {"data": None, "errors": [{"message": "database is locked"}]})]
+    sent = []
+
+    def replay(records, ack):
+        if down:
+            raise down.pop(0)
+        sent.extend(record['args']['n'] for record in records)
+        ack([record['seq'] for record in records])
+
+    spool = make_spool(tmp_path, replay)
+    for n in range(3):
+        spool.append("phash", n=n)
+    assert spool.drain(5) == 0
+    assert sorted(sent) == [0, 1, 2]
+    assert not (tmp_path / "spool.failed.jsonl").exists()